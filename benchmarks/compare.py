@@ -0,0 +1,74 @@
+"""
+Compara dois resultados de benchmarks.run e aponta as regressões.
+
+    python -m benchmarks.compare antes.json depois.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+
+# Métricas comparadas: (campo, maior é melhor)
+METRICS = [
+    ("median_ms", False),
+    ("p95_ms", False),
+    ("peak_rss_mb", False),
+    ("requests_per_s", True),
+]
+
+
+def _index(report):
+    return {(result["name"], result.get("kind"), result.get("extent")): result for result in report["results"]}
+
+
+def compare(base, new, threshold=0.1):
+    """
+    Variação relativa de cada métrica presente nos dois resultados. Uma
+    regressão é uma piora maior que `threshold`.
+    """
+    base_results, new_results = _index(base), _index(new)
+    rows = []
+    for key in base_results.keys() & new_results.keys():
+        for metric, higher_is_better in METRICS:
+            before, after = base_results[key].get(metric), new_results[key].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            rows.append({
+                "name": key[0], "kind": key[1], "metric": metric,
+                "before": before, "after": after, "change": change, "regression": worse > threshold,
+            })
+    return sorted(rows, key=lambda row: (row["kind"] or "", row["name"], row["metric"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara dois resultados de benchmark.")
+    parser.add_argument("base", help="Resultado de referência.")
+    parser.add_argument("new", help="Resultado novo.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Piora relativa considerada regressão (0.1 = 10%%).")
+    args = parser.parse_args()
+
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+
+    for report, label in [(base, "antes"), (new, "depois")]:
+        meta = report["meta"]
+        print(f"{label}: {meta.get('revision')} {meta.get('created_at')} ({meta.get('cpus')} cpus)")
+
+    rows = compare(base, new, args.threshold)
+    for row in rows:
+        flag = "REGRESSÃO" if row["regression"] else ""
+        print(
+            f"{row['kind'] or '':<12} {row['name']:<24} {row['metric']:<15}"
+            f" {row['before']:>10} {row['after']:>10} {row['change']:>+8.1%} {flag}"
+        )
+
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(regressions)} regressões acima de {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Arquivos NetCDF sintéticos, nos mesmos diretórios e nomes de
+path_utils.gen_path_template, para cada kind.
+
+    python -m benchmarks.fixtures /tmp/moonpng-bench [--scale 0.5]
+"""
+import argparse
+import hashlib
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import utils.paths as path_utils
+
+# Produto de cada kind: grade (lon_min, lon_max, lat_min, lat_max, resolução),
+# horários por arquivo e quantidade de arquivos. As grades seguem as dos dados
+# reais (modelos a 0,1-0,25°, satélite a 0,02°, radar a 0,01°).
+PRODUCTS = {
+    "observed": {
+        "model": "ct_observed_as", "variable": "2m_air_temperature",
+        "grid": (-85, -20, -60, 15, 0.1), "steps": 1, "files": 10,
+    },
+    "forecast": {
+        "model": "ecmwf_as", "variable": "2m_air_temperature",
+        "grid": (-85, -20, -60, 15, 0.1), "steps": 24, "files": 3,
+    },
+    "seasonal": {
+        "model": "cfs_glo", "variable": "total_precipitation",
+        "grid": (-180, 180, -90, 90, 0.5), "steps": 1, "files": 10,
+    },
+    "reanalysis": {
+        "model": "cfs_glo", "variable": "2m_air_temperature",
+        "grid": (-180, 180, -90, 90, 0.25), "steps": 4, "files": 5,
+    },
+    "climatology": {
+        "model": "era5_glo", "variable": "2m_air_temperature",
+        "grid": (-180, 180, -90, 90, 0.25), "steps": 1, "files": 5,
+    },
+    "satellite": {
+        "model": "abi-goes16", "variable": "brightness_temperature",
+        "grid": (-75, -32, -34, 5.3, 0.02), "steps": 1, "files": 12,
+    },
+    "radar": {
+        "model": "ct_observed_as", "variable": "reflectivity",
+        "grid": (-54, -42, -25.8, -19, 0.01), "steps": 1, "files": 12,
+    },
+}
+
+MEMBER = "M000"
+START = pd.Timestamp("2025-06-01")
+SEED = 20250601
+
+# Máscara sintética (um retângulo dentro de SP), gravada onde mask_utils procura
+MASK_NAME = "bench_sp"
+MASK_POLYGON = [[-53, -25], [-44, -25], [-44, -20], [-53, -20], [-53, -25]]
+
+
+def get_times(kind):
+    """
+    Horário de cada arquivo, na frequência de gen_path_template.
+    """
+    product = PRODUCTS[kind]
+    _, freq = path_utils.gen_path_template(_params(kind, "."))
+    return pd.date_range(START, periods=product["files"], freq=freq)
+
+
+def _params(kind, source):
+    product = PRODUCTS[kind]
+    return SimpleNamespace(
+        source=source, kind=kind, model=product["model"], variable=product["variable"], member=MEMBER
+    )
+
+
+def get_grid(kind, scale=1.0):
+    lon_min, lon_max, lat_min, lat_max, resolution = PRODUCTS[kind]["grid"]
+    resolution = resolution / scale
+    lons = np.arange(lon_min, lon_max, resolution)
+    lats = np.arange(lat_min, lat_max, resolution)
+    return lons, lats
+
+
+def _field(lons, lats, time, rng):
+    """
+    Campo suave com ruído, variando com o tempo, em float32.
+    """
+    phase = time.dayofyear + time.hour / 24 + time.minute / 1440
+    x, y = np.meshgrid(np.radians(lons), np.radians(lats))
+    smooth = 20 + 8 * np.sin(3 * x + phase) * np.cos(2 * y) + 4 * np.cos(7 * x - phase) * np.sin(5 * y)
+    noise = rng.standard_normal(smooth.shape)
+    return (smooth + noise).astype("float32")
+
+
+def write_file(path, variable, lons, lats, times, rng, compress=True):
+    data = np.stack([_field(lons, lats, time, rng) for time in times])
+    dataset = xr.Dataset(
+        {variable: (("time", "latitude", "longitude"), data)},
+        coords={"time": times, "latitude": lats, "longitude": lons},
+    )
+    encoding = {}
+    if compress:
+        encoding[variable] = {
+            "zlib": True,
+            "complevel": 4,
+            "chunksizes": (1, min(len(lats), 512), min(len(lons), 512)),
+        }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    dataset.to_netcdf(temp_path, engine="netcdf4", encoding=encoding)
+    os.replace(temp_path, path)
+
+
+def write_mask(root):
+    path = os.path.join(root, "data", "cmaps", "geojsons", f"{MASK_NAME}.geojson")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump({
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "properties": {"name": MASK_NAME},
+                "geometry": {"type": "Polygon", "coordinates": [MASK_POLYGON]},
+            }],
+        }, file)
+
+
+def generate(root, kinds=None, scale=1.0, compress=True):
+    """
+    Gera os arquivos de cada kind em `root` (pulando os que já existem com a
+    mesma especificação) e retorna o manifesto com os parâmetros de cada
+    produto.
+    """
+    kinds = kinds or list(PRODUCTS)
+    spec = {"products": {kind: PRODUCTS[kind] for kind in kinds}, "scale": scale, "compress": compress, "seed": SEED}
+    spec_hash = hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:12]
+
+    manifest_path = os.path.join(root, "manifest.json")
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest["spec"] == spec_hash:
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+
+    products = {}
+    for kind in kinds:
+        product = PRODUCTS[kind]
+        lons, lats = get_grid(kind, scale)
+        path_template, freq = path_utils.gen_path_template(_params(kind, root))
+        rng = np.random.default_rng(SEED)
+        times = get_times(kind)
+
+        for time in times:
+            steps = pd.date_range(time, periods=product["steps"], freq=pd.Timedelta(freq) / product["steps"])
+            write_file(time.strftime(path_template), product["variable"], lons, lats, steps, rng, compress)
+
+        products[kind] = {
+            "params": {
+                "kind": kind,
+                "model": product["model"],
+                "variable": product["variable"],
+                "member": MEMBER,
+                "source": root,
+                "date": times[0].isoformat(),
+                "initDate": times[0].isoformat(),
+                "endDate": times[-1].isoformat(),
+            },
+            "grid": [len(lats), len(lons)],
+            "files": len(times),
+            "steps": product["steps"],
+        }
+
+    write_mask(root)
+    manifest = {"spec": spec_hash, "scale": scale, "compress": compress, "products": products}
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera os NetCDF sintéticos dos benchmarks.")
+    parser.add_argument("root", help="Diretório raiz (o `source` dos parâmetros).")
+    parser.add_argument("--kinds", help="Kinds separados por vírgula (padrão: todos).")
+    parser.add_argument("--scale", type=float, default=1.0, help="Fator da resolução das grades (0.5: metade dos pontos por eixo).")
+    parser.add_argument("--no-compress", action="store_true", help="Grava sem compressão zlib.")
+    args = parser.parse_args()
+
+    kinds = args.kinds.split(",") if args.kinds else None
+    manifest = generate(os.path.abspath(args.root), kinds, args.scale, not args.no_compress)
+    for kind, product in manifest["products"].items():
+        print(kind, product["grid"], product["files"], "arquivos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Benchmarks das etapas do pipeline e das requisições /moonpng (GET e POST)
+sobre os NetCDF sintéticos de benchmarks.fixtures. Mede latência,
+throughput e pico de RSS e grava um JSON comparável com
+benchmarks.compare.
+
+    python -m benchmarks.run --data /tmp/moonpng-bench --output antes.json
+"""
+import os
+import tempfile
+
+# Sem cache em disco nem reaproveitamento do resultado do single-flight, para
+# que as medições "frias" renderizem de fato (pode ser sobrescrito pelo ambiente)
+os.environ.setdefault("MOONPNG_CACHE_DIR", "")
+os.environ.setdefault("MOONPNG_SINGLEFLIGHT_RESULT_TTL", "0")
+os.environ.setdefault("MOONPNG_SINGLEFLIGHT_DIR", tempfile.mkdtemp(prefix="moonpng-bench-sf-"))
+# Sem aquecimento: ele encheria de novo os caches que as medições "frias" esvaziam
+os.environ.setdefault("MOONPNG_WARMUP_ENABLED", "0")
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+from PIL import Image
+
+import benchmarks.fixtures as fixtures
+import utils.aggregations as aggregations
+import utils.assets as assets
+import utils.cache as cache
+import utils.catalog as catalog
+import utils.encode as encode
+import utils.executor as render_executor
+import utils.features as features_utils
+import utils.mask as mask_utils
+import utils.netcdf as nc_utils
+import utils.paths as path_utils
+import utils.plot as plot_utils
+import utils.render as render_utils
+from models.params import MoonPngParams
+from utils.bounding_box import get_bbox
+
+# Recortes das requisições de throughput (chaves de cache distintas)
+THROUGHPUT_EXTENTS = ["SP", "RJ", "MG", "PR", "SC", "RS", "GO", "BA"]
+
+
+def _status_kb(field, pid="self"):
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak(pid="self"):
+    """
+    Zera o pico de RSS (VmHWM) do processo, quando o kernel permite.
+    """
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(pid="self"):
+    peak = _status_kb("VmHWM:", pid)
+    if peak is None:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024, 1)
+
+
+def _worker_pids():
+    # sem criar o pool: nas etapas tudo roda no próprio processo
+    processes = getattr(render_executor._executor, "_processes", None) or {}
+    return list(processes)
+
+
+def flush_caches():
+    """
+    Esvazia os caches deste processo: imagens, datasets abertos e janelas,
+    máscaras, camadas do mapa base, geometrias do acervo e registro de
+    assets.
+    """
+    cache.clear()
+    nc_utils.clear_pool()
+    mask_utils.clear()
+    plot_utils.get_basemap_layers.cache_clear()
+    features_utils._load.cache_clear()
+    assets.clear()
+
+
+def reset_cold():
+    """
+    Antes de cada medição "fria": esvazia os caches deste processo e, com o
+    pool de processos, recria os renderizadores, que guardam os próprios.
+    """
+    flush_caches()
+    if render_executor.get_executor() is not None and not render_executor.in_process():
+        render_executor.shutdown()
+        render_executor.start()
+
+
+def _summary(times):
+    times = sorted(times)
+    return {
+        "n": len(times),
+        "min_ms": round(times[0], 2),
+        "median_ms": round(statistics.median(times), 2),
+        "p95_ms": round(times[min(len(times) - 1, int(round(0.95 * (len(times) - 1))))], 2),
+        "mean_ms": round(statistics.fmean(times), 2),
+        "max_ms": round(times[-1], 2),
+    }
+
+
+def measure(name, fn, repeat, before=None, **info):
+    """
+    Executa `fn` `repeat` vezes e resume latência (a primeira execução fica
+    separada em first_ms) e pico de RSS do processo e dos renderizadores.
+    """
+    pids = _worker_pids()
+    for pid in ["self", *pids]:
+        reset_peak(pid)
+
+    times = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+
+    result = {
+        "name": name,
+        **info,
+        "first_ms": round(times[0], 2),
+        **_summary(times),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if pids:
+        result["worker_peak_rss_mb"] = max(peak_rss_mb(pid) for pid in pids)
+    print(f"{name:<24} {info.get('kind', ''):<12} mediana {result['median_ms']:>10} ms  pico {result['peak_rss_mb']} MB", flush=True)
+    return result
+
+
+def get_params(product, extent, **extra):
+    return MoonPngParams(**{**product["params"], "contourf": True, "aggregation": "mean", "extent": extent, **extra})
+
+
+def bench_stages(kind, product, extent, repeat):
+    params = get_params(product, extent)
+    info = {"kind": kind, "extent": extent, "grid": product["grid"], "files": product["files"]}
+    bbox = get_bbox(params)
+
+    def paths():
+        path_template, freq = path_utils.gen_path_template(params)
+        return path_utils.run_validate(list(path_utils.get_paths(params, path_template, freq)), params.variable)
+
+    validated_paths = paths()
+    path_template, freq = path_utils.gen_path_template(params)
+    catalog.get_paths(params, path_template, freq)
+    cube = nc_utils.get_data(validated_paths, params.variable, extent=bbox).load()
+    field = aggregations.apply(cube, params).load()
+    layer = render_utils.load_layer(params, validated_paths)
+    masked = params.model_copy(update={"mask": fixtures.MASK_NAME})
+
+    results = [
+        measure("paths", paths, repeat, **info),
+        measure("catalog_paths", lambda: catalog.get_paths(params, path_template, freq), repeat, **info),
+        measure("open", lambda: nc_utils.get_data(validated_paths, params.variable, extent=bbox), repeat, **info),
+        measure("read", lambda: nc_utils.get_data(validated_paths, params.variable, extent=bbox).values, repeat, **info),
+        measure("apply", lambda: aggregations.apply(cube, params).values, repeat, **info),
+        measure("aggregate", lambda: aggregations.aggregate(validated_paths, params, extent=bbox).values, repeat, **info),
+        measure("mask", lambda: mask_utils.get_masked_data(field, fixtures.MASK_NAME, extent=bbox, pad=1), repeat, **info),
+        measure("prepare", lambda: render_utils.load_layer(params, validated_paths), repeat, **info),
+        measure("draw", lambda: render_utils.draw_layer(params, layer, "png"), repeat, **info),
+        measure("render_png", lambda: render_utils.render_png(params, validated_paths, "png"), repeat, **info),
+        measure("render_png_mask", lambda: render_utils.render_png(masked, validated_paths, "png"), repeat, **info),
+        measure("render_raster", lambda: render_utils.render_raster(params.model_copy(update={"renderer": "raster"}), validated_paths, "png"), repeat, **info),
+    ]
+
+    image = Image.open(BytesIO(render_utils.draw_layer(params, layer, "png")))
+    image.load()
+    for profile in encode.PROFILES:
+        if encode.is_supported(profile):
+            results.append(measure(f"encode_{profile}", lambda: encode.encode_image(image, profile), repeat, **info))
+    return results
+
+
+def bench_requests(client, kind, product, extent, repeat, concurrency):
+    params = get_params(product, extent)
+    query = {key: value for key, value in params.model_dump().items() if value is not None and not isinstance(value, (dict, list))}
+    layers = [
+        params.model_dump(),
+        {**params.model_dump(), "contourf": False, "contour": True, "aggregation": "max"},
+    ]
+    info = {"kind": kind, "extent": extent, "grid": product["grid"], "files": product["files"]}
+
+    def get():
+        response = client.get("/moonpng", params=query)
+        assert response.status_code == 200, response.text
+        return response
+
+    def post():
+        response = client.post("/moonpng", json=layers)
+        assert response.status_code == 200, response.text
+
+    etag = get().headers.get("etag", "")
+
+    def not_modified():
+        response = client.get("/moonpng", params=query, headers={"If-None-Match": etag})
+        assert response.status_code == 304, response.status_code
+
+    results = [
+        measure("get_cold", get, repeat, before=reset_cold, **info),
+        measure("get_warm", get, repeat, **info),
+        measure("get_304", not_modified, repeat, **info),
+        measure("post_cold", post, repeat, before=reset_cold, **info),
+        measure("post_warm", post, repeat, **info),
+    ]
+
+    # throughput: recortes distintos, cache vazio, `concurrency` clientes
+    queries = [{**query, "extent": name} for name in THROUGHPUT_EXTENTS] * max(repeat // 2, 1)
+    reset_cold()
+    latencies = []
+
+    def timed(q):
+        started = time.perf_counter()
+        response = client.get("/moonpng", params=q)
+        latencies.append((time.perf_counter() - started) * 1000)
+        return response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        statuses = list(pool.map(timed, queries))
+    elapsed = time.perf_counter() - started
+    result = {
+        "name": "get_throughput",
+        **info,
+        "concurrency": concurrency,
+        "errors": sum(status != 200 for status in statuses),
+        "requests_per_s": round(len(queries) / elapsed, 2),
+        **_summary(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"{'get_throughput':<24} {kind:<12} {result['requests_per_s']} req/s", flush=True)
+    results.append(result)
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do MoonPNG sobre dados sintéticos.")
+    parser.add_argument("--data", default="/tmp/moonpng-bench", help="Diretório dos dados sintéticos (gerados se preciso).")
+    parser.add_argument("--output", default=f"moonpng-bench-{datetime.now():%Y%m%d-%H%M%S}.json", help="Arquivo JSON de resultados.")
+    parser.add_argument("--kinds", help="Kinds separados por vírgula (padrão: todos).")
+    parser.add_argument("--scale", type=float, default=1.0, help="Fator da resolução das grades sintéticas.")
+    parser.add_argument("--extent", default="SP", help="Recorte usado nas medições.")
+    parser.add_argument("--repeat", type=int, default=5, help="Execuções por medição.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clientes simultâneos no teste de throughput.")
+    parser.add_argument("--skip-stages", action="store_true", help="Só as requisições.")
+    parser.add_argument("--skip-requests", action="store_true", help="Só as etapas.")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    data = os.path.abspath(args.data)
+    kinds = args.kinds.split(",") if args.kinds else None
+
+    started = time.perf_counter()
+    manifest = fixtures.generate(data, kinds, args.scale)
+    print(f"dados prontos em {time.perf_counter() - started:.1f} s", flush=True)
+
+    # a máscara sintética fica em {data}/data/cmaps/geojsons, caminho relativo
+    # usado por mask_utils
+    os.chdir(data)
+
+    results = []
+    products = {kind: manifest["products"][kind] for kind in (kinds or manifest["products"])}
+    if not args.skip_stages:
+        for kind, product in products.items():
+            results.extend(bench_stages(kind, product, args.extent, args.repeat))
+
+    if not args.skip_requests:
+        from fastapi.testclient import TestClient
+
+        import main as app_main
+
+        with TestClient(app_main.app) as client:
+            for kind, product in products.items():
+                results.extend(bench_requests(client, kind, product, args.extent, args.repeat, args.concurrency))
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "peak_rss_reset": reset_peak(),
+            "args": vars(args),
+            "fixtures": {"scale": manifest["scale"], "compress": manifest["compress"], "spec": manifest["spec"]},
+            "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith("MOONPNG_")},
+        },
+        "results": results,
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"resultados em {output}")
+
+
+if __name__ == "__main__":
+    main()
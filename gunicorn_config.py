@@ -1,6 +1,9 @@
 # gunicorn_config.py
 
 import multiprocessing
+import os
+
+import utils.logger as logger_utils
 
 # App: main.py com objeto `app`
 bind = "0.0.0.0:8000"
@@ -11,6 +14,15 @@ workers = 4  # ou: multiprocessing.cpu_count()
 # Tipo de worker para FastAPI (ASGI)
 worker_class = "uvicorn.workers.UvicornWorker"
 
+# Importa e aquece a aplicação uma única vez no master (MOONPNG_PRELOAD=1):
+# os workers nascem por fork já prontos, compartilham a memória
+# (copy-on-write) e renderizam eles mesmos, em threads (ver utils/executor.py)
+preload_app = os.environ.get("MOONPNG_PRELOAD", "0") == "1"
+
+if preload_app:
+    # o master não sobe threads antes do fork: a de log sobe em post_fork
+    logger_utils.defer()
+
 # Tempo máximo de resposta (em segundos)
 timeout = 90
 
@@ -28,3 +40,25 @@ proc_name = "moonpng-api"
 
 # Recomendado se você usa root_path ou reverse proxy
 # root_path = "/api"
+
+
+def on_starting(server):
+    # métricas de execuções anteriores (ver utils/metrics.py)
+    import utils.metrics as metrics
+
+    metrics.reset()
+
+
+def when_ready(server):
+    # com preload_app, aquece no master antes do fork dos workers
+    if preload_app:
+        import utils.executor as render_executor
+        import utils.warmup as warmup
+
+        render_executor.set_preloaded()
+        warmup.warm()
+        logger_utils.flush()
+
+
+def post_fork(server, worker):
+    logger_utils.start()
@@ -1,24 +1,35 @@
+import time
+
+_import_started = time.perf_counter()
+
 from fastapi import Depends, FastAPI, HTTPException, Request, Body, Query
-from fastapi.responses import StreamingResponse
-import matplotlib.pyplot as plt
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from io import BytesIO
 from models.params import MoonPngParams, get_params
-import utils.netcdf as nc_utils
 import utils.paths as path_utils
-import utils.plot as plot_utils
-import utils.aggregations as aggregations
-from utils.levels import get_levels
-from utils.bounding_box import BBOX_DB, set_extent, get_bbox
-import utils.mask as mask_utils
-import utils.colorbar as colorbar_utils
-import time
+import utils.cache as cache
+import utils.catalog as catalog
+import utils.executor as render_executor
+import utils.encode as encode
+import utils.http_cache as http_cache
+import utils.stream as stream
+import utils.prewarm as prewarm
+import utils.metrics as metrics
+import utils.profiler as profiler
+import utils.warmup as warmup
+import asyncio
+import os
+import tempfile
 from utils.logger import get_logger
-from utils.profiler import profile_block
 from fastapi.middleware.cors import CORSMiddleware
-from collections import defaultdict
-import cartopy.crs as ccrs
-import numpy as np
-import cartopy.feature as cfeature
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+# Os módulos que importam matplotlib, cartopy e xarray (render, animation,
+# tiles, fanout, assets) são importados nas rotas que os usam, e as funções
+# de renderização vão para o pool pelo nome: o worker que só encaminha as
+# renderizações para o pool não carrega nada disso.
 
 logger = get_logger()
 
@@ -33,8 +44,42 @@ app.add_middleware(
 )
 logger.info("Starting MoonPNG API")
 
+
+@app.on_event("startup")
+def warm_up():
+    # só onde se renderiza: os processos do pool se aquecem sozinhos, e os
+    # workers criados por fork de um master já aquecido (preload_app) herdam
+    if render_executor.in_process():
+        warmup.warm()
+
+
+@app.on_event("startup")
+def start_catalog():
+    catalog.start()
+
+
+@app.on_event("startup")
+def start_render_executor():
+    render_executor.start()
+
+
+@app.on_event("startup")
+def start_prewarm():
+    prewarm.start()
+
+
+@app.on_event("shutdown")
+def stop_render_executor():
+    render_executor.shutdown()
+
+
+_first_request = True
+
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
+    global _first_request
+
     start_time = time.time()
 
     log_data = {
@@ -55,209 +100,277 @@ async def log_requests(request: Request, call_next):
         duration = (time.time() - start_time) * 1000
         log_data["duration_ms"] = round(duration, 2)
         logger.info(log_data)
+        if _first_request:
+            _first_request = False
+            logger.info({"message": "primeira requisição", "pid": os.getpid(), "endpoint": request.url.path, "duration_ms": log_data["duration_ms"]})
+        # rota com os parâmetros de caminho ({z}, {x}...), não a URL
+        route = request.scope.get("route")
+        metrics.observe(
+            "moonpng_request_duration_seconds",
+            duration / 1000,
+            endpoint=route.path if route is not None else "unmatched",
+            method=request.method,
+            status=log_data["status_code"],
+        )
 
     return response
 
-def get_image(params: MoonPngParams):
+def prepare(params_list: list[MoonPngParams], profile: str):
     """
-    Gera uma imagem a partir dos parâmetros fornecidos.
+    Resolve os arquivos de cada camada, a chave do cache e a data de
+    modificação das entradas, sem abrir nenhum NetCDF.
     """
-    path_template, freq = path_utils.gen_path_template(params)
-    raw_paths = path_utils.get_paths(params, path_template, freq)
-    validated_paths = nc_utils.run_validate(raw_paths, params.variable)
-    dataset = nc_utils.get_data(validated_paths, params.variable)
-    dataset = dataset.mean(dim="time")
-    lons = dataset.longitude.values
-    lats = dataset.latitude.values
-    data = dataset.values
-    figure, ax = plot_utils.plot(params, lons, lats, data)
-
-    image = BytesIO()
-
-    figure.savefig(
-        image,
-        format="png",
-        dpi=params.dpi,
-        pad_inches=0,
-        bbox_inches="tight",
-    )
-    image.seek(0)
-    
-    #image = plot_utils.compress_image(image)
-    return figure, ax, image, figure, dataset
-
-def get_image_profiler(params: MoonPngParams):
-    with profile_block("geração da imagem"):
-
-        path_template, freq = path_utils.gen_path_template(params)
-
-        with profile_block("gerar caminhos"):
-            raw_paths = path_utils.get_paths(params, path_template, freq)
-
-        with profile_block("validar caminhos"):
-            validated_paths = nc_utils.run_validate(raw_paths, params.variable)
-
-        with profile_block("carregar dataset"):
-            dataset = nc_utils.get_data(validated_paths, params.variable)
-            dataset = dataset.mean(dim="time")
-
-        with profile_block("plotar figura"):
-            figure = plot_utils.plot(
-                params, 
-                dataset.longitude.values, 
-                dataset.latitude.values, 
-                dataset.values
-            )
-
-        with profile_block("gerar PNG"):
-            image = BytesIO()
-
-            figure.savefig(
-                image,
-                format="png",
-                dpi=params.dpi,
-                pad_inches=0,
-                bbox_inches="tight",
-            )
-            image.seek(0)
-            
-            #image = plot_utils.compress_image(image)
-    return image, figure, dataset
+    if len(params_list) > 1:
+        with ThreadPoolExecutor(max_workers=min(render_executor.LAYER_WORKERS, len(params_list))) as pool:
+            paths_list = list(pool.map(path_utils.get_validated_paths, params_list))
+    else:
+        paths_list = [path_utils.get_validated_paths(params) for params in params_list]
+    key = cache.make_key(list(zip(params_list, paths_list)), profile)
+    last_modified = http_cache.get_last_modified(paths_list)
+    return paths_list, key, last_modified
+
+
+def image_headers(params_list: list[MoonPngParams], key, last_modified):
+    headers = http_cache.get_headers(key, last_modified, [params.kind for params in params_list])
+    # a resposta muda com o Accept quando há formatos negociados
+    if encode.ENCODE_ACCEPT:
+        headers["Vary"] = "Accept"
+    return headers
+
+
+def validate_layers(params_list: list[MoonPngParams]):
+    if len(params_list) > 1 and any(params.renderer == "raster" for params in params_list):
+        raise HTTPException(
+            status_code=400,
+            detail="O renderizador 'raster' só suporta uma camada.",
+        )
+
+
+def render_post(params_list: list[MoonPngParams], paths_list: list[list], profile: str) -> bytes:
+    """
+    Prepara as camadas em paralelo no pool de renderização (no máximo
+    LAYER_WORKERS por vez) e desenha todas juntas numa única tarefa.
+    """
+    if len(params_list) == 1 or render_executor.get_executor() is None:
+        return render_executor.run("utils.render:render_png_post", params_list, paths_list, profile)
+
+    with ThreadPoolExecutor(max_workers=min(render_executor.LAYER_WORKERS, len(params_list))) as pool:
+        layers = list(pool.map(partial(render_executor.run, "utils.render:load_layer"), params_list, paths_list))
+    return render_executor.run("utils.render:draw_layers", params_list, layers, profile)
+
+
+async def get_or_render(key, render) -> bytes:
+    """
+    Acertos no cache em memória saem direto do event loop; o resto roda fora
+    dele, com a renderização no pool dedicado.
+    """
+    image = cache.peek(key)
+    if image is None:
+        image = await run_in_threadpool(cache.render_cached, key, render)
+    return image
+
+
+async def profile_response(mode, render):
+    """
+    Renderiza sem cache, no próprio processo, e responde com o relatório do
+    perfil no lugar da imagem.
+    """
+    content, media_type = await run_in_threadpool(profiler.run, mode, render)
+    if media_type == "application/json":
+        return content
+    return Response(content, media_type=media_type, headers={"Cache-Control": "no-store"})
+
 
 @app.get("/moonpng", summary="obter dados meteorológicos")
-def moonpng(params: MoonPngParams = Query(...)): # Depends(get_params)
-    figure = plt.figure(figsize=(15, 20))
-    ax = plt.axes(projection=ccrs.PlateCarree())
-    try:
-        path_template, freq = path_utils.gen_path_template(params)
-        raw_paths = path_utils.get_paths(params, path_template, freq)
-        validated_paths = nc_utils.run_validate(raw_paths, params.variable)
-        dataset = nc_utils.get_data(validated_paths, params.variable)
-
-        extent = get_bbox(params)
-        if extent:
-            dataset = dataset.sel(
-                longitude=slice(extent[0], extent[1]),
-                latitude=slice(extent[2], extent[3]),
-            )
-            ax.set_extent(extent, crs=ccrs.PlateCarree())
-
-        dataset = aggregations.apply(dataset, params)
-        lons, lats = np.meshgrid(dataset.longitude.values, dataset.latitude.values)
-
-        if params.mask:
-            data, lons, lats, extent = mask_utils.get_masked_data(dataset, params.mask, extent=extent, pad=1)
-        else:
-            data = dataset.values
-
-        levels = get_levels(params)
-
-        if params.contourf:
-            cbar = ax.contourf(lons, lats, data, transform=ccrs.PlateCarree(), levels=levels)
-            colorbar_utils
-            plt.colorbar(
-                cbar, 
-                ax=ax, 
-                orientation="horizontal",
-                pad=0.05, 
-                aspect=50, 
-                label=params.variable
-            )
-
-        elif params.contour:
-            ax.contour(lons, lats, data, colors=params.color, linewidths=params.linewidths, levels=levels, zorder=params.zorder, transform=ccrs.PlateCarree())
-
-        if params.details:
-            plot_utils.draw_details(ax, params)
-        
-        if params.gridlines:
-            plot_utils.draw_gridlines(ax, params)
-        image = BytesIO()
-
-        figure.savefig(
-            image,
-            format="png",
-            dpi=params.dpi,
-            pad_inches=0,
-            bbox_inches="tight",
-        )
-        image.seek(0)
-        
-        #image = plot_utils.compress_image(image)
-        return StreamingResponse(image, media_type="image/png")
+async def moonpng(request: Request, params: MoonPngParams = Query(...)): # Depends(get_params)
+    profile = encode.negotiate(request.headers.get("accept"))
+    profile_mode = profiler.get_mode(request)
+    (validated_paths,), key, last_modified = await run_in_threadpool(prepare, [params], profile)
+    render = "utils.render:render_raster" if params.renderer == "raster" else "utils.render:render_png"
+    if profile_mode is not None:
+        return await profile_response(profile_mode, partial(render_executor.resolve(render), params, validated_paths, profile))
 
-    finally:
-        if dataset is not None:
-            nc_utils.close_and_destroy(dataset)
-        if figure is not None:
-            plt.close(figure)
+    headers = image_headers([params], key, last_modified)
+    if http_cache.is_not_modified(request, key, last_modified):
+        return Response(status_code=304, headers=headers)
 
+    image = await get_or_render(key, partial(render_executor.run, render, params, validated_paths, profile))
+
+    return StreamingResponse(BytesIO(image), media_type=encode.MEDIA_TYPES[profile], headers=headers)
 
 
 @app.post(
     "/moonpng", summary="Obter dados meteorológicos para múltiplas variáveis via POST"
 )
-def moonpng_post(params_list: list[MoonPngParams] = Body(...)): # Depends(get_params)
-    figure = plt.figure(figsize=(15, 20))
-    ax = plt.axes(projection=ccrs.PlateCarree())
-    for params in params_list:
-        path_template, freq = path_utils.gen_path_template(params)
-        raw_paths = path_utils.get_paths(params, path_template, freq)
-        validated_paths = nc_utils.run_validate(raw_paths, params.variable)
-        dataset = nc_utils.get_data(validated_paths, params.variable)
-
-        extent = get_bbox(params)
-        if extent:
-            dataset = dataset.sel(
-                longitude=slice(extent[0], extent[1]),
-                latitude=slice(extent[2], extent[3]),
-            )
-            ax.set_extent(extent, crs=ccrs.PlateCarree())
-
-        dataset = aggregations.apply(dataset, params)
-        lons, lats = np.meshgrid(dataset.longitude.values, dataset.latitude.values)
-
-        if params.mask:
-            data, lons, lats, extent = mask_utils.get_masked_data(dataset, params.mask, extent=extent, pad=1)
-        else:
-            data = dataset.values
-
-        levels = get_levels(params)
-
-        if params.contourf:
-            if params.colorbar:
-                levels, cmap, norm = colorbar_utils.add_colorbar(params.colorbar)
-            
-            cbar = ax.contourf(lons, lats, data, transform=ccrs.PlateCarree(), levels=levels, cmap=cmap, norm=norm)
-            colorbar_utils.show_colorbar(cbar, ax)
-
-        elif params.contour:
-            ax.contour(lons, lats, data, colors=params.color, linewidths=params.linewidths, levels=levels, zorder=params.zorder, transform=ccrs.PlateCarree())
-
-    if params.details:
-        plot_utils.draw_details(ax, params)
-    
-    if params.gridlines:
-        plot_utils.draw_gridlines(ax, params)
-
-
-    image = BytesIO()
-
-    figure.savefig(
-        image,
-        format="png",
-        dpi=params.dpi,
-        pad_inches=0,
-        bbox_inches="tight",
+async def moonpng_post(request: Request, params_list: list[MoonPngParams] = Body(...)): # Depends(get_params)
+    validate_layers(params_list)
+    profile = encode.negotiate(request.headers.get("accept"))
+    profile_mode = profiler.get_mode(request)
+    paths_list, key, last_modified = await run_in_threadpool(prepare, params_list, profile)
+    if profile_mode is not None:
+        return await profile_response(
+            profile_mode, partial(render_executor.resolve("utils.render:render_png_post"), params_list, paths_list, profile)
+        )
+
+    headers = image_headers(params_list, key, last_modified)
+    if http_cache.is_not_modified(request, key, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    image = await get_or_render(key, partial(render_post, params_list, paths_list, profile))
+
+    return StreamingResponse(BytesIO(image), media_type=encode.MEDIA_TYPES[profile], headers=headers)
+
+
+def prepare_animation(params: MoonPngParams, times, step, fmt: str, duration: int):
+    """
+    Resolve os arquivos que cobrem todos os quadros, a chave do cache e a
+    data de modificação das entradas.
+    """
+    import utils.animation as animation
+
+    validated_paths = path_utils.get_validated_paths(animation.get_range(params, times))
+    key = animation.make_key(params, validated_paths, times, step, fmt, duration)
+    last_modified = http_cache.get_last_modified([validated_paths])
+    return validated_paths, key, last_modified
+
+
+@app.post("/moonpng/animation", summary="Animação de vários horários de um produto")
+async def moonpng_animation(
+    request: Request,
+    params: MoonPngParams = Body(...),
+    times: list[str] | None = Body(None, description="Horários dos quadros (ISO 8601)."),
+    step: str | None = Body(None, description="Passo entre quadros de initDate a endDate (ex.: '3h'). Sem times nem step, usa todos os horários do intervalo."),
+    fmt: str = Body("webp", alias="format", description="webp, gif, apng, zip ou multipart."),
+    duration: int | None = Body(None, description="Duração de cada quadro (ms). Padrão: MOONPNG_ANIMATION_FRAME_MS."),
+):
+    import utils.animation as animation
+
+    if duration is None:
+        duration = animation.ANIMATION_FRAME_MS
+    animation.validate(fmt, times, step)
+    validated_paths, key, last_modified = await run_in_threadpool(prepare_animation, params, times, step, fmt, duration)
+
+    if fmt in stream.STREAM_FORMATS:
+        # quadros em PNG enviados à medida que ficam prontos, sem cache
+        directory = tempfile.mkdtemp(prefix="moonpng-frames-")
+        task = asyncio.ensure_future(run_in_threadpool(
+            render_executor.run, "utils.animation:write_frames", params, validated_paths, times, step, directory
+        ))
+        await stream.wait_first_file(task, directory)
+        return StreamingResponse(
+            stream.stream_files(task, directory, fmt), media_type=stream.STREAM_MEDIA_TYPES[fmt]
+        )
+
+    headers = image_headers([params], key, last_modified)
+    if http_cache.is_not_modified(request, key, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    image = await get_or_render(key, partial(
+        render_executor.run, "utils.animation:render_animation", params, validated_paths, times, step, fmt, duration
+    ))
+
+    return StreamingResponse(BytesIO(image), media_type=encode.ANIMATION_MEDIA_TYPES[fmt], headers=headers)
+
+
+@app.post("/moonpng/batch", summary="Um produto em vários recortes a partir de uma única leitura")
+async def moonpng_batch(
+    request: Request,
+    params: MoonPngParams = Body(...),
+    extents: list[str | list] | None = Body(None, description="Recortes (nomes do BBOX_DB ou [lon_min, lon_max, lat_min, lat_max]). Padrão: estados, BR e AS."),
+    masks: list[str | None] | None = Body(None, description="Máscara de cada recorte, na mesma ordem."),
+    fmt: str = Body("zip", alias="format", description="zip ou multipart."),
+):
+    if fmt not in stream.STREAM_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato '{fmt}' inválido. Use um de {stream.STREAM_FORMATS}.",
+        )
+    profile = encode.negotiate(request.headers.get("accept"))
+    validated_paths = await run_in_threadpool(path_utils.get_validated_paths, params)
+
+    # cada recorte é enviado assim que fica pronto; recortes inválidos saem
+    # como 400 antes do primeiro arquivo
+    directory = tempfile.mkdtemp(prefix="moonpng-batch-")
+    task = asyncio.ensure_future(run_in_threadpool(
+        render_executor.run, "utils.fanout:write_extents", params, validated_paths, extents, masks, profile,
+        partial(stream.write_file, directory),
+    ))
+    await stream.wait_first_file(task, directory)
+    return StreamingResponse(
+        stream.stream_files(task, directory, fmt), media_type=stream.STREAM_MEDIA_TYPES[fmt]
     )
-    image.seek(0)
-    nc_utils.close_and_destroy(dataset)
-    plt.close(figure)
-    #image = plot_utils.compress_image(image)
-    return StreamingResponse(image, media_type="image/png")
-
-        # finally:
-        #     nc_utils.close_and_destroy(dataset)
-        #     plt.close(figure)
-            
-    # return {"results": results}
+
+
+def prepare_tile(params: MoonPngParams, z: int, x: int, y: int, profile: str):
+    """
+    Resolve os arquivos, as chaves do campo e do tile e a data de
+    modificação das entradas.
+    """
+    import utils.tiles as tile_utils
+
+    validated_paths = path_utils.get_validated_paths(params)
+    field_key = tile_utils.field_key(params, validated_paths)
+    key = tile_utils.tile_key(field_key, params, z, x, y, profile)
+    last_modified = http_cache.get_last_modified([validated_paths])
+    return validated_paths, field_key, key, last_modified
+
+
+@app.get("/tiles/{z}/{x}/{y}.png", summary="Obter um tile XYZ (Web Mercator) do campo")
+async def tiles(request: Request, z: int, x: int, y: int, params: MoonPngParams = Query(...)):
+    import utils.tiles as tile_utils
+
+    tile_utils.validate_tile(z, x, y)
+    tile_utils.validate_params(params, request.query_params.keys())
+    profile = encode.negotiate(request.headers.get("accept"))
+    validated_paths, field_key, key, last_modified = await run_in_threadpool(prepare_tile, params, z, x, y, profile)
+    headers = image_headers([params], key, last_modified)
+    if http_cache.is_not_modified(request, key, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    # campo e tile no pool de renderização, sem matplotlib
+    image = await get_or_render(key, partial(
+        render_executor.run, "utils.tiles:get_tile", params, validated_paths, field_key, z, x, y, profile
+    ))
+
+    return Response(image, media_type=encode.MEDIA_TYPES[profile], headers=headers)
+
+
+@app.get("/metrics", summary="Métricas das etapas e das requisições (formato Prometheus)")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/assets", summary="Listar as colorbars e os geojsons carregados para renderizar neste worker")
+def get_assets():
+    # o registro fica em quem renderiza: com o pool de processos, num dos
+    # renderizadores (cada um carrega o seu no aquecimento)
+    return render_executor.run("utils.assets:describe")
+
+
+@app.get("/health", summary="Verificar se a API está respondendo")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/catalog/times", summary="Listar os horários disponíveis de um produto")
+def catalog_times(
+    kind: str = Query(..., description="Tipo de dado meteorológico."),
+    model: str = Query(..., description="Modelo numérico utilizado."),
+    variable: str = Query(..., description="Variável meteorológica."),
+    member: str = Query("M000", description="Membro do modelo para previsões, se aplicável."),
+    source: str = Query("/data", description="Diretório de origem dos dados."),
+    initDate: str | None = Query(None, description="Data inicial do intervalo."),
+    endDate: str | None = Query(None, description="Data final do intervalo."),
+):
+    times = catalog.get_times(source, kind, model, variable, member, initDate, endDate)
+    return {
+        "kind": kind,
+        "model": model,
+        "variable": variable,
+        "member": member,
+        "source": source,
+        "times": [t.isoformat() for t in times],
+    }
+
+
+logger.info({"message": "aplicação carregada", "pid": os.getpid(), "import_ms": round((time.perf_counter() - _import_started) * 1000, 2)})
@@ -8,12 +8,12 @@ class MoonPngParams(BaseModel):
     kind: str = Field(..., description="Tipo de dado meteorológico.")
     model: str = Field(..., description="Modelo numérico utilizado.")
     variable: str = Field(..., description="Variável meteorológica.")
-    date: str = Field(
-        default=datetime.utcnow().isoformat(),
-        description="Data da previsão no formato ISO 8601.",
+    date: str | None = Field(
+        default=None,
+        description="Data da previsão no formato ISO 8601 (padrão: o horário da requisição).",
     )
-    initDate: str = Field(default=datetime.utcnow().isoformat(), description="Data inicial do intervalo.")
-    endDate: str = Field(default=datetime.utcnow().isoformat(), description="Data final do intervalo.")
+    initDate: str | None = Field(default=None, description="Data inicial do intervalo.")
+    endDate: str | None = Field(default=None, description="Data final do intervalo.")
     member: str = Field(
         default="M000", description="Membro do modelo para previsões, se aplicável."
     )
@@ -37,6 +37,13 @@ class MoonPngParams(BaseModel):
     colorbar: str | dict | None = Field(
         default=None, description="colorbar."
     )
+    renderer: str = Field(
+        default="matplotlib",
+        description="Motor de renderização: 'matplotlib' ou 'raster' (só contourf; não desenha a barra de cores nem as gridlines).",
+    )
+    downsample: bool = Field(
+        default=True, description="Se reduz a grade para a resolução da imagem antes de desenhar."
+    )
 
 
     # smoothed: bool = Field(
@@ -77,12 +84,32 @@ class MoonPngParams(BaseModel):
 
     @root_validator(skip_on_failure=True)
     def validate_combination(cls, values):
+        # datas padrão resolvidas a cada requisição, não na importação do
+        # módulo (que acontece uma vez por worker)
+        now = datetime.utcnow().isoformat()
+        if values.get("initDate") or values.get("endDate"):
+            values["initDate"] = values.get("initDate") or now
+            values["endDate"] = values.get("endDate") or now
+        elif not values.get("date"):
+            values["date"] = now
+
+        for field in ("date", "initDate", "endDate"):
+            if values.get(field):
+                try:
+                    datetime.fromisoformat(values[field])
+                except (TypeError, ValueError):
+                    raise HTTPException(
+                        status_code=400,
+                        detail={"message": "Data inválida.", "field": field, "value": values[field]},
+                    )
+
         kind = values.get("kind")
         model = values.get("model")
         variables = values.get("variable")
         date = values.get("date")
         contourf = values.get("contourf")
         contour = values.get("contour")
+        renderer = values.get("renderer")
 
         if not contourf and not contour:
             raise HTTPException(
@@ -90,13 +117,31 @@ class MoonPngParams(BaseModel):
                 detail="Pelo menos um dos parâmetros 'contourf' ou 'contour' deve ser verdadeiro.",
             )
 
+        if renderer not in VALID_RENDERERS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Renderizador '{renderer}' inválido. Use um de {VALID_RENDERERS}.",
+            )
+
+        if renderer == "raster" and not contourf:
+            raise HTTPException(
+                status_code=400,
+                detail="O renderizador 'raster' só suporta contourf.",
+            )
+
         if model == "chimera_as" and "500hPa_geopotential_height" in variables:
             raise HTTPException(
                 status_code=400,
                 detail="O modelo ECMWF não suporta a variável '10m_wind_speed'.",
             )
 
-        if kind == "observed" and datetime.fromisoformat(date) > datetime.utcnow():
+        if kind not in VALID_MODELS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Tipo '{kind}' inválido. Use um de {VALID_KINDS}.",
+            )
+
+        if kind == "observed" and date and datetime.fromisoformat(date) > datetime.utcnow():
             raise HTTPException(
                 status_code=400,
                 detail="Não é permitido usar datas passadas com kind=forecast.",
@@ -153,14 +198,14 @@ def get_params(
         ..., description="Variável ou lista de variáveis meteorológicas."
     ),
     date: str | None = Query(
-        default=datetime.utcnow().isoformat(), description="Data da previsão no formato ISO 8601."
+        default=None, description="Data da previsão no formato ISO 8601."
     ),
     member: str = Query(
         "M000", description="Membro do modelo para previsões, se aplicável."
     ),
     source: str = Query("/data", description="Diretório de origem dos dados."),
-    initDate: str = Query(datetime.utcnow().isoformat(), description="Data inicial do intervalo."),
-    endDate: str = Query(datetime.utcnow().isoformat(), description="Data final do intervalo."),
+    initDate: str | None = Query(None, description="Data inicial do intervalo."),
+    endDate: str | None = Query(None, description="Data final do intervalo."),
     aggregation: str | None = Query(None, description="Tipo de agregação temporal."),
     contourf: bool | None = Query(None, description="Se usa contornos preenchidos."),
     contour: bool | None = Query(None, description="Se usa contornos de isolinhas."),
@@ -176,6 +221,8 @@ def get_params(
     ocean: bool = Query(True, description="Se desenha o oceano."),
     shapecontours: str | list | None = Query(None, description="Contornos de shapefiles."),
     colorbar: str | None = Query(None, description="Colorbar utilizada."),
+    renderer: str = Query("matplotlib", description="Motor de renderização: 'matplotlib' ou 'raster'."),
+    downsample: bool = Query(True, description="Se reduz a grade para a resolução da imagem antes de desenhar."),
 
     
     # smoothed: bool = Query(False, description="Se os dados devem ser suavizados."),
@@ -232,6 +279,8 @@ def get_params(
         ocean=ocean,
         shapecontours=shapecontours,
         colorbar=colorbar,
+        renderer=renderer,
+        downsample=downsample,
         # hours=hours,
         # smoothed=smoothed,
         # resolution=resolution,
@@ -539,6 +588,8 @@ VALID_MODELS = {
     "satellite": OBSERVED_PRODUCTS,
 }
 
+VALID_RENDERERS = ["matplotlib", "raster"]
+
 VALID_KINDS = [
     "forecast",
     "observed",
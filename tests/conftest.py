@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Sem arquivo de log, catálogo, aquecimento nem processos de renderização
+os.environ.setdefault("MOONPNG_LOG_FILE", "")
+os.environ.setdefault("MOONPNG_CATALOG", "0")
+os.environ.setdefault("MOONPNG_WARMUP_ENABLED", "0")
+os.environ.setdefault("MOONPNG_RENDER_WORKERS", "0")
+os.environ.setdefault("MOONPNG_METRICS_ENABLED", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
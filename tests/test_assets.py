@@ -0,0 +1,144 @@
+import json
+import os
+
+import pytest
+import shapely
+from fastapi import HTTPException
+
+import utils.assets as assets
+
+COLORBAR = {"scale": [0, 1, 2], "cmap": [[255, 0, 0], [0, 0, 255]]}
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, "COLORBARS_DIR", str(tmp_path))
+    monkeypatch.setattr(assets, "SHAPES_DIR", str(tmp_path))
+    monkeypatch.setattr(assets, "_colorbars", {})
+    monkeypatch.setattr(assets, "_shapes", {})
+    monkeypatch.setattr(assets, "_errors", {})
+    monkeypatch.setattr(assets, "ASSETS_CHECK_INTERVAL", 0)
+    return tmp_path
+
+
+def write(path, data, mtime):
+    path.write_text(json.dumps(data))
+    os.utime(path, (mtime, mtime))
+
+
+def count_loads(monkeypatch):
+    calls = []
+    load = assets._load_colorbar
+
+    def counted(name, path):
+        calls.append(name)
+        return load(name, path)
+
+    monkeypatch.setattr(assets, "_load_colorbar", counted)
+    return calls
+
+
+@pytest.mark.parametrize(
+    "definition",
+    [
+        [],
+        {"scale": [0, 1]},
+        {"scale": [1, 0], "cmap": [[0, 0, 0]]},
+        {"scale": [0, 1, 2], "cmap": [[0, 0, 0]]},
+        {"scale": [0, 1], "cmap": [[0, 0, 300]]},
+        {"scale": ["a", "b"], "cmap": [[0, 0, 0]]},
+    ],
+)
+def test_build_colorbar_rejects_invalid_definitions(definition):
+    with pytest.raises(ValueError):
+        assets.build_colorbar("test", definition)
+
+
+def test_colorbar_is_loaded_once_per_mtime(registry, monkeypatch):
+    calls = count_loads(monkeypatch)
+    write(registry / "temp.json", {"temp": COLORBAR}, 1000)
+
+    entry = assets.get_colorbar("temp")
+    assert entry["levels"] == [0, 1, 2]
+    assert assets.get_colorbar("temp") is entry
+
+    write(registry / "temp.json", {"temp": {**COLORBAR, "scale": [0, 5, 10]}}, 2000)
+    assert assets.get_colorbar("temp")["levels"] == [0, 5, 10]
+    assert calls == ["temp", "temp"]
+
+
+def test_invalid_file_is_not_parsed_again_until_it_changes(registry, monkeypatch):
+    calls = count_loads(monkeypatch)
+    write(registry / "bad.json", {"other": COLORBAR}, 1000)
+
+    for _ in range(3):
+        with pytest.raises(HTTPException) as error:
+            assets.get_colorbar("bad")
+        assert error.value.status_code == 500
+    assert calls == ["bad"]
+    assert [failure["name"] for failure in assets.describe()["errors"]] == ["bad"]
+
+    write(registry / "bad.json", {"bad": COLORBAR}, 2000)
+    assert assets.get_colorbar("bad")["levels"] == [0, 1, 2]
+    assert calls == ["bad", "bad"]
+    assert assets.describe()["errors"] == []
+
+
+def test_disk_is_checked_once_per_interval(registry, monkeypatch):
+    write(registry / "temp.json", {"temp": COLORBAR}, 1000)
+    assets.get_colorbar("temp")
+
+    stats = []
+    getmtime = os.path.getmtime
+    monkeypatch.setattr(assets.os.path, "getmtime", lambda path: stats.append(path) or getmtime(path))
+    monkeypatch.setattr(assets, "ASSETS_CHECK_INTERVAL", 60)
+    for _ in range(5):
+        assets.get_colorbar("temp")
+    assert stats == []
+
+    monkeypatch.setattr(assets, "ASSETS_CHECK_INTERVAL", 0)
+    assets.get_colorbar("temp")
+    assert len(stats) == 1
+
+
+@pytest.mark.parametrize("name", ["../temp", "/etc/passwd", ".hidden", "", None])
+def test_invalid_names(registry, name):
+    with pytest.raises(HTTPException) as error:
+        assets.get_colorbar(name)
+    assert error.value.status_code == 400
+
+
+def test_missing_file_is_forgotten(registry):
+    write(registry / "temp.json", {"temp": COLORBAR}, 1000)
+    assets.get_colorbar("temp")
+    os.remove(registry / "temp.json")
+
+    with pytest.raises(HTTPException) as error:
+        assets.get_colorbar("temp")
+    assert error.value.status_code == 400
+    assert assets.describe()["colorbars"] == []
+
+
+def test_shape_is_repaired_and_indexed(registry):
+    bowtie = [[0, 0], [2, 2], [2, 0], [0, 2], [0, 0]]
+    square = [[10, 10], [11, 10], [11, 11], [10, 11], [10, 10]]
+    write(registry / "area.geojson", {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+            for ring in (bowtie, square)
+        ],
+    }, 1000)
+
+    shape = assets.get_shape("area")
+    assert shapely.is_valid(shape["geometries"]).all()
+    assert shape["bounds"] == [0, 0, 11, 11]
+    assert len(assets.query(shape, [9, 12, 9, 12])) == 1
+    assert len(assets.query(shape)) == 2
+
+
+def test_empty_shape_is_invalid(registry):
+    write(registry / "empty.geojson", {"type": "FeatureCollection", "features": []}, 1000)
+    with pytest.raises(HTTPException) as error:
+        assets.get_shape("empty")
+    assert error.value.status_code == 500
@@ -0,0 +1,81 @@
+import pytest
+from fastapi import HTTPException
+
+import utils.cache as cache
+from models.params import MoonPngParams
+
+
+def make_params(**kwargs):
+    return MoonPngParams(
+        **{"kind": "observed", "model": "merge_as", "variable": "prec", "contourf": True, **kwargs}
+    )
+
+
+@pytest.fixture
+def paths(tmp_path):
+    files = []
+    for name in ("a.nc", "b.nc"):
+        path = tmp_path / name
+        path.write_bytes(b"data")
+        files.append(str(path))
+    return files
+
+
+def test_default_dates_are_resolved_per_request():
+    params = make_params()
+    assert params.date is not None
+    assert params.initDate is None and params.endDate is None
+
+    ranged = make_params(endDate="2025-06-09T00:00:00")
+    assert ranged.initDate is not None
+
+
+def test_invalid_date_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        make_params(date="garbage")
+    assert error.value.status_code == 400
+    assert error.value.detail["field"] == "date"
+
+
+def test_invalid_kind_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        make_params(kind="foo")
+    assert error.value.status_code == 400
+
+
+def test_key_ignores_dates_by_default(paths):
+    first = make_params(date="2025-06-09T00:00:00")
+    second = make_params(date="2025-06-10T12:00:00")
+    third = make_params(initDate="2025-06-01", endDate="2025-06-09")
+    keys = {cache.make_key([(params, paths)]) for params in (first, second, third, make_params())}
+    assert len(keys) == 1
+
+
+def test_key_with_dates_uses_range_or_date(paths):
+    ranged = cache.canonicalize(make_params(initDate="2025-06-01", endDate="2025-06-09T00:00"), dates=True)
+    assert ranged["initDate"] == "2025-06-01T00:00:00"
+    assert ranged["endDate"] == "2025-06-09T00:00:00"
+    assert "date" not in ranged
+
+    single = cache.canonicalize(make_params(date="2025-06-09"), dates=True)
+    assert single["date"] == "2025-06-09T00:00:00"
+    assert "initDate" not in single
+
+    assert cache.make_key([(make_params(initDate="2025-06-01", endDate="2025-06-09"), paths)], dates=True) != cache.make_key(
+        [(make_params(initDate="2025-06-01", endDate="2025-06-08"), paths)], dates=True
+    )
+
+
+def test_key_normalizes_extent(paths):
+    assert cache.make_key([(make_params(extent="br"), paths)]) == cache.make_key([(make_params(extent="BR"), paths)])
+
+
+def test_key_changes_with_output_params_profile_and_files(paths):
+    base = cache.make_key([(make_params(), paths)])
+    assert cache.make_key([(make_params(dpi=200), paths)]) != base
+    assert cache.make_key([(make_params(), paths)], "webp") != base
+    assert cache.make_key([(make_params(), paths[:1])]) != base
+
+    with open(paths[0], "ab") as file:
+        file.write(b"more")
+    assert cache.make_key([(make_params(), paths)]) != base
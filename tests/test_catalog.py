@@ -0,0 +1,157 @@
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import utils.catalog as catalog
+import utils.paths as path_utils
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "_products", catalog.OrderedDict())
+    monkeypatch.setattr(catalog, "_identities", {})
+    monkeypatch.setattr(catalog, "CATALOG_ALLOWED_SOURCES", [str(tmp_path)])
+
+    # observed/merge_as/prec: arquivos diários de 01/06 a 10/06, sem o dia 05
+    day = datetime(2025, 6, 1)
+    while day <= datetime(2025, 6, 10):
+        if day.day != 5:
+            directory = tmp_path / "observed" / "merge_as" / "prec" / day.strftime("%Y") / day.strftime("%j")
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / day.strftime("merge_as_prec_%Y%m%d00.nc")).write_bytes(b"data")
+        day += timedelta(days=1)
+    return str(tmp_path)
+
+
+def make_params(source, **kwargs):
+    return SimpleNamespace(
+        **{"source": source, "kind": "observed", "model": "merge_as", "variable": "prec", "member": "M000",
+           "date": None, "initDate": None, "endDate": None, **kwargs}
+    )
+
+
+def expected_paths(params):
+    # referência: os caminhos gerados que existem no disco
+    path_template, freq = path_utils.gen_path_template(params)
+    return [path for path in path_utils.get_paths(params, path_template, freq) if os.path.exists(path)]
+
+
+@pytest.mark.parametrize(
+    "dates",
+    [
+        {"initDate": "2025-06-01", "endDate": "2025-06-10"},
+        {"initDate": "2025-06-03", "endDate": "2025-06-07"},
+        {"initDate": "2025-06-03T12:00", "endDate": "2025-06-07"},
+        {"initDate": "2025-05-01", "endDate": "2025-06-02"},
+        {"initDate": "2025-07-01", "endDate": "2025-07-02"},
+        {"date": "2025-06-04"},
+        {"date": "2025-06-05"},
+        {"date": "2025-06-06T06:00"},
+    ],
+)
+def test_get_paths_matches_generated_paths(source, dates):
+    params = make_params(source, **dates)
+    path_template, freq = path_utils.gen_path_template(params)
+    assert catalog.get_paths(params, path_template, freq) == expected_paths(params)
+
+
+def test_get_times_range(source):
+    times = catalog.get_times(source, "observed", "merge_as", "prec", "M000")
+    assert len(times) == 9
+    assert datetime(2025, 6, 5) not in times
+
+    times = catalog.get_times(source, "observed", "merge_as", "prec", "M000", "2025-06-04", "2025-06-06")
+    assert times == [datetime(2025, 6, 4), datetime(2025, 6, 6)]
+
+
+def test_get_times_validation(source, tmp_path):
+    with pytest.raises(HTTPException) as error:
+        catalog.get_times(source, "foo", "merge_as", "prec", "M000")
+    assert error.value.status_code == 400 and error.value.detail["kind"] == "foo"
+
+    with pytest.raises(HTTPException) as error:
+        catalog.get_times(source, "observed", "merge_as", "prec", "M000", initDate="garbage")
+    assert error.value.status_code == 400 and error.value.detail["field"] == "initDate"
+
+    with pytest.raises(HTTPException) as error:
+        catalog.get_times(str(tmp_path / "observed"), "observed", "merge_as", "prec", "M000")
+    assert error.value.status_code == 400
+
+
+def test_products_without_files_are_not_registered(source):
+    assert catalog.get_times(source, "observed", "merge_as", "other", "M000") == []
+    assert catalog._products == {}
+
+    catalog.get_product(source, "observed", "merge_as", "other", "M000", pin=True)
+    assert list(catalog._products) == [(source, "observed", "merge_as", "other", "M000")]
+
+
+def test_products_are_capped(source, monkeypatch):
+    monkeypatch.setattr(catalog, "CATALOG_MAX_PRODUCTS", 1)
+    for variable in ("prec", "temp"):
+        directory = os.path.join(source, "observed", "merge_as", variable, "2025", "152")
+        os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, f"merge_as_{variable}_2025060100.nc"), "wb").close()
+
+    catalog.get_product(source, "observed", "merge_as", "prec", "M000")
+    catalog.get_product(source, "observed", "merge_as", "temp", "M000")
+    assert list(catalog._products) == [(source, "observed", "merge_as", "temp", "M000")]
+    assert all("/temp/" in path for path in catalog._identities)
+
+
+def test_get_paths_off_grid_minutes(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "_products", catalog.OrderedDict())
+    monkeypatch.setattr(catalog, "_identities", {})
+    directory = tmp_path / "observed" / "radar_poa" / "dbz" / "2025" / "160"
+    directory.mkdir(parents=True)
+    for minute in (0, 3, 5, 8, 13):
+        (directory / f"radar_poa_dbz_M000_2025060912{minute:02d}.nc").write_bytes(b"data")
+
+    for dates in ({"initDate": "2025-06-09T12:03", "endDate": "2025-06-09T12:13"},
+                  {"initDate": "2025-06-09T12:00:30", "endDate": "2025-06-09T12:10"},
+                  {"date": "2025-06-09T12:08:59"}):
+        params = make_params(str(tmp_path), kind="radar", model="radar_poa", variable="dbz", **dates)
+        path_template, freq = path_utils.gen_path_template(params)
+        assert catalog.get_paths(params, path_template, freq) == expected_paths(params)
+
+
+def test_identities_follow_overwritten_files(source):
+    import utils.cache as cache
+
+    params = make_params(source, date="2025-06-04")
+    path_template, freq = path_utils.gen_path_template(params)
+    paths = catalog.get_paths(params, path_template, freq)
+    before = cache.get_file_identities(paths)
+
+    # sobrescrito depois da varredura: o catálogo ainda não viu
+    with open(paths[0], "wb") as file:
+        file.write(b"new data")
+    os.utime(paths[0], (2e9, 2e9))
+
+    assert catalog.get_paths(params, path_template, freq) == paths
+    assert cache.get_file_identities(paths) != before
+
+
+def test_rescan_recent_only_skips_old_days(source):
+    key = (source, "observed", "merge_as", "prec", "M000")
+    catalog.get_product(*key)
+
+    def add(day):
+        directory = os.path.join(source, "observed", "merge_as", "prec", day.strftime("%Y"), day.strftime("%j"))
+        os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, day.strftime("merge_as_prec_%Y%m%d00.nc")), "wb").close()
+        return datetime(day.year, day.month, day.day)
+
+    today = add(datetime.now())
+    old = add(datetime(2025, 6, 5))
+
+    catalog.rescan_all(recent_only=True)
+    times = catalog.get_times(*key)
+    assert today in times and old not in times
+    assert len(times) == 10
+
+    catalog.rescan_all()
+    assert old in catalog.get_times(*key)
@@ -0,0 +1,94 @@
+import numpy as np
+import xarray as xr
+
+import utils.downsample as downsample_utils
+
+
+def make_field(values):
+    values = np.asarray(values)
+    return xr.DataArray(
+        values,
+        coords={"latitude": np.arange(values.shape[0]) * 1.0, "longitude": np.arange(values.shape[1]) * 10.0},
+        dims=("latitude", "longitude"),
+        name="field",
+    )
+
+
+def test_partial_blocks_at_the_edges():
+    field = make_field(np.arange(35, dtype="float32").reshape(5, 7))
+    result = downsample_utils.block_mean(field, 3, 2)
+
+    assert result.shape == (3, 3)
+    expected = field.coarsen(latitude=2, longitude=3, boundary="pad").mean()
+    np.testing.assert_allclose(result.values, expected.values)
+    np.testing.assert_allclose(result.longitude.values, [10, 40, 60])
+    np.testing.assert_allclose(result.latitude.values, [0.5, 2.5, 4])
+
+
+def test_integers_are_not_truncated():
+    field = make_field(np.array([[1, 2], [2, 2]], dtype="int16"))
+    result = downsample_utils.block_mean(field, 2, 2)
+
+    assert np.issubdtype(result.dtype, np.floating)
+    assert result.values[0, 0] == 1.75
+
+
+def test_float32_is_kept_and_nan_ignored():
+    field = make_field(np.array([[1, np.nan, 4], [3, np.nan, np.nan]], dtype="float32"))
+    result = downsample_utils.block_mean(field, 2, 2)
+
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result.values, [[2, 4]])
+
+
+def test_empty_blocks_are_nan():
+    field = make_field(np.array([[np.nan, np.nan, 1]], dtype="float64"))
+    result = downsample_utils.block_mean(field, 2, 1)
+    assert np.isnan(result.values[0, 0])
+    assert result.values[0, 1] == 1
+
+
+def test_method_follows_flag_attributes(monkeypatch):
+    field = make_field(np.zeros((2, 2)))
+    assert downsample_utils.get_method(field, "land_cover_type") == "mean"
+
+    field.attrs["flag_values"] = [1, 2, 3]
+    assert downsample_utils.get_method(field, "soil_moisture") == "nearest"
+
+    monkeypatch.setattr(downsample_utils, "NEAREST_VARIABLES", ["10m_wind_direction"])
+    assert downsample_utils.get_method(make_field(np.zeros((2, 2))), "10m_wind_direction") == "nearest"
+
+
+def test_mask_is_applied_before_the_block_mean(tmp_path, monkeypatch):
+    import json
+
+    import utils.assets as assets
+    import utils.render as render_utils
+    from models.params import MoonPngParams
+
+    monkeypatch.setattr(assets, "SHAPES_DIR", str(tmp_path))
+    monkeypatch.setattr(assets, "_shapes", {})
+    # bordas entre os centros dos blocos 2x2: a média de borda mistura dentro e fora
+    ring = [[-50.12, -20.12], [-39.88, -20.12], [-39.88, -9.88], [-50.12, -9.88], [-50.12, -20.12]]
+    (tmp_path / "area.geojson").write_text(json.dumps({
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [ring]}}],
+    }))
+
+    # 1 dentro da máscara, 100 fora: nenhuma média de borda pode passar de 1
+    lons = np.arange(-59.95, -30.0, 0.1)
+    lats = np.arange(-29.95, 0.0, 0.1)
+    inside = (np.abs(lons[None, :] + 45) < 5.12) & (np.abs(lats[:, None] + 15) < 5.12)
+    field = xr.DataArray(
+        np.where(inside, 1.0, 100.0), coords={"latitude": lats, "longitude": lons}, dims=("latitude", "longitude")
+    )
+    params = MoonPngParams(
+        kind="observed", model="merge_as", variable="prec", contourf=True, mask="area", dpi=10,
+        extent=[-60, -30, -30, 0],
+    )
+
+    extent, out_lons, out_lats, data = render_utils.prepare_layer(field, params, [-60, -30, -30, 0])
+    assert data.shape == (out_lats.size, out_lons.size)
+    assert data.shape[1] < lons.size
+    assert np.ma.count(data) > 0
+    assert np.ma.max(data) == 1
@@ -0,0 +1,69 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import utils.encode as encode
+
+
+@pytest.fixture
+def offered(monkeypatch):
+    monkeypatch.setattr(encode, "ENCODE_ACCEPT", ["webp", "avif"])
+    monkeypatch.setattr(encode, "ENCODE_PROFILE", "png")
+    monkeypatch.setattr(encode, "is_supported", lambda profile: profile in encode.PROFILES)
+
+
+def test_parse_accept():
+    ranges = encode.parse_accept("image/webp;q=0.5, image/*; q=0.8 ,*/*;q=abc, text/html")
+    assert ranges == {"image/webp": 0.5, "image/*": 0.8, "*/*": 0.0, "text/html": 1.0}
+    assert encode.get_quality(ranges, "image/png") == 0.8
+    assert encode.get_quality(ranges, "image/webp") == 0.5
+    assert encode.get_quality({}, "image/png") == 0.0
+
+
+@pytest.mark.parametrize(
+    "accept, profile",
+    [
+        (None, "png"),
+        ("", "png"),
+        ("*/*", "png"),
+        ("image/*", "png"),
+        ("image/webp", "webp"),
+        ("image/webp;q=0", "png"),
+        ("image/webp;q=0, */*", "png"),
+        ("image/avif,image/webp,image/apng,image/*,*/*;q=0.8", "webp"),
+        ("image/webp;q=0.5, image/avif;q=0.9", "avif"),
+        ("image/png, image/webp;q=0.5", "png"),
+        ("image/webp;q=0.5, */*;q=0.1", "webp"),
+        ("IMAGE/WEBP", "webp"),
+        ("image/webpx", "png"),
+    ],
+)
+def test_negotiate(offered, accept, profile):
+    assert encode.negotiate(accept) == profile
+
+
+def test_negotiate_skips_unsupported(offered, monkeypatch):
+    monkeypatch.setattr(encode, "is_supported", lambda profile: profile != "avif")
+    assert encode.negotiate("image/avif") == "png"
+    assert encode.negotiate("image/avif, image/webp;q=0.5") == "webp"
+
+
+def test_negotiate_without_offers(monkeypatch):
+    monkeypatch.setattr(encode, "ENCODE_ACCEPT", [])
+    monkeypatch.setattr(encode, "ENCODE_PROFILE", "fast")
+    assert encode.negotiate("image/webp") == "fast"
+
+
+@pytest.mark.parametrize("profile", ["png", "fast", "palette"])
+def test_encode_figure(profile):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(2, 1))
+    figure.add_subplot().plot([0, 1], [1, 0])
+    image = Image.open(BytesIO(encode.encode_figure(figure, 50, profile)))
+    assert image.format == "PNG"
+    assert image.mode == ("P" if profile == "palette" else "RGBA")
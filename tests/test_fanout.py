@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from fastapi import HTTPException
+
+import utils.cache as cache
+import utils.fanout as fanout
+import utils.render as render_utils
+from models.params import MoonPngParams
+
+EXTENTS = ["SP", "RS", [-60, -50, -20, -10]]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    # campo diário suave cobrindo o Brasil, 0,5° de resolução
+    latitudes = np.arange(-35.0, 6.0, 0.5)
+    longitudes = np.arange(-75.0, -30.0, 0.5)
+    values = (np.sin(latitudes[:, None] / 5) + np.cos(longitudes[None, :] / 7)).astype("float32")
+    path = str(tmp_path / "prec.nc")
+    xr.Dataset(
+        {"prec": (("time", "latitude", "longitude"), values[np.newaxis])},
+        coords={"time": pd.date_range("2025-06-01", periods=1), "latitude": latitudes, "longitude": longitudes},
+    ).to_netcdf(path)
+    return [path]
+
+
+def make_params(**kwargs):
+    return MoonPngParams(
+        **{"kind": "observed", "model": "merge_as", "variable": "prec", "aggregation": "mean", "contourf": True,
+           "details": False, "gridlines": False, "date": "2025-06-01T00:00:00", **kwargs}
+    )
+
+
+def test_union_crops_match_single_extent_layers(paths):
+    params = make_params()
+    targets = fanout.get_targets(params, EXTENTS)
+
+    for target, field in zip(targets, fanout.load_fields(params, paths, targets)):
+        single = render_utils.load_layer(target, paths)
+        crop = render_utils.prepare_layer(field, target, single[0])
+        for expected, value in zip(single[1:], crop[1:]):
+            np.testing.assert_array_equal(value, expected)
+
+
+def test_union_crops_render_like_single_extents(paths, monkeypatch):
+    monkeypatch.setattr(cache, "get", lambda key: None)
+    monkeypatch.setattr(cache, "set", lambda key, image: None)
+    params = make_params()
+
+    images = {}
+    count = fanout.write_extents(params, paths, EXTENTS, None, "png", lambda index, name, data: images.update({name: data}))
+
+    assert count == len(EXTENTS)
+    for target in fanout.get_targets(params, EXTENTS):
+        assert images[f"{fanout.get_label(target)}.png"] == render_utils.render_png(target, paths, "png")
+
+
+def test_write_extents_rejects_invalid_extent(paths):
+    with pytest.raises(HTTPException) as error:
+        fanout.write_extents(make_params(), paths, ["XX"], None, "png", lambda *args: None)
+    assert error.value.status_code == 400
@@ -0,0 +1,55 @@
+from email.utils import formatdate
+
+from starlette.requests import Request
+
+import utils.cache as cache
+import utils.http_cache as http_cache
+from models.params import MoonPngParams
+
+
+def make_request(**headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/moonpng",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_headers():
+    headers = http_cache.get_headers("abc", 1717891200, ["forecast", "radar"])
+    assert headers["ETag"] == '"abc"'
+    assert headers["Cache-Control"] == f"public, max-age={http_cache.MAX_AGE_SHORT}"
+    assert headers["Last-Modified"] == "Sun, 09 Jun 2024 00:00:00 GMT"
+
+
+def test_if_none_match():
+    assert http_cache.is_not_modified(make_request(if_none_match='"abc"'), "abc", None)
+    assert http_cache.is_not_modified(make_request(if_none_match='"x", W/"abc"'), "abc", None)
+    assert http_cache.is_not_modified(make_request(if_none_match="*"), "abc", None)
+    assert not http_cache.is_not_modified(make_request(if_none_match='"other"'), "abc", None)
+    # If-None-Match tem precedência sobre If-Modified-Since
+    assert not http_cache.is_not_modified(
+        make_request(if_none_match='"other"', if_modified_since=formatdate(2e9, usegmt=True)), "abc", 1e9
+    )
+
+
+def test_if_modified_since():
+    assert http_cache.is_not_modified(make_request(if_modified_since=formatdate(1000, usegmt=True)), "abc", 1000.5)
+    assert not http_cache.is_not_modified(make_request(if_modified_since=formatdate(999, usegmt=True)), "abc", 1000)
+    assert not http_cache.is_not_modified(make_request(if_modified_since="garbage"), "abc", 1000)
+    assert not http_cache.is_not_modified(make_request(), "abc", 1000)
+
+
+def test_etag_does_not_depend_on_request_time(tmp_path):
+    path = tmp_path / "a.nc"
+    path.write_bytes(b"data")
+    params = dict(kind="observed", model="merge_as", variable="prec", contourf=True)
+
+    first = http_cache.get_headers(cache.make_key([(MoonPngParams(**params), [str(path)])]), None, ["observed"])
+    second = http_cache.get_headers(cache.make_key([(MoonPngParams(**params), [str(path)])]), None, ["observed"])
+    assert first["ETag"] == second["ETag"]
+
+    path.write_bytes(b"changed")
+    third = http_cache.get_headers(cache.make_key([(MoonPngParams(**params), [str(path)])]), None, ["observed"])
+    assert third["ETag"] != first["ETag"]
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import shapely
+
+import utils.mask as mask_utils
+
+
+def reference(geoms, lons, lats):
+    # teste ponto a ponto dos centros das células
+    lon2d, lat2d = np.meshgrid(lons, lats)
+    inside = np.zeros(lon2d.shape, dtype=bool)
+    for geom in geoms:
+        inside |= shapely.contains_xy(geom, lon2d, lat2d)
+    return inside
+
+
+GEOMETRIES = {
+    "triangle": [shapely.Polygon([(-50, -20), (-40, -5), (-35, -25)])],
+    "hole": [shapely.Polygon(
+        [(-55, -30), (-35, -30), (-35, -10), (-55, -10)],
+        [[(-50, -25), (-40, -25), (-40, -15), (-50, -15)]],
+    )],
+    "multipolygon": [shapely.MultiPolygon([
+        shapely.Polygon([(-60, -30), (-52, -30), (-56, -20)]),
+        shapely.Polygon([(-45, -12), (-38, -12), (-38, -2), (-45, -2)]),
+    ])],
+    "overlapping": [
+        shapely.Polygon([(-55, -25), (-45, -25), (-45, -15), (-55, -15)]),
+        shapely.Polygon([(-50, -20), (-40, -20), (-40, -10), (-50, -10)]),
+    ],
+    "irregular": [shapely.Point(-47.3, -16.1).buffer(7.7, quad_segs=32)],
+}
+
+
+@pytest.mark.parametrize("name", sorted(GEOMETRIES))
+@pytest.mark.parametrize("descending", [False, True])
+def test_rasterize_matches_shapely(name, descending):
+    # grade que não coincide com os vértices
+    lons = np.arange(-62.13, -30, 0.37)
+    lats = np.arange(-33.07, 0, 0.29)
+    if descending:
+        lats = lats[::-1]
+    geoms = GEOMETRIES[name]
+
+    mask = mask_utils.rasterize(geoms, lons, lats)
+
+    assert mask.shape == (lats.size, lons.size)
+    np.testing.assert_array_equal(mask, reference(geoms, lons, lats))
+
+
+def test_rasterize_outside_grid_and_other_types():
+    lons = np.linspace(0, 10, 11)
+    lats = np.linspace(0, 10, 11)
+    geoms = [
+        shapely.Polygon([(20, 20), (30, 20), (30, 30)]),
+        shapely.LineString([(0, 0), (10, 10)]),
+        shapely.Polygon(),
+    ]
+    assert not mask_utils.rasterize(geoms, lons, lats).any()
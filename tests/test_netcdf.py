@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import utils.netcdf as nc_utils
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(nc_utils, "_pool", nc_utils.OrderedDict())
+    monkeypatch.setattr(nc_utils, "POOL_SIZE", 2)
+    yield
+    nc_utils.clear_pool()
+
+
+def write(path, value, mtime):
+    xr.Dataset({"t2m": (("latitude", "longitude"), np.full((2, 3), value, dtype="float32"))}).to_netcdf(path)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_same_file_is_opened_once(pool, tmp_path):
+    path = write(tmp_path / "a.nc", 1, 1000)
+    assert nc_utils.open_dataset(path) is nc_utils.open_dataset(path)
+
+
+def test_replaced_file_keeps_the_old_handle_open(pool, tmp_path):
+    path = write(tmp_path / "a.nc", 1, 1000)
+    old = nc_utils.open_dataset(path)
+
+    os.remove(path)
+    write(tmp_path / "a.nc", 2, 2000)
+    new = nc_utils.open_dataset(path)
+
+    assert new is not old
+    assert float(new["t2m"][0, 0]) == 2
+    assert [key[0] for key in nc_utils._pool] == [path]
+    # uma requisição em andamento ainda lê a versão antiga
+    assert old._close is not None
+    assert float(old["t2m"][0, 0]) == 1
+
+
+def test_pool_is_bounded(pool, tmp_path):
+    paths = [write(tmp_path / f"{name}.nc", 1, 1000) for name in "abc"]
+    for path in paths:
+        nc_utils.open_dataset(path)
+    assert [key[0] for key in nc_utils._pool] == paths[1:]
+
+
+def test_clear_pool_closes_everything(pool, tmp_path):
+    dataset = nc_utils.open_dataset(write(tmp_path / "a.nc", 1, 1000))
+    nc_utils.clear_pool()
+    assert not nc_utils._pool
+    assert dataset._close is None
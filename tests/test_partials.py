@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import utils.aggregations as aggregations
+import utils.netcdf as nc_utils
+import utils.partials as partials
+
+METHODS = ["mean", "sum", "max", "min", "std", "var", "count"]
+
+
+@pytest.fixture
+def files(tmp_path):
+    # 6 dias (28/06 a 03/07) com 4 horários por arquivo, alguns valores ausentes
+    rng = np.random.default_rng(0)
+    latitudes = np.linspace(-10, 10, 5)
+    longitudes = np.linspace(300, 320, 6)
+    paths = []
+    for offset in range(6):
+        day = datetime(2025, 6, 28) + timedelta(days=offset)
+        values = rng.normal(290, 5, (4, latitudes.size, longitudes.size)).astype("float32")
+        values[rng.random(values.shape) < 0.1] = np.nan
+        directory = tmp_path / "source" / day.strftime("%Y") / day.strftime("%j")
+        directory.mkdir(parents=True)
+        path = str(directory / day.strftime("t2m_%Y%m%d.nc"))
+        xr.Dataset(
+            {"t2m": (("time", "latitude", "longitude"), values)},
+            coords={
+                "time": pd.date_range(day, periods=4, freq="6h"),
+                "latitude": latitudes,
+                "longitude": longitudes,
+            },
+        ).to_netcdf(path)
+        paths.append(path)
+    return paths
+
+
+def make_params(aggregation):
+    return SimpleNamespace(
+        variable="t2m", aggregation=aggregation, initDate="2025-06-28T00:00:00", endDate="2025-07-03T23:59:59"
+    )
+
+
+def reference(paths, params):
+    dataarray = nc_utils.get_data(paths, params.variable)
+    try:
+        return aggregations.apply(dataarray, params).values
+    finally:
+        nc_utils.close_and_destroy(dataarray)
+
+
+@pytest.mark.parametrize("aggregation", METHODS)
+def test_merge_matches_get_data(files, aggregation):
+    params = make_params(aggregation)
+    total = None
+    for path in files:
+        with xr.open_dataset(path) as dataset:
+            total = partials.merge_partials(total, partials.reduce_partial(dataset["t2m"].values))
+
+    np.testing.assert_allclose(partials.finalize_partial(total, aggregation), reference(files, params), rtol=1e-5)
+
+
+@pytest.mark.parametrize("aggregation", METHODS)
+def test_aggregate_matches_get_data(files, tmp_path, monkeypatch, aggregation):
+    monkeypatch.setattr(partials, "STORE_DIR", str(tmp_path / "partials"))
+    params = make_params(aggregation)
+    expected = reference(files, params)
+
+    # sem parcial gravada o pedido fica com o caminho normal
+    assert partials.aggregate(files, params) is None
+
+    # dias gravados nas parciais, os dois últimos lidos dos arquivos
+    assert partials.refresh(files[:4], files[:4], "t2m") == 4
+    result = partials.aggregate(files, params)
+    assert result is not None
+    np.testing.assert_allclose(result.values, expected, rtol=1e-5)
+    assert not list((tmp_path / "partials").glob(f"v{partials.STORE_VERSION}/*/2025-07-0[23]-*"))
+
+
+def test_aggregate_with_extent(files, tmp_path, monkeypatch):
+    monkeypatch.setattr(partials, "STORE_DIR", str(tmp_path / "partials"))
+    params = make_params("mean")
+    extent = [-55, -45, -5, 5]
+    partials.refresh(files[:3], files[:3], "t2m")
+
+    # os dias de borda são lidos só na janela
+    shapes = []
+    build = partials._build
+
+    def windowed_build(paths, variable, extent=None):
+        piece = build(paths, variable, extent)
+        shapes.append(piece[0]["sum"].shape)
+        return piece
+
+    monkeypatch.setattr(partials, "_build", windowed_build)
+
+    dataarray = nc_utils.get_data(files, "t2m", extent)
+    try:
+        expected = aggregations.apply(dataarray, params)
+        result = partials.aggregate(files, params, extent)
+        np.testing.assert_allclose(result.values, expected.values, rtol=1e-5)
+        np.testing.assert_allclose(result.longitude.values, expected.longitude.values)
+        assert shapes == [expected.shape]
+    finally:
+        nc_utils.close_and_destroy(dataarray)
+
+
+def test_aggregate_stores_covered_month_from_days(files, tmp_path, monkeypatch):
+    monkeypatch.setattr(partials, "STORE_DIR", str(tmp_path / "partials"))
+    params = SimpleNamespace(
+        variable="t2m", aggregation="mean", initDate="2025-07-01T00:00:00", endDate="2025-08-01T00:00:00"
+    )
+    july = files[3:]
+    partials.refresh(july, july, "t2m")
+
+    expected = reference(july, params)
+    np.testing.assert_allclose(partials.aggregate(july, params).values, expected, rtol=1e-5)
+    names = [path.name for path in (tmp_path / "partials").glob(f"v{partials.STORE_VERSION}/*/2025-07-*")]
+    assert len([name for name in names if name.count("-") == 2]) == 1
+
+
+def test_reduce_files_rejects_grid_mismatch():
+    fields = {
+        "a": xr.DataArray(np.zeros((2, 3, 3)), dims=("time", "latitude", "longitude")),
+        "b": xr.DataArray(np.zeros((2, 4, 3)), dims=("time", "latitude", "longitude")),
+    }
+    with pytest.raises(ValueError, match="grid mismatch in b"):
+        partials.reduce_files(["a", "b"], fields.get)
+
+
+def test_variance_keeps_precision_with_large_offset():
+    # float32 com média alta e variância pequena: soma dos quadrados cancela
+    rng = np.random.default_rng(1)
+    values = (1e6 + rng.normal(0, 0.01, (40, 2, 2))).astype("float32")
+    total = None
+    for block in np.split(values, 8):
+        total = partials.merge_partials(total, partials.reduce_partial(block))
+
+    expected = values.astype("float64").var(axis=0)
+    np.testing.assert_allclose(partials.finalize_partial(total, "var"), expected, rtol=1e-9)
@@ -0,0 +1,40 @@
+import threading
+import time
+
+import pytest
+
+import utils.partials as partials
+import utils.prewarm as prewarm
+import utils.singleflight as singleflight
+
+
+@pytest.fixture
+def lock_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(singleflight, "LOCK_DIR", str(tmp_path))
+    monkeypatch.setattr(prewarm, "PREWARM_LEADER_RETRY_SECONDS", 0.05)
+    monkeypatch.setattr(prewarm, "_leader", None)
+    yield tmp_path
+    if prewarm._leader is not None:
+        prewarm._leader.close()
+
+
+def test_only_one_worker_leads(lock_dir):
+    holder = singleflight.try_lock("prewarm")
+    waiter = threading.Thread(target=prewarm._lead, daemon=True)
+    waiter.start()
+
+    # outro worker tem o lock: este espera a vez
+    time.sleep(0.2)
+    assert waiter.is_alive()
+    assert prewarm._leader is None
+
+    holder.close()
+    waiter.join(timeout=5)
+    assert not waiter.is_alive()
+    assert prewarm._leader is not None
+
+
+def test_refresh_partials_needs_the_lock(lock_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(partials, "STORE_DIR", str(tmp_path / "partials"))
+    monkeypatch.setattr(partials, "refresh", lambda *args: pytest.fail("parciais atualizadas sem o lock"))
+    prewarm.refresh_partials(("/data", "observed", "merge_as", "prec", "M000"), ["/data/a.nc"])
@@ -0,0 +1,57 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import utils.executor as render_executor
+import utils.profiler as profiler
+
+
+def make_request(**headers):
+    return SimpleNamespace(headers=headers)
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_ENABLED", False)
+    assert profiler.get_mode(make_request()) is None
+    with pytest.raises(HTTPException) as error:
+        profiler.get_mode(make_request(**{profiler.PROFILE_HEADER: "cpu"}))
+    assert error.value.status_code == 403
+
+
+def test_token_is_required_when_configured(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_ENABLED", True)
+    monkeypatch.setattr(profiler, "PROFILE_TOKEN", "secret")
+    for token in (None, "wrong"):
+        headers = {profiler.PROFILE_HEADER: "memory"}
+        if token:
+            headers[profiler.PROFILE_TOKEN_HEADER] = token
+        with pytest.raises(HTTPException) as error:
+            profiler.get_mode(make_request(**headers))
+        assert error.value.status_code == 403
+
+    request = make_request(**{profiler.PROFILE_HEADER: "memory", profiler.PROFILE_TOKEN_HEADER: "secret"})
+    assert profiler.get_mode(request) == "memory"
+
+
+def test_invalid_mode(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_ENABLED", True)
+    monkeypatch.setattr(profiler, "PROFILE_TOKEN", "")
+    with pytest.raises(HTTPException) as error:
+        profiler.get_mode(make_request(**{profiler.PROFILE_HEADER: "disk"}))
+    assert error.value.status_code == 400
+
+
+def test_profile_takes_a_render_slot(monkeypatch):
+    monkeypatch.setattr(render_executor, "_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(render_executor, "RENDER_QUEUE_TIMEOUT", 0.05)
+
+    content, media_type = profiler.run("memory", lambda: bytearray(1024))
+    assert media_type == "application/json"
+    assert content["memory_peak_kb"] >= 1
+
+    with render_executor.slot():
+        with pytest.raises(HTTPException) as error:
+            profiler.run("memory", lambda: None)
+    assert error.value.status_code == 503
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import utils.raster as raster
+from models.params import MoonPngParams
+
+
+def test_resample_keeps_only_existing_classes():
+    # degrau de 0 para 10: nada entre os dois intervalos extremos
+    lons = np.arange(4.0)
+    lats = np.arange(3.0)
+    data = np.array([[0, 0, 10, 10]] * 3, dtype="float32")
+    out_lons = np.linspace(0, 3, 31)
+    out_lats = np.linspace(0, 2, 21)
+
+    field = raster.resample(data, lons, lats, out_lons, out_lats)
+    index = raster.classify(field, np.array([-1.0, 2.0, 8.0, 11.0]))
+
+    assert set(np.unique(index)) == {0, 2}
+
+
+def test_resample_outside_grid_is_nan():
+    field = raster.resample(np.ones((2, 2)), np.array([0.0, 1.0]), np.array([0.0, 1.0]), np.array([-5.0, 0.5]), np.array([0.5, 5.0]))
+    assert np.isnan(field[1]).all()
+    assert np.isnan(field[:, 0]).all()
+    assert field[0, 1] == 1
+
+
+def test_classify_bounds():
+    levels = np.array([0.0, 1.0, 2.0])
+    index = raster.classify(np.array([0.0, 0.5, 1.0, 1.5, 2.0, 2.5, -1.0, np.nan]), levels)
+    assert index.tolist() == [0, 0, 0, 1, 1, 2, 2, 2]
+
+
+def test_post_rejects_raster_with_several_layers():
+    import main
+
+    layer = {"kind": "observed", "model": "merge_as", "variable": "prec", "contourf": True, "renderer": "raster"}
+    main.validate_layers([MoonPngParams(**layer)])
+    with pytest.raises(HTTPException) as error:
+        main.validate_layers([MoonPngParams(**layer), MoonPngParams(**{**layer, "renderer": "matplotlib"})])
+    assert error.value.status_code == 400
+
+
+def test_masked_raster_uses_the_masked_coordinates(tmp_path, monkeypatch):
+    import json
+
+    import xarray as xr
+
+    import utils.assets as assets
+    import utils.render as render_utils
+
+    monkeypatch.setattr(assets, "SHAPES_DIR", str(tmp_path))
+    monkeypatch.setattr(assets, "_shapes", {})
+    ring = [[-50, -20], [-40, -20], [-40, -10], [-50, -10], [-50, -20]]
+    (tmp_path / "area.geojson").write_text(json.dumps({
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [ring]}}],
+    }))
+
+    # o valor de cada célula é a própria longitude
+    lons = np.arange(-70.0, -20.0, 1.0)
+    lats = np.arange(-40.0, 10.0, 1.0)
+    dataset = xr.DataArray(
+        np.tile(lons, (lats.size, 1)), coords={"latitude": lats, "longitude": lons}, dims=("latitude", "longitude")
+    )
+    sampled = []
+    resample = raster.resample
+    monkeypatch.setattr(raster, "resample", lambda *args: sampled.append(args) or resample(*args))
+
+    params = MoonPngParams(
+        kind="observed", model="merge_as", variable="prec", contourf=True, renderer="raster",
+        mask="area", details=False, levels=list(range(-80, -10, 1)),
+    )
+    render_utils.draw_raster(params, dataset)
+
+    data, field_lons, field_lats, out_lons, out_lats = sampled[0]
+    assert data.shape == (field_lats.size, field_lons.size)
+    inside = ~np.ma.getmaskarray(data)
+    np.testing.assert_array_equal(np.ma.getdata(data)[inside], np.broadcast_to(field_lons, data.shape)[inside])
+
+    field = resample(data, field_lons, field_lats, out_lons, out_lats)
+    column = np.argmin(np.abs(out_lons + 45))
+    assert np.nanmax(np.abs(field[:, column] - out_lons[column])) <= 0.5
@@ -0,0 +1,122 @@
+import fcntl
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+import utils.singleflight as singleflight
+
+
+@pytest.fixture
+def lock_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(singleflight, "LOCK_DIR", str(tmp_path))
+    return tmp_path
+
+
+def age(path, seconds):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_concurrent_calls_run_once(lock_dir):
+    calls = []
+    started = threading.Event()
+
+    def render():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return b"image"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(singleflight.do("key", render))) for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == [b"image"] * 4
+
+
+def _worker(lock_dir, counter):
+    singleflight.LOCK_DIR = lock_dir
+
+    def render():
+        with open(counter, "ab") as file:
+            file.write(b"x")
+        time.sleep(0.3)
+        return b"image"
+
+    assert singleflight.do("shared", render) == b"image"
+
+
+def test_workers_share_the_result(lock_dir):
+    counter = str(lock_dir / "counter")
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_worker, args=(str(lock_dir), counter)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert [worker.exitcode for worker in workers] == [0, 0, 0]
+    with open(counter, "rb") as file:
+        assert file.read() == b"x"
+
+
+def test_cleanup_removes_old_files(lock_dir):
+    old_lock, old_result, new_lock = lock_dir / "a.lock", lock_dir / "a.result", lock_dir / "b.lock"
+    for path in (old_lock, old_result, new_lock):
+        path.write_bytes(b"")
+    age(old_lock, 3600)
+    age(old_result, 3600)
+
+    singleflight.cleanup()
+
+    assert not old_lock.exists()
+    assert not old_result.exists()
+    assert new_lock.exists()
+
+
+def test_cleanup_keeps_held_locks(lock_dir):
+    path = lock_dir / "held.lock"
+    with open(path, "ab") as holder:
+        fcntl.flock(holder, fcntl.LOCK_EX)
+        age(path, 3600)
+
+        singleflight.cleanup()
+
+        assert path.exists()
+        assert singleflight._same_file(holder, str(path))
+
+
+def test_lock_reopens_a_removed_file(lock_dir):
+    path = str(lock_dir / "key.lock")
+    result = {}
+
+    # a limpeza trava e remove o arquivo que o outro já tinha aberto
+    with open(path, "ab") as cleaner:
+        fcntl.flock(cleaner, fcntl.LOCK_EX)
+        waiter = threading.Thread(target=lambda: result.update(lock_file=singleflight._open_lock(path)))
+        waiter.start()
+        time.sleep(0.2)
+        os.remove(path)
+    waiter.join()
+
+    with result["lock_file"] as lock_file:
+        assert singleflight._same_file(lock_file, path)
+
+
+def test_try_lock_has_a_single_holder(lock_dir):
+    holder = singleflight.try_lock("leader")
+    assert holder is not None
+    assert singleflight.try_lock("leader") is None
+
+    holder.close()
+    with singleflight.try_lock("leader") as other:
+        assert other is not None
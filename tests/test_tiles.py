@@ -0,0 +1,160 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import utils.assets as assets
+import utils.tiles as tile_utils
+from models.params import MoonPngParams
+
+
+def make_params(**kwargs):
+    return MoonPngParams(
+        **{"kind": "observed", "model": "merge_as", "variable": "prec", "aggregation": "mean", "contourf": True, **kwargs}
+    )
+
+
+@pytest.fixture
+def paths(tmp_path):
+    path = tmp_path / "a.nc"
+    path.write_bytes(b"data")
+    return [str(path)]
+
+
+@pytest.fixture
+def shapes(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, "SHAPES_DIR", str(tmp_path))
+    monkeypatch.setattr(assets, "_shapes", {})
+    monkeypatch.setattr(assets, "ASSETS_CHECK_INTERVAL", 0)
+
+    def write(name, box):
+        geometry = {
+            "type": "Polygon",
+            "coordinates": [[[box[0], box[2]], [box[1], box[2]], [box[1], box[3]], [box[0], box[3]], [box[0], box[2]]]],
+        }
+        path = tmp_path / f"{name}.geojson"
+        path.write_text(json.dumps({
+            "type": "FeatureCollection",
+            "features": [{"type": "Feature", "properties": {}, "geometry": geometry}],
+        }))
+        return str(path)
+
+    return write
+
+
+def test_field_key_ignores_style(paths):
+    key = tile_utils.field_key(make_params(), paths)
+    assert tile_utils.field_key(make_params(levels=[0, 1, 2], dpi=300, extent="BR"), paths) == key
+    assert tile_utils.field_key(make_params(aggregation="max"), paths) != key
+
+
+def test_field_key_depends_on_mask(paths, shapes):
+    path = shapes("area", [-50, -40, -20, -10])
+    key = tile_utils.field_key(make_params(), paths)
+    masked = tile_utils.field_key(make_params(mask="area"), paths)
+    assert masked != key
+
+    # geojson alterado: outro campo
+    mtime = os.path.getmtime(path)
+    shapes("area", [-60, -40, -20, -10])
+    os.utime(path, (mtime + 10, mtime + 10))
+    assert tile_utils.field_key(make_params(mask="area"), paths) != masked
+
+
+def test_tile_key_depends_on_style_tile_and_profile(paths):
+    field = tile_utils.field_key(make_params(), paths)
+    key = tile_utils.tile_key(field, make_params(), 3, 2, 1)
+    assert tile_utils.tile_key(field, make_params(dpi=300), 3, 2, 1) == key
+    assert tile_utils.tile_key(field, make_params(levels=[0, 1, 2]), 3, 2, 1) != key
+    assert tile_utils.tile_key(field, make_params(colorbar="prec"), 3, 2, 1) != key
+    assert tile_utils.tile_key(field, make_params(), 3, 2, 2) != key
+    assert tile_utils.tile_key(field, make_params(), 3, 2, 1, "webp") != key
+
+
+def test_unsupported_params_are_rejected():
+    tile_utils.validate_params(make_params())
+    tile_utils.validate_params(make_params(renderer="raster"))
+
+    for kwargs in ({"renderer": "matplotlib"}, {"contour": True}, {"shapecontours": "area"}):
+        with pytest.raises(HTTPException) as error:
+            tile_utils.validate_params(make_params(**kwargs))
+        assert error.value.status_code == 400
+        assert error.value.detail["params"] == list(kwargs)
+
+
+def test_tiles_endpoint_rejects_unsupported_params():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    response = TestClient(main.app).get(
+        "/tiles/0/0/0.png",
+        params={"kind": "observed", "model": "merge_as", "variable": "prec", "contourf": True, "renderer": "matplotlib"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"]["params"] == ["renderer"]
+
+
+def test_tiles_endpoint_accepts_default_params(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    # só a validação interessa: o tile em si não é gerado
+    monkeypatch.setattr(main, "prepare_tile", lambda *args: (_ for _ in ()).throw(HTTPException(status_code=404)))
+    response = TestClient(main.app).get(
+        "/tiles/0/0/0.png", params={"kind": "observed", "model": "merge_as", "variable": "prec", "contourf": True}
+    )
+    assert response.status_code == 404
+
+
+def test_mask_is_applied_to_the_field(paths, shapes, monkeypatch):
+    import xarray as xr
+
+    shapes("area", [-50, -40, -20, -10])
+    # centros ímpares: nenhuma célula na borda do polígono
+    lons = np.arange(-59.0, -30.0, 2.0)
+    lats = np.arange(-29.0, 0.0, 2.0)
+    dataset = xr.DataArray(
+        np.ones((lats.size, lons.size)), coords={"latitude": lats, "longitude": lons}, dims=("latitude", "longitude")
+    )
+    monkeypatch.setattr(tile_utils.aggregations, "aggregate", lambda validated_paths, params, extent=None: dataset)
+
+    data, field_lons, field_lats = tile_utils._load_field(make_params(mask="area"), paths)
+    inside = (np.abs(field_lons[None, :] + 45) < 5) & (np.abs(field_lats[:, None] + 15) < 5)
+    assert np.all(data[inside] == 1)
+    assert np.all(np.isnan(data[~inside]))
+
+
+def test_oversized_field_is_read_per_tile(paths, monkeypatch):
+    import xarray as xr
+
+    rng = np.random.default_rng(0)
+    lons = np.arange(-179.5, 180.0, 1.0)
+    lats = np.arange(-84.5, 85.0, 1.0)
+    dataset = xr.DataArray(
+        rng.normal(0, 10, (lats.size, lons.size)), coords={"latitude": lats, "longitude": lons}, dims=("latitude", "longitude")
+    )
+    extents = []
+
+    def aggregate(validated_paths, params, extent=None):
+        extents.append(extent)
+        return tile_utils.nc_utils.apply_window(dataset, extent) if extent else dataset
+
+    monkeypatch.setattr(tile_utils.aggregations, "aggregate", aggregate)
+    monkeypatch.setattr(tile_utils, "_fields", tile_utils.OrderedDict())
+    monkeypatch.setattr(tile_utils, "_oversized", set())
+    monkeypatch.setattr(tile_utils, "FIELD_CACHE_MAX_BYTES", 0)
+
+    params = make_params(levels=list(range(-30, 31, 5)))
+    key = tile_utils.field_key(params, paths)
+    full = tile_utils._load_field(params, paths)
+    extents.clear()
+
+    # o primeiro tile descobre que o campo não cabe; os seguintes leem só a janela
+    for z, x, y in [(3, 2, 4), (3, 2, 4), (4, 5, 9), (2, 0, 1)]:
+        image = tile_utils.get_tile(params, paths, key, z, x, y)
+        assert image == tile_utils.render_tile(full, params, z, x, y)
+    assert extents == [None] + [tile_utils.tile_extent(*tile) for tile in [(3, 2, 4), (4, 5, 9), (2, 0, 1)]]
@@ -1,5 +1,15 @@
+import os
+
+import numpy as np
 from fastapi import HTTPException
 
+import utils.netcdf as nc_utils
+import utils.partials as partials
+
+# A partir de quantos arquivos a redução passa a ser feita arquivo a arquivo
+STREAMING_MIN_FILES = int(os.environ.get("MOONPNG_STREAMING_MIN_FILES", 48))
+STREAMING_METHODS = partials.PARTIAL_METHODS + ["first", "last"]
+
 def apply(dataset, params):
     if params.aggregation == "mean":
         return dataset.mean(dim="time")
@@ -22,4 +32,66 @@ def apply(dataset, params):
     elif params.aggregation == "last":  
         return dataset.isel(time=-1)
     else:
-        raise HTTPException(status_code=400, detail="Aggregation method not supported")
\ No newline at end of file
+        raise HTTPException(status_code=400, detail="Aggregation method not supported")
+
+
+def _open_file(path, variable, extent):
+    try:
+        dataarray = nc_utils.open_dataset(path)[variable]
+        if extent:
+            dataarray = nc_utils.apply_window(dataarray, extent)
+        return dataarray
+    except Exception as e:
+        msg = {
+            "function_name": f"stream()",
+            "message": f"something is wrong:\n{path}",
+            "error": e,
+        }
+        raise HTTPException(
+            status_code=400,
+            detail=msg,
+        )
+
+
+def stream(validated_paths, params, extent=None):
+    """
+    Redução temporal arquivo a arquivo, mantendo em memória só os
+    acumuladores. O consumo de memória não depende do tamanho do intervalo.
+    """
+    if params.aggregation == "first":
+        return _open_file(validated_paths[0], params.variable, extent).isel(time=0).load()
+    elif params.aggregation == "last":
+        return _open_file(validated_paths[-1], params.variable, extent).isel(time=-1).load()
+
+    try:
+        total, template = partials.reduce_files(
+            validated_paths, lambda path: _open_file(path, params.variable, extent)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"function_name": "stream()", "message": str(e)})
+
+    values = np.array(partials.finalize_partial(total, params.aggregation))
+    if params.aggregation != "count" and np.issubdtype(template.dtype, np.floating):
+        values = values.astype(template.dtype)
+    return template.copy(data=values)
+
+
+def aggregate(validated_paths, params, extent=None):
+    """
+    Abre os arquivos e aplica a agregação temporal. Usa as parciais
+    pré-calculadas quando o método permite e a redução arquivo a arquivo
+    para intervalos longos.
+    """
+    if partials.STORE_DIR and params.aggregation in partials.PARTIAL_METHODS:
+        dataarray = partials.aggregate(validated_paths, params, extent=extent)
+        if dataarray is not None:
+            return dataarray
+
+    if len(validated_paths) >= STREAMING_MIN_FILES and params.aggregation in STREAMING_METHODS:
+        return stream(validated_paths, params, extent=extent)
+
+    dataset = nc_utils.get_data(validated_paths, params.variable, extent=extent)
+    dataarray = apply(dataset, params)
+    # atributos da variável (ex.: flag_values, que escolhem a redução de resolução)
+    dataarray.attrs = dict(dataset.attrs)
+    return dataarray
@@ -0,0 +1,237 @@
+import os
+
+import cartopy.crs as ccrs
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from matplotlib.ticker import MaxNLocator
+from PIL import Image
+
+import utils.cache as cache
+import utils.colorbar as colorbar_utils
+import utils.encode as encode
+import utils.mask as mask_utils
+import utils.metrics as metrics
+import utils.netcdf as nc_utils
+import utils.paths as path_utils
+import utils.plot as plot_utils
+import utils.render as render_utils
+import utils.stream as stream
+from models.params import MoonPngParams
+from utils.bounding_box import get_bbox
+from utils.levels import get_levels
+# Limite de quadros por animação: todos ficam em memória até a codificação
+ANIMATION_MAX_FRAMES = int(os.environ.get("MOONPNG_ANIMATION_MAX_FRAMES", 96))
+# Duração padrão de cada quadro (ms)
+ANIMATION_FRAME_MS = int(os.environ.get("MOONPNG_ANIMATION_FRAME_MS", 500))
+
+# Animações num arquivo ou quadros em PNG enviados à medida que ficam prontos
+FORMATS = encode.ANIMATION_FORMATS + stream.STREAM_FORMATS
+
+
+def validate(fmt, times=None, step=None):
+    if fmt not in FORMATS or (fmt == "webp" and not encode.is_supported("webp")):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato '{fmt}' inválido. Use um de {FORMATS}.",
+        )
+
+    if times and step:
+        raise HTTPException(status_code=400, detail="Use 'times' ou 'step', não os dois.")
+
+    if times and len(times) > ANIMATION_MAX_FRAMES:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Quadros demais.", "max_frames": ANIMATION_MAX_FRAMES},
+        )
+
+    try:
+        for value in times or []:
+            pd.Timestamp(value)
+        if step:
+            pd.Timedelta(step)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def get_range(params: MoonPngParams, times=None):
+    """
+    Parâmetros com o intervalo de arquivos que cobre os quadros: dos horários
+    pedidos ou de initDate a endDate. O início é arredondado para a
+    frequência dos arquivos, já que cada um guarda vários horários.
+    """
+    if times:
+        times = sorted(pd.Timestamp(value) for value in times)
+        start, end = times[0], times[-1]
+    elif not (params.initDate and params.endDate):
+        raise HTTPException(status_code=400, detail="Informe 'times' ou o intervalo (initDate e endDate).")
+    else:
+        start, end = pd.Timestamp(params.initDate), pd.Timestamp(params.endDate)
+
+    _, freq = path_utils.gen_path_template(params)
+    return params.model_copy(
+        update={"initDate": start.floor(freq).isoformat(), "endDate": end.isoformat()}
+    )
+
+
+def make_key(params: MoonPngParams, validated_paths, times, step, fmt, duration):
+    return cache.make_key(
+        [(params, validated_paths)],
+        {"animation": fmt, "duration": duration, "times": times, "step": step},
+        # com `times`, os quadros não dependem do intervalo
+        dates=not times,
+    )
+
+
+def select_times(dataarray, params: MoonPngParams, times=None, step=None):
+    """
+    Horários dos quadros: os pedidos em `times`, os de initDate a endDate a
+    cada `step` ou, sem nenhum dos dois, todos os do intervalo.
+    """
+    if "time" not in dataarray.dims:
+        raise HTTPException(status_code=400, detail="Os dados não têm dimensão de tempo.")
+
+    available = pd.DatetimeIndex(dataarray.time.values)
+    if times:
+        wanted = pd.DatetimeIndex([pd.Timestamp(value) for value in times])
+        missing = wanted.difference(available)
+        if len(missing):
+            raise HTTPException(
+                status_code=400,
+                detail={"message": "Horários sem dados.", "times": [t.isoformat() for t in missing]},
+            )
+        dataarray = dataarray.sel(time=wanted)
+    else:
+        dataarray = dataarray.sel(time=slice(params.initDate, params.endDate))
+        if step:
+            wanted = pd.date_range(params.initDate, params.endDate, freq=step)
+            dataarray = dataarray.isel(time=np.flatnonzero(pd.DatetimeIndex(dataarray.time.values).isin(wanted)))
+
+    if dataarray.sizes["time"] == 0:
+        raise HTTPException(status_code=400, detail="Nenhum horário com dados no intervalo.")
+    if dataarray.sizes["time"] > ANIMATION_MAX_FRAMES:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Quadros demais.", "max_frames": ANIMATION_MAX_FRAMES},
+        )
+    return dataarray
+
+
+def get_style(params: MoonPngParams, data):
+    """
+    Níveis, cmap e norm fixos para todos os quadros, para a barra de cores
+    valer para a animação inteira.
+    """
+    if params.colorbar:
+        return colorbar_utils.add_colorbar(params.colorbar)
+
+    levels = get_levels(params)
+    if levels is None:
+        levels = MaxNLocator(8).tick_values(np.nanmin(data), np.nanmax(data))
+    return levels, None, None
+
+
+def _tight_crop(figure):
+    """
+    Recorte (linhas, colunas) do buffer equivalente ao bbox_inches="tight"
+    do savefig.
+    """
+    bbox = figure.get_tightbbox(figure.canvas.get_renderer())
+    _, height = figure.canvas.get_width_height()
+    dpi = figure.dpi
+    top = max(height - int(round(bbox.y1 * dpi)), 0)
+    left = max(int(round(bbox.x0 * dpi)), 0)
+    return (
+        slice(top, top + int(bbox.height * dpi)),
+        slice(left, left + int(bbox.width * dpi)),
+    )
+
+
+def render_frames(params: MoonPngParams, validated_paths: list, times=None, step=None):
+    """
+    Gera (horário, imagem) de cada quadro. Os dados são lidos uma única vez
+    e o fundo (mapa base, gridlines e barra de cores) é desenhado só no
+    primeiro quadro; nos demais, só o campo e o que fica acima dele são
+    redesenhados sobre o fundo salvo.
+    """
+    extent = get_bbox(params)
+    read_extent = mask_utils.get_mask_extent(params.mask, extent, pad=1) if params.mask else extent
+
+    source = None
+    try:
+        with metrics.stage("aggregate"):
+            source = nc_utils.get_data(validated_paths, params.variable, extent=read_extent)
+            cube = select_times(source, params, times, step).load()
+    finally:
+        if source is not None:
+            nc_utils.close_and_destroy(source)
+
+    figure, ax = render_utils.new_figure()
+    figure.set_dpi(params.dpi)
+    canvas = figure.canvas
+    if extent:
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+
+    levels, cmap, norm = get_style(params, cube.values)
+    artist, background, foreground, crop = None, None, [], None
+
+    for i, time in enumerate(pd.DatetimeIndex(cube.time.values)):
+        _, lons, lats, data = render_utils.prepare_layer(cube.isel(time=i), params, extent)
+        lons, lats = np.meshgrid(lons, lats)
+
+        if artist is not None:
+            artist.remove()
+        if params.contourf:
+            artist = ax.contourf(lons, lats, data, transform=ccrs.PlateCarree(), levels=levels, cmap=cmap, norm=norm)
+        else:
+            artist = ax.contour(lons, lats, data, colors=params.color, linewidths=params.linewidths, levels=levels, zorder=params.zorder, transform=ccrs.PlateCarree())
+        artist.set_animated(True)
+
+        if background is None:
+            if params.contourf:
+                # mesma barra de cores do GET, fora dos eixos: fica no fundo
+                figure.colorbar(artist, ax=ax, orientation="horizontal", pad=0.05, aspect=50, label=params.variable)
+            if params.details:
+                plot_utils.draw_basemap(ax, params)
+            if params.gridlines:
+                plot_utils.draw_gridlines(ax, params)
+
+            # o que fica acima do campo sai do fundo e é redesenhado a cada quadro
+            foreground = sorted(
+                (a for a in [*ax.images, *ax.artists, *ax.spines.values()] if a.get_zorder() >= artist.get_zorder()),
+                key=lambda a: a.get_zorder(),
+            )
+            for a in foreground:
+                a.set_animated(True)
+
+            canvas.draw()
+            background = canvas.copy_from_bbox(figure.bbox)
+            crop = _tight_crop(figure)
+        else:
+            canvas.restore_region(background)
+
+        for a in [artist, *foreground]:
+            ax.draw_artist(a)
+
+        yield time, Image.fromarray(np.array(canvas.buffer_rgba())[crop], "RGBA")
+
+
+def render_animation(params: MoonPngParams, validated_paths: list, times=None, step=None, fmt="webp", duration=ANIMATION_FRAME_MS) -> bytes:
+    """
+    Renderiza todos os quadros e retorna a animação codificada.
+    """
+    frames = [image for _, image in render_frames(params, validated_paths, times, step)]
+    return encode.encode_animation(frames, fmt, duration)
+
+
+def write_frames(params: MoonPngParams, validated_paths: list, times, step, directory) -> int:
+    """
+    Grava cada quadro em PNG no diretório assim que fica pronto, para ser
+    enviado enquanto os próximos são desenhados.
+    """
+    count = 0
+    for time, image in render_frames(params, validated_paths, times, step):
+        data = encode.encode_image(image, "png", frame=count)
+        stream.write_file(directory, count, f"{time:%Y%m%d%H%M}.png", data)
+        count += 1
+    return count
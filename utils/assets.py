@@ -0,0 +1,252 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import shapely
+from fastapi import HTTPException
+from matplotlib.colors import BoundaryNorm, ListedColormap
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Tabelas de cores ({nome}.json) das colorbars
+COLORBARS_DIR = os.environ.get("MOONPNG_COLORBARS_DIR", "data/cmaps")
+# Geojsons ({nome}.geojson) das máscaras e dos shapecontours
+SHAPES_DIR = os.environ.get("MOONPNG_SHAPES_DIR", "data/cmaps/geojsons")
+# De quanto em quanto tempo (segundos) um arquivo já lido é conferido no
+# disco (0 confere a cada uso)
+ASSETS_CHECK_INTERVAL = float(os.environ.get("MOONPNG_ASSETS_CHECK_INTERVAL", 5))
+
+# Nomes vêm da requisição e viram caminhos: nada de "/" nem ".." no início
+_NAME = re.compile(r"^[\w-][\w.-]*$")
+
+_colorbars = {}
+_shapes = {}
+_errors = {}
+_lock = threading.Lock()
+
+
+def colorbar_path(name):
+    return os.path.join(COLORBARS_DIR, f"{name}.json")
+
+
+def shape_path(name):
+    return os.path.join(SHAPES_DIR, f"{name}.geojson")
+
+
+def build_colorbar(name, definition):
+    """
+    Valida uma definição {"scale": [níveis], "cmap": [[r, g, b], ...]} e
+    monta (níveis, cmap, norm). Levanta ValueError se for inválida.
+    """
+    if not isinstance(definition, dict) or "scale" not in definition or "cmap" not in definition:
+        raise ValueError("esperado {'scale': [...], 'cmap': [[r, g, b], ...]}")
+
+    try:
+        levels = np.asarray(definition["scale"], dtype="float64")
+        colors = np.asarray(definition["cmap"], dtype="float64")
+    except (TypeError, ValueError):
+        raise ValueError("scale e cmap devem ser listas numéricas")
+
+    if levels.ndim != 1 or levels.size < 2 or not np.all(np.diff(levels) > 0):
+        raise ValueError("scale deve ser crescente e ter ao menos 2 níveis")
+    if colors.ndim != 2 or colors.shape[1] not in (3, 4) or colors.min() < 0 or colors.max() > 255:
+        raise ValueError("cmap deve ser uma lista de cores RGB ou RGBA entre 0 e 255")
+    if len(colors) < levels.size - 1:
+        raise ValueError(f"cmap tem {len(colors)} cores para {levels.size - 1} intervalos")
+
+    cmap = ListedColormap(colors / 255.0, name)
+    norm = BoundaryNorm(levels, cmap.N)
+    return list(definition["scale"]), cmap, norm
+
+
+def _load_colorbar(name, path):
+    with open(path) as file:
+        data = json.load(file)
+    if not isinstance(data, dict) or name not in data:
+        raise ValueError(f"o arquivo não tem a chave '{name}'")
+    levels, cmap, norm = build_colorbar(name, data[name])
+    return {"levels": levels, "cmap": cmap, "norm": norm}
+
+
+def _load_shape(name, path):
+    import geopandas as gpd
+
+    frame = gpd.read_file(path)
+    # PlateCarree: longitude e latitude em graus
+    if frame.crs is not None and not frame.crs.is_geographic:
+        frame = frame.to_crs(4326)
+
+    geometries = np.array(list(frame.geometry), dtype=object)
+    if geometries.size:
+        geometries = geometries[~(shapely.is_missing(geometries) | shapely.is_empty(geometries))]
+    if not geometries.size:
+        raise ValueError("nenhuma geometria")
+    invalid = ~shapely.is_valid(geometries)
+    if invalid.any():
+        geometries[invalid] = shapely.make_valid(geometries[invalid])
+
+    return {
+        "geometries": geometries,
+        "tree": shapely.STRtree(geometries),
+        "bounds": [float(value) for value in shapely.total_bounds(geometries)],
+    }
+
+
+def _invalid(kind, name, path, error):
+    return HTTPException(
+        status_code=500,
+        detail={"message": f"{kind} '{name}' inválido.", "path": path, "error": error},
+    )
+
+
+def _get(registry, kind, name, path, load):
+    """
+    Entrada do registro, lida e validada na primeira vez e de novo sempre
+    que o arquivo mudar. O arquivo é conferido no disco no máximo a cada
+    ASSETS_CHECK_INTERVAL segundos, e um arquivo inválido só é lido de novo
+    quando mudar.
+    """
+    if not isinstance(name, str) or not _NAME.match(name):
+        raise HTTPException(status_code=400, detail=f"Nome de {kind} inválido: '{name}'.")
+
+    now = time.monotonic()
+    entry = registry.get(name)
+    failure = _errors.get((kind, name))
+    if entry is not None and now - entry["checked"] < ASSETS_CHECK_INTERVAL:
+        return entry
+    if failure is not None and now - failure["checked"] < ASSETS_CHECK_INTERVAL:
+        raise _invalid(kind, name, path, failure["error"])
+
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        with _lock:
+            registry.pop(name, None)
+            _errors.pop((kind, name), None)
+        raise HTTPException(status_code=400, detail=f"{kind} '{name}' não encontrado.")
+
+    if entry is not None and entry["mtime"] == mtime:
+        entry["checked"] = now
+        return entry
+    if failure is not None and failure["mtime"] == mtime:
+        failure["checked"] = now
+        raise _invalid(kind, name, path, failure["error"])
+
+    try:
+        entry = {"name": name, "path": path, "mtime": mtime, "checked": now, **load(name, path)}
+    except Exception as e:
+        with _lock:
+            registry.pop(name, None)
+            _errors[(kind, name)] = {"mtime": mtime, "checked": now, "error": str(e)}
+        logger.warning({"message": "asset inválido", "kind": kind, "name": name, "path": path, "error": str(e)})
+        raise _invalid(kind, name, path, str(e))
+
+    with _lock:
+        reloaded = name in registry
+        registry[name] = entry
+        _errors.pop((kind, name), None)
+    logger.info({"message": "asset recarregado" if reloaded else "asset carregado", "kind": kind, "name": name, "path": path})
+    return entry
+
+
+def get_colorbar(name):
+    """
+    Colorbar do registro: {"levels", "cmap", "norm", ...}.
+    """
+    return _get(_colorbars, "colorbar", name, colorbar_path(name), _load_colorbar)
+
+
+def get_shape(name):
+    """
+    Geojson do registro: {"geometries", "tree", "bounds", ...}, com as
+    geometrias em PlateCarree, válidas e indexadas (STRtree).
+    """
+    return _get(_shapes, "geojson", name, shape_path(name), _load_shape)
+
+
+def query(shape, extent=None):
+    """
+    Geometrias de `shape` que intersectam o extent [lon_min, lon_max,
+    lat_min, lat_max], na ordem do arquivo. Sem extent, todas.
+    """
+    if extent is None or np.isnan(extent[0]):
+        return shape["geometries"]
+    box = shapely.box(extent[0], extent[2], extent[1], extent[3])
+    return shape["geometries"][np.sort(shape["tree"].query(box, predicate="intersects"))]
+
+
+def load_all():
+    """
+    Carrega todos os arquivos dos diretórios; os inválidos ficam em
+    describe()["errors"].
+    """
+    names = [
+        (get_colorbar, os.path.basename(path)[:-len(".json")])
+        for path in sorted(glob.glob(os.path.join(COLORBARS_DIR, "*.json")))
+    ] + [
+        (get_shape, os.path.basename(path)[:-len(".geojson")])
+        for path in sorted(glob.glob(os.path.join(SHAPES_DIR, "*.geojson")))
+    ]
+    for get, name in names:
+        try:
+            get(name)
+        except HTTPException:
+            pass
+
+
+def clear():
+    """
+    Esvazia o registro: tudo é lido de novo no próximo uso.
+    """
+    with _lock:
+        _colorbars.clear()
+        _shapes.clear()
+        _errors.clear()
+
+
+def _modified(mtime):
+    return datetime.fromtimestamp(mtime, tz=timezone.utc).isoformat()
+
+
+def describe():
+    """
+    O que está carregado em memória neste processo.
+    """
+    with _lock:
+        colorbars, shapes, errors = list(_colorbars.values()), list(_shapes.values()), dict(_errors)
+
+    return {
+        "colorbars": [
+            {
+                "name": entry["name"],
+                "path": entry["path"],
+                "modified": _modified(entry["mtime"]),
+                "levels": len(entry["levels"]),
+                "colors": entry["cmap"].N,
+                "range": [entry["levels"][0], entry["levels"][-1]],
+            }
+            for entry in sorted(colorbars, key=lambda entry: entry["name"])
+        ],
+        "shapes": [
+            {
+                "name": entry["name"],
+                "path": entry["path"],
+                "modified": _modified(entry["mtime"]),
+                "geometries": int(entry["geometries"].size),
+                "geometry_types": sorted({geometry.geom_type for geometry in entry["geometries"]}),
+                "bounds": entry["bounds"],
+            }
+            for entry in sorted(shapes, key=lambda entry: entry["name"])
+        ],
+        "errors": [
+            {"kind": kind, "name": name, "modified": _modified(failure["mtime"]), "error": failure["error"]}
+            for (kind, name), failure in sorted(errors.items())
+        ],
+    }
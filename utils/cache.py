@@ -0,0 +1,243 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import orjson
+
+import utils.singleflight as singleflight
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Incrementar quando uma mudança no pipeline alterar as imagens geradas
+CACHE_VERSION = 3
+
+# Limite do LRU em memória (por worker)
+CACHE_MAX_BYTES = int(os.environ.get("MOONPNG_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Camada em disco compartilhada entre os workers do gunicorn (desligada se vazio)
+CACHE_DIR = os.environ.get("MOONPNG_CACHE_DIR", "")
+CACHE_DISK_MAX_BYTES = int(os.environ.get("MOONPNG_CACHE_DISK_MAX_BYTES", 4 * 1024 * 1024 * 1024))
+CACHE_DISK_PRUNE_EVERY = 100
+
+_memory = OrderedDict()
+_memory_bytes = 0
+_lock = threading.Lock()
+_disk_writes = 0
+
+
+def canonicalize(params, dates=False):
+    """
+    Representação canônica dos parâmetros validados, usada na chave do cache.
+
+    As datas ficam fora por padrão: elas só escolhem os arquivos de entrada,
+    que já entram na chave pela identidade (get_file_identities). Com
+    `dates=True` (operações que recortam o tempo dentro dos arquivos, como
+    as animações), entra o intervalo normalizado ou, sem intervalo, a data.
+    """
+    data = params.model_dump()
+
+    normalized = {}
+    for field in ("date", "initDate", "endDate"):
+        value = data.pop(field, None)
+        if isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value).isoformat()
+            except ValueError:
+                pass
+        normalized[field] = value
+
+    if dates:
+        if normalized["initDate"] and normalized["endDate"]:
+            data["initDate"] = normalized["initDate"]
+            data["endDate"] = normalized["endDate"]
+        else:
+            data["date"] = normalized["date"]
+
+    if isinstance(data.get("extent"), str):
+        data["extent"] = data["extent"].upper()
+
+    return data
+
+
+def get_file_identities(paths):
+    """
+    Identidade dos arquivos de entrada: caminho, mtime e tamanho. Sempre do
+    disco: o catálogo só lista os arquivos e pode estar uma varredura atrás
+    de um arquivo sobrescrito.
+    """
+    identities = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            identities.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            identities.append((path, None, None))
+    return identities
+
+
+def make_key(layers, profile="png", dates=False):
+    """
+    Gera a chave do cache a partir de uma lista de (params, validated_paths)
+    e do perfil de codificação da imagem. `dates` como em canonicalize.
+    """
+    payload = {
+        "version": CACHE_VERSION,
+        "profile": profile,
+        "layers": [
+            {
+                "params": canonicalize(params, dates),
+                "files": get_file_identities(paths),
+            }
+            for params, paths in layers
+        ],
+    }
+    return hashlib.sha256(
+        orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)
+    ).hexdigest()
+
+
+def _disk_path(key):
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.bin")
+
+
+def _memory_set(key, data):
+    global _memory_bytes
+
+    if len(data) > CACHE_MAX_BYTES:
+        return
+
+    with _lock:
+        if key in _memory:
+            _memory_bytes -= len(_memory.pop(key))
+        _memory[key] = data
+        _memory_bytes += len(data)
+
+        while _memory_bytes > CACHE_MAX_BYTES:
+            _, evicted = _memory.popitem(last=False)
+            _memory_bytes -= len(evicted)
+
+
+def _disk_get(key):
+    path = _disk_path(key)
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+
+def _disk_set(key, data):
+    global _disk_writes
+
+    path = _disk_path(key)
+    if os.path.exists(path):
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning({"message": "falha ao gravar cache em disco", "error": str(e)})
+        return
+
+    _disk_writes += 1
+    if _disk_writes % CACHE_DISK_PRUNE_EVERY == 0:
+        prune_disk()
+
+
+def prune_disk():
+    """
+    Remove os arquivos menos usados até o cache em disco caber no limite.
+    """
+    entries = []
+    total = 0
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= CACHE_DISK_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def get(key):
+    """
+    Busca a imagem no LRU em memória e, em seguida, no disco.
+    """
+    with _lock:
+        data = _memory.get(key)
+        if data is not None:
+            _memory.move_to_end(key)
+            return data
+
+    if CACHE_DIR:
+        data = _disk_get(key)
+        if data is not None:
+            _memory_set(key, data)
+            return data
+
+    return None
+
+
+def peek(key):
+    """
+    Busca a imagem só no LRU em memória, sem acessar o disco.
+    """
+    with _lock:
+        data = _memory.get(key)
+        if data is not None:
+            _memory.move_to_end(key)
+        return data
+
+
+def set(key, data):
+    _memory_set(key, data)
+    if CACHE_DIR:
+        _disk_set(key, data)
+
+
+def clear():
+    global _memory_bytes
+
+    with _lock:
+        _memory.clear()
+        _memory_bytes = 0
+
+
+def render_cached(key, render) -> bytes:
+    """
+    Retorna a imagem do cache ou renderiza uma única vez para todas as
+    requisições idênticas em andamento.
+    """
+    image = get(key)
+    if image is None:
+        image = singleflight.do(key, render)
+        set(key, image)
+    return image
@@ -0,0 +1,395 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+import utils.paths as path_utils
+from models.params import VALID_KINDS
+from utils.logger import get_logger
+
+logger = get_logger()
+
+CATALOG_ENABLED = os.environ.get("MOONPNG_CATALOG", "1") == "1"
+# Intervalo entre as varreduras em segundo plano (só os dias recentes)
+CATALOG_RESCAN_SECONDS = float(os.environ.get("MOONPNG_CATALOG_RESCAN_SECONDS", 60))
+# Intervalo entre as varreduras completas em segundo plano (todos os dias)
+CATALOG_FULL_RESCAN_SECONDS = float(os.environ.get("MOONPNG_CATALOG_FULL_RESCAN_SECONDS", 6 * 3600))
+# Diretórios modificados há menos que isso são sempre relidos (arquivos sobrescritos)
+CATALOG_RECENT_SECONDS = float(os.environ.get("MOONPNG_CATALOG_RECENT_SECONDS", 2 * 86400))
+# Fontes varridas por completo na inicialização (separadas por vírgula)
+CATALOG_SOURCES = [s for s in os.environ.get("MOONPNG_CATALOG_SOURCES", "").split(",") if s]
+# Fontes que o /catalog/times aceita (padrão: as de MOONPNG_CATALOG_SOURCES
+# ou, sem elas, /data)
+CATALOG_ALLOWED_SOURCES = [
+    s for s in os.environ.get("MOONPNG_CATALOG_ALLOWED_SOURCES", ",".join(CATALOG_SOURCES) or "/data").split(",") if s
+]
+# Produtos mantidos no catálogo (os menos consultados saem primeiro); os
+# fixados pela pré-renderização não contam
+CATALOG_MAX_PRODUCTS = int(os.environ.get("MOONPNG_CATALOG_MAX_PRODUCTS", 1024))
+
+MEMBER_TOKEN = "{member}"
+
+_products = OrderedDict()
+_identities = {}
+_listeners = []
+_lock = threading.Lock()
+_thread = None
+
+
+def _template(source, kind, model, variable, member):
+    params = SimpleNamespace(
+        source=source, kind=kind, model=model, variable=variable, member=member
+    )
+    return path_utils.gen_path_template(params)
+
+
+def _new_product(key, path_template):
+    root = path_template[: path_template.index("%")]
+    return {
+        "key": key,
+        "root": root,
+        "file_format": os.path.basename(path_template),
+        "dirs": {},
+        # (times em ns, caminhos) ordenados por tempo, trocados atomicamente
+        "index": (np.array([], dtype="int64"), []),
+        "scanned_at": 0.0,
+        "pinned": False,
+    }
+
+
+def _listdir(path):
+    try:
+        return sorted(entry.path for entry in os.scandir(path) if entry.is_dir())
+    except OSError:
+        return []
+
+
+def _scan_dir(product, dir_path):
+    files = {}
+    try:
+        entries = list(os.scandir(dir_path))
+    except OSError:
+        return files
+
+    for entry in entries:
+        try:
+            timestamp = datetime.strptime(entry.name, product["file_format"])
+        except ValueError:
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        path = os.path.join(dir_path, entry.name)
+        files[path] = (pd.Timestamp(timestamp).value, stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def _dir_day(dir_path):
+    # data de um diretório {%Y}/{%j}, ou None se o nome não for uma data
+    day_dir = dir_path.rstrip(os.sep)
+    try:
+        year = int(os.path.basename(os.path.dirname(day_dir)))
+        return datetime(year, 1, 1) + timedelta(days=int(os.path.basename(day_dir)) - 1)
+    except ValueError:
+        return None
+
+
+def scan(product, recent_only=False):
+    """
+    Atualiza o índice de um produto. Só relê os diretórios {%Y}/{%j} cujo
+    mtime mudou, além dos recentes. Com `recent_only`, os diretórios de dias
+    anteriores a CATALOG_RECENT_SECONDS nem são consultados.
+    """
+    now = time.time()
+    seen = set()
+    changed = False
+
+    cutoff = datetime.fromtimestamp(now - CATALOG_RECENT_SECONDS).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def is_old(dir_path):
+        day = _dir_day(dir_path)
+        return recent_only and day is not None and day < cutoff
+
+    for year_dir in _listdir(product["root"]):
+        if recent_only and os.path.basename(year_dir).isdigit() and int(os.path.basename(year_dir)) < cutoff.year:
+            continue
+        for day_dir in _listdir(year_dir):
+            dir_path = day_dir + os.sep
+            if is_old(dir_path):
+                continue
+            seen.add(dir_path)
+            try:
+                mtime = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+
+            cached = product["dirs"].get(dir_path)
+            recent = now - mtime / 1e9 < CATALOG_RECENT_SECONDS
+            if cached is not None and cached[0] == mtime and not recent:
+                continue
+
+            files = _scan_dir(product, dir_path)
+            if cached is None or cached[1] != files:
+                changed = True
+            product["dirs"][dir_path] = (mtime, files)
+
+    for dir_path in list(product["dirs"]):
+        if dir_path not in seen and not is_old(dir_path):
+            del product["dirs"][dir_path]
+            changed = True
+
+    if changed or not product["scanned_at"]:
+        entries = sorted(
+            (time_ns, path, mtime, size)
+            for _, files in product["dirs"].values()
+            for path, (time_ns, mtime, size) in files.items()
+        )
+        times = np.array([entry[0] for entry in entries], dtype="int64")
+        paths = [entry[1] for entry in entries]
+        product["index"] = (times, paths)
+        new_paths = [path for _, path, mtime, size in entries if _identities.get(path) != (mtime, size)]
+        for _, path, mtime, size in entries:
+            _identities[path] = (mtime, size)
+
+        # a primeira varredura só constrói o índice
+        if product["scanned_at"] and new_paths:
+            _notify(product["key"], new_paths)
+
+    product["scanned_at"] = now
+    return changed
+
+
+def subscribe(listener):
+    """
+    Registra `listener(chave, caminhos)`, chamado pelas varreduras com a
+    chave do produto e os arquivos novos ou modificados.
+    """
+    _listeners.append(listener)
+
+
+def _notify(key, paths):
+    for listener in _listeners:
+        try:
+            listener(key, paths)
+        except Exception as e:
+            logger.warning({"message": "falha ao avisar sobre arquivos novos", "product": key, "error": str(e)})
+
+
+def _forget(key):
+    product = _products.pop(key)
+    for path in product["index"][1]:
+        _identities.pop(path, None)
+
+
+def _register(key, product):
+    _products[key] = product
+    unpinned = [old for old, entry in _products.items() if not entry["pinned"]]
+    for old in unpinned[: max(len(unpinned) - CATALOG_MAX_PRODUCTS, 0)]:
+        _forget(old)
+
+
+def get_product(source, kind, model, variable, member, path_template=None, pin=False):
+    """
+    Retorna o índice do produto, varrendo o disco na primeira consulta.
+    Produtos sem nenhum arquivo não ficam no catálogo, a não ser que sejam
+    fixados com `pin` (produtos que ainda vão receber arquivos).
+    """
+    key = (source, kind, model, variable, member)
+    with _lock:
+        product = _products.get(key)
+        if product is not None and (product["pinned"] or not pin):
+            _products.move_to_end(key)
+            return product
+
+    if path_template is None:
+        path_template, _ = _template(*key)
+
+    with _lock:
+        product = _products.get(key)
+        if product is None:
+            product = _new_product(key, path_template)
+            scan(product)
+        product["pinned"] = product["pinned"] or pin
+        if product["pinned"] or len(product["index"][0]):
+            _register(key, product)
+    return product
+
+
+def _resolution(path_template):
+    # menor unidade de tempo no nome do arquivo: horários mais finos que ela
+    # apontam para o mesmo arquivo
+    file_format = os.path.basename(path_template)
+    for directive, unit in (("%S", "1s"), ("%M", "1min"), ("%H", "1h"), ("%d", "1D"), ("%j", "1D")):
+        if directive in file_format:
+            return pd.Timedelta(unit).value
+    return 1
+
+
+def get_paths(params, path_template, freq):
+    """
+    Equivalente a get_paths + run_validate: caminhos existentes no intervalo
+    pedido, resolvidos por busca binária no índice, sem stat por arquivo.
+    """
+    product = get_product(
+        params.source, params.kind, params.model, params.variable, params.member, path_template
+    )
+    times, paths = product["index"]
+
+    step = pd.Timedelta(freq).value
+    resolution = _resolution(path_template)
+
+    if params.initDate and params.endDate:
+        start = pd.Timestamp(params.initDate).value
+        offset = start % resolution
+        start, end = start - offset, pd.Timestamp(params.endDate).value - offset
+        lo = int(np.searchsorted(times, start, side="left"))
+        hi = int(np.searchsorted(times, end, side="right"))
+        # mesma grade de tempos do pd.date_range(start, end, freq)
+        aligned = (times[lo:hi] - start) % step == 0
+        return [paths[lo + i] for i in np.flatnonzero(aligned)]
+
+    date = pd.Timestamp(params.date).value
+    date -= date % resolution
+    i = int(np.searchsorted(times, date, side="left"))
+    if i < len(times) and times[i] == date:
+        return [paths[i]]
+    return []
+
+
+def is_allowed_source(source):
+    """
+    Se `source` é uma das fontes de CATALOG_ALLOWED_SOURCES.
+    """
+    return os.path.realpath(source) in {os.path.realpath(allowed) for allowed in CATALOG_ALLOWED_SOURCES}
+
+
+def _parse_time(name, value):
+    try:
+        timestamp = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        timestamp = pd.NaT
+    if pd.isna(timestamp):
+        raise HTTPException(status_code=400, detail={"message": "Data inválida.", "field": name, "value": value})
+    return timestamp.value
+
+
+def get_times(source, kind, model, variable, member, initDate=None, endDate=None):
+    """
+    Horários com arquivo do produto, de initDate a endDate (inclusive).
+    """
+    if kind not in VALID_KINDS:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Tipo inválido.", "kind": kind, "valid_kinds": VALID_KINDS},
+        )
+    if not is_allowed_source(source):
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Fonte de dados não permitida.", "source": source, "valid_sources": CATALOG_ALLOWED_SOURCES},
+        )
+    start = _parse_time("initDate", initDate) if initDate else None
+    end = _parse_time("endDate", endDate) if endDate else None
+
+    product = get_product(source, kind, model, variable, member)
+    times, _ = product["index"]
+
+    lo, hi = 0, len(times)
+    if start is not None:
+        lo = int(np.searchsorted(times, start, side="left"))
+    if end is not None:
+        hi = int(np.searchsorted(times, end, side="right"))
+    return pd.to_datetime(times[lo:hi]).to_pydatetime().tolist()
+
+
+def _discover_members(source, kind, model, variable):
+    path_template, _ = _template(source, kind, model, variable, MEMBER_TOKEN)
+    if MEMBER_TOKEN not in path_template:
+        return ["M000"]
+
+    root = path_template[: path_template.index("%")]
+    years = _listdir(root)
+    days = _listdir(years[-1]) if years else []
+    if not days:
+        return []
+
+    file_format = os.path.basename(path_template)
+    prefix = file_format.split(MEMBER_TOKEN, 1)[0]
+    members = set()
+    for name in os.listdir(days[-1]):
+        if not name.startswith(prefix):
+            continue
+        member = name[len(prefix):].split("_", 1)[0]
+        try:
+            datetime.strptime(name, file_format.replace(MEMBER_TOKEN, member))
+        except ValueError:
+            continue
+        members.add(member)
+    return sorted(members)
+
+
+def discover(source):
+    """
+    Indexa todos os produtos encontrados numa fonte de dados.
+    """
+    for kind in VALID_KINDS:
+        kind_dir = "observed" if kind in ["satellite", "radar"] else kind
+        for model_dir in _listdir(os.path.join(source, kind_dir)):
+            model = os.path.basename(model_dir)
+            for variable_dir in _listdir(model_dir):
+                variable = os.path.basename(variable_dir)
+                for member in _discover_members(source, kind, model, variable):
+                    get_product(source, kind, model, variable, member)
+
+
+def rescan_all(recent_only=False):
+    for product in list(_products.values()):
+        try:
+            with _lock:
+                scan(product, recent_only)
+                # produto que ficou sem arquivos sai do catálogo
+                if not product["pinned"] and not len(product["index"][0]) and product["key"] in _products:
+                    _forget(product["key"])
+        except Exception as e:
+            logger.warning({"message": "falha ao atualizar catálogo", "product": product["key"], "error": str(e)})
+
+
+def _run():
+    for source in CATALOG_SOURCES:
+        started = time.perf_counter()
+        discover(source)
+        logger.info({
+            "message": "catálogo construído",
+            "source": source,
+            "products": len(_products),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+
+    # as varreduras frequentes só olham os dias recentes, onde chegam os
+    # arquivos novos; o histórico inteiro é revisto bem mais raramente
+    full_rescan_at = time.monotonic()
+    while True:
+        time.sleep(CATALOG_RESCAN_SECONDS)
+        full = time.monotonic() - full_rescan_at >= CATALOG_FULL_RESCAN_SECONDS
+        rescan_all(recent_only=not full)
+        if full:
+            full_rescan_at = time.monotonic()
+
+
+def start():
+    """
+    Constrói o catálogo das fontes configuradas e mantém tudo atualizado em
+    segundo plano. Deve ser chamado em cada worker (após o fork).
+    """
+    global _thread
+
+    if not CATALOG_ENABLED or _thread is not None:
+        return
+    _thread = threading.Thread(target=_run, name="moonpng-catalog", daemon=True)
+    _thread.start()
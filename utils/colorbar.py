@@ -1,29 +1,25 @@
-import json
-import numpy as np
-from matplotlib.cm import colors
-import matplotlib.pyplot as plt
+from fastapi import HTTPException
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 
+import utils.assets as assets
 
-def add_colorbar(colorbar: str | dict):  
 
+def add_colorbar(colorbar: str | dict):
+    """
+    (níveis, cmap, norm) de uma colorbar do registro, pelo nome, ou definida
+    na requisição como {nome: {"scale": [...], "cmap": [...]}}.
+    """
     if isinstance(colorbar, dict):
-        name = list(colorbar.keys())[0]
-        levels_scale = colorbar[name]["scale"]
-        array_colors = np.array(colorbar[name]['cmap']) / 255.0
-        cmap = colors.ListedColormap(array_colors, name)
-        norm = colors.BoundaryNorm(levels_scale, cmap.N)
-        return levels_scale, cmap, norm
+        name = next(iter(colorbar), None)
+        try:
+            return assets.build_colorbar(name, colorbar.get(name))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail={"message": "Colorbar inválida.", "colorbar": name, "error": str(e)})
 
     elif isinstance(colorbar, str):
-        with open(f"data/cmaps/{colorbar}.json") as file:
-            data = json.load(file)
-        levels_scale = data[f"{colorbar}"]["scale"]
-        array_colors = np.array(data[f"{colorbar}"]['cmap']) / 255.0
-        cmap = colors.ListedColormap(array_colors, colorbar)
-        norm = colors.BoundaryNorm(levels_scale, cmap.N)
-        return levels_scale, cmap, norm
-    
+        entry = assets.get_colorbar(colorbar)
+        return entry["levels"], entry["cmap"], entry["norm"]
+
     else:
         raise HTTPException(status_code=400, detail="Invalid colorbar format. Expected a string or a dictionary.")
 
@@ -35,7 +31,7 @@ def show_colorbar(im, axes):
                                    loc='lower right',
                                    borderpad=5)  # 1.65)
     
-    cbar = plt.colorbar(im, cax=cax, orientation='horizontal', alpha=1)
+    cbar = axes.figure.colorbar(im, cax=cax, orientation='horizontal', alpha=1)
     cbar.ax.xaxis.set_label_coords(-0.1, 0.5)
     cbar.solids.set_alpha(1)
     cbar.ax.tick_params(colors="black", labelsize=12)
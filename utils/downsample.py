@@ -0,0 +1,114 @@
+import os
+
+import matplotlib
+import numpy as np
+import xarray as xr
+
+from models.params import MoonPngParams
+
+DOWNSAMPLE_ENABLED = os.environ.get("MOONPNG_DOWNSAMPLE", "1") == "1"
+# Células da grade mantidas por pixel de saída em cada eixo
+DOWNSAMPLE_CELLS_PER_PIXEL = float(os.environ.get("MOONPNG_DOWNSAMPLE_CELLS_PER_PIXEL", 1))
+# Atributos (convenção CF) que marcam variáveis categóricas: classes, códigos
+# e bits não podem ser promediados
+FLAG_ATTRS = ["flag_values", "flag_meanings", "flag_masks"]
+# Variáveis reduzidas por vizinho mais próximo em vez de média, além das que
+# têm FLAG_ATTRS (nomes exatos, separados por vírgula; ex.: direções)
+NEAREST_VARIABLES = [v for v in os.environ.get("MOONPNG_DOWNSAMPLE_NEAREST", "").split(",") if v]
+
+
+def get_method(dataset, variable):
+    """
+    "nearest" para as variáveis categóricas (atributos flag_* do campo) e as
+    listadas em MOONPNG_DOWNSAMPLE_NEAREST; "mean" para as demais.
+    """
+    if variable in NEAREST_VARIABLES or any(attr in dataset.attrs for attr in FLAG_ATTRS):
+        return "nearest"
+    return "mean"
+
+
+def axes_pixels(extent, dpi, figsize):
+    """
+    Pixels dos eixos PlateCarree (aspecto 1:1 em graus) na figura.
+    """
+    params = matplotlib.rcParams
+    box_width = figsize[0] * (params["figure.subplot.right"] - params["figure.subplot.left"])
+    box_height = figsize[1] * (params["figure.subplot.top"] - params["figure.subplot.bottom"])
+
+    lon_span = extent[1] - extent[0]
+    lat_span = extent[3] - extent[2]
+    scale = min(box_width * dpi / lon_span, box_height * dpi / lat_span)
+    return max(int(round(lon_span * scale)), 1), max(int(round(lat_span * scale)), 1)
+
+
+def get_factors(dataset, extent, dpi, figsize):
+    width, height = axes_pixels(extent, dpi, figsize)
+    factor_x = int(dataset.sizes["longitude"] / (width * DOWNSAMPLE_CELLS_PER_PIXEL))
+    factor_y = int(dataset.sizes["latitude"] / (height * DOWNSAMPLE_CELLS_PER_PIXEL))
+    return max(factor_x, 1), max(factor_y, 1)
+
+
+def downsample(dataset, params: MoonPngParams, extent, figsize):
+    """
+    Reduz a grade para a resolução da imagem antes de desenhar, por média
+    em blocos ou vizinho mais próximo. Recortes pequenos, com menos células
+    que pixels, ficam como estão.
+    """
+    if not DOWNSAMPLE_ENABLED or not params.downsample:
+        return dataset
+
+    if not extent:
+        lons = dataset.longitude.values
+        lats = dataset.latitude.values
+        extent = [lons.min(), lons.max(), lats.min(), lats.max()]
+
+    factor_x, factor_y = get_factors(dataset, extent, params.dpi, figsize)
+    if factor_x == 1 and factor_y == 1:
+        return dataset
+
+    if get_method(dataset, params.variable) == "nearest":
+        return dataset.isel(
+            longitude=slice(factor_x // 2, None, factor_x),
+            latitude=slice(factor_y // 2, None, factor_y),
+        )
+    return block_mean(dataset, factor_x, factor_y)
+
+
+def _pad(values, axis, factor):
+    # completa o eixo com NaN até um múltiplo de factor
+    missing = -values.shape[axis] % factor
+    if not missing:
+        return values
+    width = [(0, 0)] * values.ndim
+    width[axis] = (0, missing)
+    return np.pad(values, width, constant_values=np.nan)
+
+
+def block_mean(dataset, factor_x, factor_y):
+    """
+    Média (ignorando NaN) em blocos de factor_y x factor_x células, direto
+    no NumPy. Os blocos incompletos das bordas usam as células que têm, e
+    o resultado é sempre em ponto flutuante (float32 ou mais largo, conforme
+    a entrada).
+    """
+    dataset = dataset.transpose("latitude", "longitude")
+    dtype = np.result_type(dataset.dtype, np.float32)
+    ny = -(-dataset.sizes["latitude"] // factor_y)
+    nx = -(-dataset.sizes["longitude"] // factor_x)
+
+    values = np.asarray(dataset.values, dtype="float64")
+    values = _pad(_pad(values, 0, factor_y), 1, factor_x)
+    blocks = values.reshape(ny, factor_y, nx, factor_x)
+    valid = ~np.isnan(blocks)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        data = np.where(valid, blocks, 0).sum(axis=(1, 3)) / valid.sum(axis=(1, 3))
+
+    lons = np.nanmean(_pad(dataset.longitude.values.astype("float64"), 0, factor_x).reshape(nx, factor_x), axis=1)
+    lats = np.nanmean(_pad(dataset.latitude.values.astype("float64"), 0, factor_y).reshape(ny, factor_y), axis=1)
+    return xr.DataArray(
+        data.astype(dtype),
+        coords={"latitude": lats, "longitude": lons},
+        dims=("latitude", "longitude"),
+        name=dataset.name,
+        attrs=dataset.attrs,
+    )
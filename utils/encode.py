@@ -0,0 +1,207 @@
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import utils.metrics as metrics
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Perfil das respostas em PNG: "png" (zlib padrão), "fast" (zlib rápido) ou
+# "palette" (PNG de 8 bits)
+ENCODE_PROFILE = os.environ.get("MOONPNG_ENCODE_PROFILE", "png")
+ENCODE_PNG_LEVEL = int(os.environ.get("MOONPNG_ENCODE_PNG_LEVEL", 6))
+ENCODE_FAST_LEVEL = int(os.environ.get("MOONPNG_ENCODE_FAST_LEVEL", 1))
+# Formatos oferecidos a quem aceita (header Accept), em ordem de preferência
+ENCODE_ACCEPT = [f for f in os.environ.get("MOONPNG_ENCODE_ACCEPT", "").split(",") if f]
+ENCODE_WEBP_QUALITY = int(os.environ.get("MOONPNG_ENCODE_WEBP_QUALITY", 90))
+ENCODE_AVIF_QUALITY = int(os.environ.get("MOONPNG_ENCODE_AVIF_QUALITY", 75))
+
+PROFILES = ["png", "fast", "palette", "webp", "avif"]
+# Nível de compressão dos perfis gravados como PNG de 24/32 bits
+PNG_LEVELS = {"png": ENCODE_PNG_LEVEL, "fast": ENCODE_FAST_LEVEL}
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "fast": "image/png",
+    "palette": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+# Formatos de animação (várias imagens num único arquivo)
+ANIMATION_FORMATS = ["webp", "gif", "apng"]
+
+ANIMATION_MEDIA_TYPES = {
+    "webp": "image/webp",
+    "gif": "image/gif",
+    "apng": "image/apng",
+}
+
+
+def is_supported(profile):
+    if profile not in PROFILES:
+        return False
+    if profile in ["webp", "avif"]:
+        Image.init()
+        return profile.upper() in Image.SAVE
+    return True
+
+
+def parse_accept(accept: str | None):
+    """
+    Media ranges do header Accept com a qualidade (q) de cada um.
+    """
+    ranges = {}
+    for item in (accept or "").split(","):
+        media_range, *options = [part.strip() for part in item.split(";")]
+        if not media_range:
+            continue
+        quality = 1.0
+        for option in options:
+            name, _, value = option.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        ranges[media_range.lower()] = quality
+    return ranges
+
+
+def get_quality(ranges, media_type):
+    """
+    Qualidade de um media type: a do range mais específico que o cobre.
+    """
+    for media_range in (media_type, f"{media_type.split('/')[0]}/*", "*/*"):
+        if media_range in ranges:
+            return ranges[media_range]
+    return 0.0
+
+
+def negotiate(accept: str | None):
+    """
+    Perfil de codificação da resposta: o formato de ENCODE_ACCEPT que o
+    cliente pede pelo nome com a maior qualidade (no empate, a ordem de
+    ENCODE_ACCEPT), desde que não seja pior que a do PNG; senão, o perfil
+    PNG configurado. Curingas não escolhem outro formato que não o PNG.
+    """
+    ranges = parse_accept(accept)
+    best, best_quality = None, 0.0
+    for profile in ENCODE_ACCEPT:
+        quality = ranges.get(MEDIA_TYPES.get(profile, ""), 0.0)
+        if quality > best_quality and is_supported(profile):
+            best, best_quality = profile, quality
+
+    if best is not None and best_quality >= get_quality(ranges, "image/png"):
+        return best
+    return ENCODE_PROFILE if is_supported(ENCODE_PROFILE) else "png"
+
+
+def _to_palette(image):
+    """
+    Converte para paleta de 8 bits: sem perdas quando a imagem tem até 256
+    cores (mapas de colorbar sem antialiasing), senão por quantização.
+    """
+    image = image.convert("RGBA")
+    colors = image.getcolors(256)
+    if colors is not None:
+        # cada cor RGBA como um uint32, ordenadas para a busca binária
+        values = np.unique(np.array([color for _, color in colors], dtype="uint8").view("uint32"))
+        indexes = np.searchsorted(values, np.asarray(image).view("uint32")[..., 0])
+        palette = values.view("uint8").reshape(-1, 4)
+
+        result = Image.fromarray(indexes.astype("uint8"), "P")
+        result.putpalette(palette[:, :3].tobytes())
+        result.info["transparency"] = palette[:, 3].tobytes()
+        return result
+    return image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+
+
+def _save(image, profile, buffer):
+    if profile == "webp":
+        image.save(buffer, format="webp", quality=ENCODE_WEBP_QUALITY, method=4)
+    elif profile == "avif":
+        image.save(buffer, format="avif", quality=ENCODE_AVIF_QUALITY)
+    elif profile == "palette":
+        image = image if image.mode == "P" else _to_palette(image)
+        image.save(buffer, format="png", compress_level=ENCODE_PNG_LEVEL)
+    else:
+        image.save(buffer, format="png", compress_level=PNG_LEVELS.get(profile, ENCODE_PNG_LEVEL))
+
+
+def _report(profile, started, data, **extra):
+    logger.info({
+        "message": "imagem codificada",
+        "profile": profile,
+        "encode_ms": round((time.perf_counter() - started) * 1000, 2),
+        "bytes": len(data),
+        **extra,
+    })
+
+
+def encode_image(image, profile="png", **extra) -> bytes:
+    """
+    Codifica uma imagem do Pillow conforme o perfil.
+    """
+    started = time.perf_counter()
+    buffer = BytesIO()
+    with metrics.stage("encode"):
+        _save(image, profile, buffer)
+    data = buffer.getvalue()
+    _report(profile, started, data, **extra)
+    return data
+
+
+def encode_figure(figure, dpi, profile="png") -> bytes:
+    """
+    Desenha a figura do matplotlib e codifica conforme o perfil. Os perfis
+    PNG de 24/32 bits são gravados direto pelo matplotlib com o nível do
+    perfil; os demais passam por um PNG sem compressão, medindo as duas
+    etapas separadamente.
+    """
+    started = time.perf_counter()
+    buffer = BytesIO()
+    options = {"format": "png", "dpi": dpi, "pad_inches": 0, "bbox_inches": "tight"}
+    if profile in PNG_LEVELS:
+        with metrics.stage("rasterize"):
+            figure.savefig(buffer, **options, pil_kwargs={"compress_level": PNG_LEVELS[profile]})
+        data = buffer.getvalue()
+        _report(profile, started, data)
+        return data
+
+    with metrics.stage("rasterize"):
+        figure.savefig(buffer, **options, pil_kwargs={"compress_level": 0})
+        buffer.seek(0)
+        image = Image.open(buffer)
+        image.load()
+    draw_ms = round((time.perf_counter() - started) * 1000, 2)
+    return encode_image(image, profile, draw_ms=draw_ms)
+
+
+def encode_animation(frames, fmt="webp", duration=500) -> bytes:
+    """
+    Codifica uma sequência de imagens do Pillow numa animação (WebP, GIF
+    ou APNG) em loop, com `duration` milissegundos por quadro.
+    """
+    started = time.perf_counter()
+    buffer = BytesIO()
+    if fmt == "gif":
+        # GIF não tem canal alfa: o Pillow quantiza cada quadro para 256 cores
+        frames = [frame.convert("RGB") for frame in frames]
+
+    options = {"save_all": True, "append_images": frames[1:], "duration": duration, "loop": 0}
+    with metrics.stage("encode"):
+        if fmt == "webp":
+            frames[0].save(buffer, format="webp", quality=ENCODE_WEBP_QUALITY, method=4, **options)
+        elif fmt == "gif":
+            frames[0].save(buffer, format="gif", **options)
+        else:
+            frames[0].save(buffer, format="png", compress_level=ENCODE_PNG_LEVEL, **options)
+
+    data = buffer.getvalue()
+    _report(fmt, started, data, frames=len(frames))
+    return data
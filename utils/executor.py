@@ -0,0 +1,173 @@
+import importlib
+import multiprocessing
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# "process" (processos pré-aquecidos), "forkserver" (processos criados por fork
+# de um servidor aquecido uma vez por worker, ver utils/preload.py) ou
+# "thread". Com preload_app, os workers sempre renderizam em threads
+RENDER_EXECUTOR = os.environ.get("MOONPNG_RENDER_EXECUTOR", "process")
+# Renderizadores por worker do gunicorn (0 renderiza na própria thread da requisição)
+RENDER_WORKERS = int(os.environ.get("MOONPNG_RENDER_WORKERS", 2))
+# Renderizações simultâneas por worker, incluindo as que aguardam na fila do pool
+RENDER_MAX_INFLIGHT = int(os.environ.get("MOONPNG_RENDER_MAX_INFLIGHT", max(RENDER_WORKERS, 1) * 2))
+# Quanto uma requisição espera por uma vaga antes de responder 503
+RENDER_QUEUE_TIMEOUT = float(os.environ.get("MOONPNG_RENDER_QUEUE_TIMEOUT", 30))
+# Camadas do POST preparadas ao mesmo tempo
+LAYER_WORKERS = int(os.environ.get("MOONPNG_LAYER_WORKERS", 4))
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(RENDER_MAX_INFLIGHT, 1))
+_preloaded = False
+
+
+class RenderError(Exception):
+    """
+    HTTPException levantada dentro de um processo de renderização. A
+    HTTPException não é serializável pelo pickle, então atravessa o pool
+    como (status_code, detail).
+    """
+
+
+def _warm():
+    """
+    Aquece o renderizador (ver utils/warmup.py), para que a primeira
+    requisição não pague esse custo.
+    """
+    import utils.warmup as warmup
+
+    warmup.warm()
+
+
+def set_preloaded():
+    """
+    Marca o master do gunicorn com preload_app, já aquecido. Os workers
+    criados por fork dele herdam tudo e renderizam em threads, no próprio
+    processo: renderizadores novos importariam e aqueceriam tudo de novo.
+    """
+    global _preloaded
+
+    _preloaded = True
+
+
+def in_process():
+    """
+    Se as renderizações rodam neste processo (em threads ou sem pool).
+    """
+    return RENDER_WORKERS <= 0 or RENDER_EXECUTOR == "thread" or _preloaded
+
+
+def resolve(fn):
+    # "módulo:função": importada só no processo que renderiza, para o worker
+    # não carregar matplotlib e cartopy à toa
+    if isinstance(fn, str):
+        module, name = fn.split(":")
+        return getattr(importlib.import_module(module), name)
+    return fn
+
+
+def _call(fn, *args):
+    try:
+        return resolve(fn)(*args)
+    except HTTPException as e:
+        raise RenderError(e.status_code, e.detail)
+
+
+def get_executor():
+    global _executor
+
+    if _executor is not None or RENDER_WORKERS <= 0:
+        return _executor
+
+    with _executor_lock:
+        if _executor is None:
+            if RENDER_EXECUTOR == "thread" or _preloaded:
+                _executor = ThreadPoolExecutor(
+                    max_workers=RENDER_WORKERS, thread_name_prefix="moonpng-render", initializer=_warm
+                )
+            elif RENDER_EXECUTOR == "forkserver":
+                # o servidor é criado sem as threads do worker e aquece uma
+                # única vez por worker; os renderizadores são forks dele
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["utils.preload"])
+                _executor = ProcessPoolExecutor(
+                    max_workers=RENDER_WORKERS,
+                    mp_context=context,
+                    initializer=_warm,
+                )
+            else:
+                # spawn: o worker já tem threads rodando (catálogo), fork não é seguro
+                _executor = ProcessPoolExecutor(
+                    max_workers=RENDER_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm,
+                )
+    return _executor
+
+
+def start():
+    """
+    Cria o pool e sobe todos os renderizadores já na inicialização.
+    """
+    executor = get_executor()
+    if executor is None:
+        return
+    for future in [executor.submit(os.getpid) for _ in range(RENDER_WORKERS)]:
+        future.result()
+    logger.info({
+        "message": "renderizadores prontos",
+        "executor": "thread" if _preloaded else RENDER_EXECUTOR,
+        "workers": RENDER_WORKERS,
+    })
+
+
+def shutdown():
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+@contextmanager
+def slot():
+    """
+    Ocupa uma das RENDER_MAX_INFLIGHT vagas de renderização; 503 se nenhuma
+    abrir em RENDER_QUEUE_TIMEOUT segundos.
+    """
+    if not _slots.acquire(timeout=RENDER_QUEUE_TIMEOUT):
+        raise HTTPException(
+            status_code=503,
+            detail={"message": "Servidor ocupado, tente novamente.", "max_inflight": RENDER_MAX_INFLIGHT},
+        )
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+def run(fn, *args):
+    """
+    Executa `fn(*args)` no pool de renderização, respeitando o limite de
+    renderizações simultâneas. `fn` pode ser uma função ou o nome dela
+    ("módulo:função").
+    """
+    with slot():
+        try:
+            executor = get_executor()
+            if executor is None:
+                return resolve(fn)(*args)
+            return executor.submit(_call, fn, *args).result()
+        except RenderError as e:
+            status_code, detail = e.args
+            raise HTTPException(status_code=status_code, detail=detail)
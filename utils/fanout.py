@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+
+from fastapi import HTTPException
+
+import utils.aggregations as aggregations
+import utils.cache as cache
+import utils.encode as encode
+import utils.mask as mask_utils
+import utils.metrics as metrics
+import utils.netcdf as nc_utils
+import utils.paths as path_utils
+import utils.render as render_utils
+from models.params import MoonPngParams
+from utils.bounding_box import BBOX_DB, get_bbox
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Regiões do BBOX_DB que não são estados
+REGIONS = ["AS", "BR", "FD", "S", "SSE"]
+# Recortes usados quando o pedido não lista nenhum: os estados, o Brasil e a
+# América do Sul
+DEFAULT_EXTENTS = [name for name in BBOX_DB if name not in REGIONS] + ["BR", "AS"]
+
+
+def get_targets(params: MoonPngParams, extents=None, masks=None):
+    """
+    Uma cópia dos parâmetros por recorte, com a máscara correspondente
+    (por padrão, a dos próprios parâmetros).
+    """
+    extents = DEFAULT_EXTENTS if extents is None else extents
+    masks = [params.mask] * len(extents) if masks is None else masks
+
+    if not extents or len(masks) != len(extents):
+        raise HTTPException(
+            status_code=400,
+            detail="Informe ao menos um recorte e, se houver máscaras, uma por recorte.",
+        )
+
+    targets = []
+    for extent, mask in zip(extents, masks):
+        target = params.model_copy(update={"extent": extent, "mask": mask or None})
+        if get_bbox(target) is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Recorte '{extent}' inválido. Use um nome de {list(BBOX_DB)} ou [lon_min, lon_max, lat_min, lat_max].",
+            )
+        targets.append(target)
+    return targets
+
+
+def get_label(params: MoonPngParams):
+    if isinstance(params.extent, str):
+        label = params.extent.upper()
+    else:
+        label = "_".join(f"{value:g}" for value in params.extent)
+    return f"{label}_{params.mask}" if params.mask else label
+
+
+def _read_extent(params: MoonPngParams):
+    extent = get_bbox(params)
+    return mask_utils.get_mask_extent(params.mask, extent, pad=1) if params.mask else extent
+
+
+def load_fields(params: MoonPngParams, validated_paths: list, targets: list[MoonPngParams]):
+    """
+    Lê e agrega uma única vez a janela que cobre todos os recortes e separa
+    dela o pedaço de cada um, com a mesma janela de índices que uma
+    requisição isolada leria.
+    """
+    extents = [_read_extent(target) for target in targets]
+    union = [
+        min(extent[0] for extent in extents),
+        max(extent[1] for extent in extents),
+        min(extent[2] for extent in extents),
+        max(extent[3] for extent in extents),
+    ]
+
+    dataset = None
+    try:
+        with metrics.stage("aggregate"):
+            dataset = aggregations.aggregate(validated_paths, params, extent=union)
+            field = dataset.load()
+    finally:
+        if dataset is not None:
+            nc_utils.close_and_destroy(dataset)
+
+    return [nc_utils.apply_window(field, extent).copy() for extent in extents]
+
+
+def render_all(params: MoonPngParams, validated_paths: list, targets: list[MoonPngParams], profile: str = "png"):
+    """
+    Gera (parâmetros, imagem) de cada recorte, na ordem em que ficam prontos.
+    Os recortes são desenhados um a um no mesmo processo que leu o campo e
+    ficam no cache com a mesma chave de uma requisição isolada.
+    """
+    keys = [cache.make_key([(target, validated_paths)], profile) for target in targets]
+    pending = []
+    for target, key in zip(targets, keys):
+        image = cache.get(key)
+        if image is None:
+            pending.append((target, key))
+        else:
+            yield target, image
+
+    if not pending:
+        return
+
+    fields = load_fields(params, validated_paths, [target for target, _ in pending])
+    for (target, key), field in zip(pending, fields):
+        image = render_utils.render_field(target, field, profile)
+        cache.set(key, image)
+        yield target, image
+
+
+def write_extents(params: MoonPngParams, validated_paths: list, extents, masks, profile, write) -> int:
+    """
+    Renderiza todos os recortes e entrega cada imagem a `write(índice, nome,
+    bytes)` assim que fica pronta. Roda inteiro no pool de renderização
+    (leitura, agregação e desenho ocupam uma única vaga).
+    """
+    targets = get_targets(params, extents, masks)
+    extension = encode.MEDIA_TYPES[profile].split("/")[1]
+    count = 0
+    for target, image in render_all(params, validated_paths, targets, profile):
+        write(count, f"{get_label(target)}.{extension}", image)
+        count += 1
+    logger.info({"message": "recortes renderizados", "variable": params.variable, "extents": count})
+    return count
+
+
+def _parse_list(value):
+    return [item.strip() for item in value.split(",")] if value else None
+
+
+def main():
+    """
+    Job de linha de comando: grava no diretório de saída um arquivo por
+    recorte, a partir de um JSON com os parâmetros do produto.
+    """
+    parser = argparse.ArgumentParser(description="Renderiza um produto em vários recortes a partir de uma única leitura.")
+    parser.add_argument("params", help="Arquivo JSON com os parâmetros do produto.")
+    parser.add_argument("--output", required=True, help="Diretório de saída.")
+    parser.add_argument("--extents", help="Recortes separados por vírgula (padrão: estados, BR e AS).")
+    parser.add_argument("--masks", help="Máscaras separadas por vírgula, uma por recorte (vazio: sem máscara).")
+    parser.add_argument("--profile", default=encode.ENCODE_PROFILE, choices=encode.PROFILES, help="Perfil de codificação.")
+    args = parser.parse_args()
+
+    with open(args.params) as file:
+        params = MoonPngParams(**json.load(file))
+    os.makedirs(args.output, exist_ok=True)
+
+    def write(index, name, data):
+        with open(os.path.join(args.output, name), "wb") as file:
+            file.write(data)
+
+    write_extents(
+        params, path_utils.get_validated_paths(params), _parse_list(args.extents), _parse_list(args.masks), args.profile, write
+    )
+
+
+if __name__ == "__main__":
+    main()
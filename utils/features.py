@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import cartopy.crs as ccrs
+import cartopy.feature as cfeature
+import numpy as np
+import shapely
+
+from utils.bounding_box import BBOX_DB
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Acervo local do Natural Earth, gerado por `python -m utils.features`. Sem
+# acervo (ou sem a feature pedida nele), os detalhes vêm do cartopy.
+FEATURES_DIR = os.environ.get("MOONPNG_FEATURES_DIR", "data/features")
+# Tolerância de simplificação aceita, em pixels da imagem
+FEATURES_SIMPLIFY_PIXELS = float(os.environ.get("MOONPNG_FEATURES_SIMPLIFY_PIXELS", 0.5))
+# Conjuntos (feature, região, tolerância) de geometrias mantidos em memória
+FEATURES_CACHE_SIZE = int(os.environ.get("MOONPNG_FEATURES_CACHE_SIZE", 128))
+
+INDEX_FILE = "index.json"
+# (categoria, nome) do Natural Earth dos detalhes padrão do mapa
+FEATURES = [
+    ("physical", "coastline"),
+    ("physical", "land"),
+    ("physical", "ocean"),
+    ("cultural", "admin_0_boundary_lines_land"),
+    ("cultural", "admin_1_states_provinces"),
+]
+SCALES = ["50m"]
+# Tolerâncias de simplificação, em graus (0: só recortadas)
+TOLERANCES = [0.0, 0.005, 0.01, 0.025, 0.05, 0.1]
+# Região sem recorte, para extents que não cabem em nenhuma do BBOX_DB
+WORLD = "WORLD"
+WORLD_BOX = [-180.0, 180.0, -90.0, 90.0]
+
+_index = None
+
+
+def _file_name(category, name, scale):
+    return f"{category}_{name}_{scale}.npz"
+
+
+def _region_box(bbox):
+    # margem para as bordas criadas pelo recorte ficarem fora da imagem
+    pad = max(1.0, 0.1 * max(bbox[1] - bbox[0], bbox[3] - bbox[2]))
+    return [
+        max(bbox[0] - pad, WORLD_BOX[0]),
+        min(bbox[1] + pad, WORLD_BOX[1]),
+        max(bbox[2] - pad, WORLD_BOX[2]),
+        min(bbox[3] + pad, WORLD_BOX[3]),
+    ]
+
+
+def _pack(geometries):
+    wkb = shapely.to_wkb(geometries)
+    data = np.frombuffer(b"".join(wkb), dtype="uint8")
+    offsets = np.cumsum([0, *map(len, wkb)], dtype="int64")
+    return data, offsets
+
+
+def _unpack(data, offsets):
+    data = data.tobytes()
+    wkb = np.array([data[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])], dtype=object)
+    return shapely.from_wkb(wkb) if wkb.size else np.array([], dtype=object)
+
+
+def build(output=FEATURES_DIR, features=FEATURES, scales=SCALES, tolerances=TOLERANCES):
+    """
+    Gera o acervo em `output`: para cada feature e escala, as geometrias
+    recortadas em cada região do BBOX_DB (com margem) e em WORLD,
+    simplificadas em cada tolerância. Lê os shapefiles pelo cartopy (baixa
+    os que ainda não estiverem no disco).
+    """
+    import cartopy.io.shapereader as shapereader
+
+    tolerances = sorted({0.0, *map(float, tolerances)})
+    regions = {WORLD: WORLD_BOX, **{name: _region_box(bbox) for name, bbox in BBOX_DB.items()}}
+    os.makedirs(output, exist_ok=True)
+
+    built = []
+    for category, name in features:
+        for scale in scales:
+            path = shapereader.natural_earth(resolution=scale, category=category, name=name)
+            geometries = np.array(list(shapereader.Reader(path).geometries()), dtype=object)
+            geometries = geometries[~shapely.is_missing(geometries)]
+
+            arrays = {}
+            for region, box in regions.items():
+                clipped = geometries if region == WORLD else shapely.clip_by_rect(geometries, box[0], box[2], box[1], box[3])
+                clipped = clipped[~shapely.is_empty(clipped)]
+                for level, tolerance in enumerate(tolerances):
+                    simplified = shapely.simplify(clipped, tolerance, preserve_topology=True) if tolerance else clipped
+                    simplified = simplified[~shapely.is_empty(simplified)]
+                    arrays[f"{region}.{level}.wkb"], arrays[f"{region}.{level}.offsets"] = _pack(simplified)
+
+            file_path = os.path.join(output, _file_name(category, name, scale))
+            with open(f"{file_path}.tmp", "wb") as file:
+                np.savez(file, **arrays)
+            os.replace(f"{file_path}.tmp", file_path)
+            built.append(f"{category}/{name}/{scale}")
+            logger.info({
+                "message": "feature gravada no acervo",
+                "feature": built[-1],
+                "coordinates": int(shapely.get_num_coordinates(geometries).sum()),
+                "bytes": os.path.getsize(file_path),
+            })
+
+    # o índice por último: o acervo só passa a valer quando está completo
+    index = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "features": built,
+        "regions": regions,
+        "tolerances": tolerances,
+    }
+    with open(os.path.join(output, f"{INDEX_FILE}.tmp"), "w") as file:
+        json.dump(index, file, indent=2)
+    os.replace(os.path.join(output, f"{INDEX_FILE}.tmp"), os.path.join(output, INDEX_FILE))
+    return index
+
+
+def get_index():
+    """
+    Índice do acervo, ou None se não houver acervo. É relido quando o
+    acervo é gerado de novo.
+    """
+    global _index
+
+    path = os.path.join(FEATURES_DIR, INDEX_FILE)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    if _index is None or _index[0] != mtime:
+        with open(path) as file:
+            _index = (mtime, json.load(file))
+        _load.cache_clear()
+    return _index[1]
+
+
+def version():
+    """
+    Identifica o acervo em uso (muda a cada geração), ou None.
+    """
+    index = get_index()
+    return index["created_at"] if index else None
+
+
+@lru_cache(maxsize=max(FEATURES_CACHE_SIZE, 1))
+def _load(category, name, scale, region, level):
+    with np.load(os.path.join(FEATURES_DIR, _file_name(category, name, scale))) as store:
+        geometries = _unpack(store[f"{region}.{level}.wkb"], store[f"{region}.{level}.offsets"])
+    return geometries, shapely.STRtree(geometries)
+
+
+def get_region(index, extent):
+    """
+    Menor região do acervo que contém o extent; WORLD se nenhuma contém.
+    """
+    if extent is None:
+        return WORLD
+    regions = [
+        ((box[1] - box[0]) * (box[3] - box[2]), region)
+        for region, box in index["regions"].items()
+        if box[0] <= extent[0] and extent[1] <= box[1] and box[2] <= extent[2] and extent[3] <= box[3]
+    ]
+    return min(regions)[1] if regions else WORLD
+
+
+def get_level(index, resolution):
+    """
+    Maior tolerância até FEATURES_SIMPLIFY_PIXELS pixels de `resolution`
+    (graus por pixel).
+    """
+    if not resolution:
+        return 0
+    limit = resolution * FEATURES_SIMPLIFY_PIXELS
+    return max(level for level, tolerance in enumerate(index["tolerances"]) if tolerance <= limit)
+
+
+def query(category, name, scale, extent=None, resolution=None):
+    """
+    Geometrias da feature que intersectam o extent [lon_min, lon_max,
+    lat_min, lat_max], da menor região que o contém e simplificadas para a
+    resolução da imagem.
+    """
+    index = get_index()
+    geometries, tree = _load(category, name, scale, get_region(index, extent), get_level(index, resolution))
+    if extent is None:
+        return geometries
+    box = shapely.box(extent[0], extent[2], extent[1], extent[3])
+    return geometries[np.sort(tree.query(box, predicate="intersects"))]
+
+
+class StoreFeature(cfeature.Feature):
+    """
+    Feature do Natural Earth servida pelo acervo local. `resolution` é o
+    tamanho do pixel da imagem em graus (None: sem simplificação).
+    """
+
+    def __init__(self, category, name, scale, resolution=None, **kwargs):
+        super().__init__(ccrs.PlateCarree(), **kwargs)
+        self.category = category
+        self.name = name
+        self.scale = scale
+        self.resolution = resolution
+
+    def geometries(self):
+        return iter(query(self.category, self.name, self.scale, resolution=self.resolution))
+
+    def intersecting_geometries(self, extent):
+        # o cartopy passa NaN quando não há extent
+        if extent is not None and np.isnan(extent[0]):
+            extent = None
+        return iter(query(self.category, self.name, self.scale, extent, self.resolution))
+
+
+def localize(feature, resolution=None):
+    """
+    A feature equivalente do acervo local, se ele a tiver nessa escala;
+    senão, a própria feature do cartopy.
+    """
+    if not isinstance(feature, cfeature.NaturalEarthFeature) or isinstance(feature.scaler, cfeature.AdaptiveScaler):
+        return feature
+    index = get_index()
+    if index is None or f"{feature.category}/{feature.name}/{feature.scale}" not in index["features"]:
+        return feature
+    return StoreFeature(feature.category, feature.name, feature.scale, resolution, **feature.kwargs)
+
+
+def _parse_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else None
+
+
+def main():
+    """
+    Gera o acervo local (uma vez, no build da imagem): depois disso, os
+    detalhes do mapa não dependem de rede nem dos shapefiles.
+    """
+    parser = argparse.ArgumentParser(description="Gera o acervo local de features do Natural Earth.")
+    parser.add_argument("--output", default=FEATURES_DIR, help="Diretório do acervo.")
+    parser.add_argument("--features", help="categoria/nome separados por vírgula (padrão: os detalhes padrão do mapa).")
+    parser.add_argument("--scales", help="Escalas separadas por vírgula (padrão: 50m).")
+    parser.add_argument("--tolerances", help="Tolerâncias em graus separadas por vírgula.")
+    args = parser.parse_args()
+
+    features = [tuple(item.split("/", 1)) for item in _parse_list(args.features) or []] or FEATURES
+    tolerances = [float(value) for value in _parse_list(args.tolerances) or []] or TOLERANCES
+    index = build(args.output, features, _parse_list(args.scales) or SCALES, tolerances)
+    print(f"{len(index['features'])} features, {len(index['regions'])} regiões em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+
+import utils.cache as cache
+
+# max-age (segundos) por tipo de dado: reanálises e climatologias não mudam,
+# satélite e radar são atualizados a cada poucos minutos
+MAX_AGE_LONG = int(os.environ.get("MOONPNG_MAX_AGE_LONG", 7 * 86400))
+MAX_AGE_MEDIUM = int(os.environ.get("MOONPNG_MAX_AGE_MEDIUM", 600))
+MAX_AGE_SHORT = int(os.environ.get("MOONPNG_MAX_AGE_SHORT", 60))
+
+MAX_AGE_BY_KIND = {
+    "reanalysis": MAX_AGE_LONG,
+    "climatology": MAX_AGE_LONG,
+    "seasonal": MAX_AGE_MEDIUM,
+    "forecast": MAX_AGE_MEDIUM,
+    "observed": MAX_AGE_MEDIUM,
+    "satellite": MAX_AGE_SHORT,
+    "radar": MAX_AGE_SHORT,
+}
+
+
+def get_last_modified(paths_list):
+    """
+    Maior mtime (em segundos) entre os arquivos de entrada de todas as camadas.
+    """
+    mtimes = [
+        mtime
+        for paths in paths_list
+        for _, mtime, _ in cache.get_file_identities(paths)
+        if mtime is not None
+    ]
+    return max(mtimes) / 1e9 if mtimes else None
+
+
+def etag(key):
+    """
+    ETag forte da resposta: a própria chave do cache, que só depende dos
+    parâmetros que alteram a imagem, da identidade dos arquivos e do perfil
+    (as datas da requisição ficam fora, ver cache.canonicalize). A mesma
+    requisição tem o mesmo ETag em qualquer worker.
+    """
+    return f'"{key}"'
+
+
+def get_headers(key, last_modified, kinds):
+    """
+    ETag, Last-Modified e Cache-Control do tipo de dado mais volátil entre
+    as camadas.
+    """
+    max_age = min(MAX_AGE_BY_KIND.get(kind, MAX_AGE_SHORT) for kind in kinds)
+    headers = {
+        "ETag": etag(key),
+        "Cache-Control": f"public, max-age={max_age}",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, key, last_modified):
+    """
+    Se a cópia do cliente ainda vale, pelo If-None-Match ou, na falta dele,
+    pelo If-Modified-Since.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag(key) in tags or f"W/{etag(key)}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
@@ -1,20 +1,231 @@
-import json
+import atexit
+import io
 import logging
+import os
+import queue
 import sys
-from datetime import datetime
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler
+
+import orjson
+
+# Arquivo de log, além do stdout (desligado se vazio)
+LOG_FILE = os.environ.get("MOONPNG_LOG_FILE", "moonpng_requests.log")
+# Registros aguardando escrita; com a fila cheia, os novos são descartados
+LOG_QUEUE_SIZE = int(os.environ.get("MOONPNG_LOG_QUEUE_SIZE", 10000))
+# Registros escritos de uma vez pela thread de log
+LOG_BATCH_SIZE = int(os.environ.get("MOONPNG_LOG_BATCH_SIZE", 256))
+
+_STOP = object()
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_listener = None
+_listener_lock = threading.Lock()
+_deferred = False
+_handlers = []
+_dropped = 0
+_dropped_lock = threading.Lock()
+_reported = 0
 
 
 class JsonFormatter(logging.Formatter):
+    """
+    Uma linha JSON por registro. Mensagens em dict viram campos do registro;
+    o timestamp (UTC, em milissegundos) é formatado uma vez por milissegundo.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._last_ms = None
+        self._last_timestamp = None
+
+    def timestamp(self, created):
+        ms = int(created * 1000)
+        if ms != self._last_ms:
+            moment = datetime.fromtimestamp(ms / 1000, tz=timezone.utc).replace(tzinfo=None)
+            self._last_ms, self._last_timestamp = ms, moment.isoformat(timespec="milliseconds")
+        return self._last_timestamp
+
     def format(self, record):
         log_record = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": self.timestamp(record.created),
             "level": record.levelname,
-            "message": record.getMessage(),
             "logger": record.name,
         }
+        if isinstance(record.msg, dict) and not record.args:
+            log_record.update(record.msg)
+        else:
+            log_record["message"] = record.getMessage()
         if record.exc_info:
             log_record["exception"] = self.formatException(record.exc_info)
-        return json.dumps(log_record)
+        return orjson.dumps(log_record, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Só enfileira o registro: formatação e escrita ficam com a thread de log.
+    Nunca bloqueia quem loga; com a fila cheia, o registro é descartado e
+    contado.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _dropped_lock:
+                _dropped += 1
+
+
+def get_dropped():
+    """
+    Registros descartados por fila cheia desde o início do processo.
+    """
+    return _dropped
+
+
+def _write_batch(formatter, records, outputs):
+    lines = []
+    for record in records:
+        try:
+            lines.append(formatter.format(record))
+        except Exception:
+            lines.append(orjson.dumps({"level": "ERROR", "message": "falha ao formatar log", "logger": record.name}))
+    data = b"\n".join(lines) + b"\n"
+    for output in outputs:
+        try:
+            output.write(data if isinstance(output, io.BufferedIOBase) else data.decode())
+            output.flush()
+        except (OSError, ValueError):
+            pass
+
+
+def _report_dropped(formatter, outputs):
+    global _reported
+
+    dropped = _dropped
+    if dropped != _reported:
+        record = logging.LogRecord("moonpng", logging.WARNING, __file__, 0, {
+            "message": "registros de log descartados (fila cheia)",
+            "dropped": dropped - _reported,
+            "dropped_total": dropped,
+        }, None, None)
+        _reported = dropped
+        _write_batch(formatter, [record], outputs)
+
+
+def _open_outputs():
+    outputs = [sys.stdout]
+    if LOG_FILE:
+        outputs.append(open(LOG_FILE, "ab"))
+    return outputs
+
+
+def _run(log_queue):
+    formatter = JsonFormatter()
+    outputs = _open_outputs()
+
+    stop = False
+    while not stop:
+        records = [log_queue.get()]
+        while len(records) < LOG_BATCH_SIZE:
+            try:
+                records.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if _STOP in records:
+            records = records[:records.index(_STOP)]
+            stop = True
+        _write_batch(formatter, records, outputs)
+        _report_dropped(formatter, outputs)
+
+
+def _start_listener():
+    global _listener
+
+    with _listener_lock:
+        if _listener is None and not _deferred:
+            _listener = threading.Thread(target=_run, args=(_queue,), name="moonpng-log", daemon=True)
+            _listener.start()
+
+
+def defer():
+    """
+    Não sobe a thread de log neste processo: o master do gunicorn com
+    preload_app não pode ter threads rodando no fork dos workers. Os
+    registros ficam na fila até flush() ou start().
+    """
+    global _deferred
+
+    _deferred = True
+
+
+def start():
+    """
+    Sobe a thread de log adiada por defer() (post_fork dos workers).
+    """
+    global _deferred
+
+    _deferred = False
+    if _handlers:
+        _start_listener()
+
+
+def flush():
+    """
+    Escreve na própria thread o que está na fila, sem a thread de log.
+    """
+    records = []
+    while True:
+        try:
+            record = _queue.get_nowait()
+        except queue.Empty:
+            break
+        if record is not _STOP:
+            records.append(record)
+    if not records:
+        return
+
+    outputs = _open_outputs()
+    formatter = JsonFormatter()
+    _write_batch(formatter, records, outputs)
+    _report_dropped(formatter, outputs)
+    for output in outputs[1:]:
+        output.close()
+
+
+def _stop_listener():
+    # escreve o que ainda está na fila antes do processo terminar
+    if _listener is None:
+        flush()
+        return
+    try:
+        _queue.put(_STOP, timeout=1)
+    except queue.Full:
+        return
+    _listener.join(timeout=5)
+
+
+def _after_fork():
+    # a thread de log não existe no processo filho: recomeça com uma fila nova
+    global _queue, _listener, _listener_lock, _dropped, _dropped_lock, _reported
+
+    _queue, _listener, _listener_lock = queue.Queue(maxsize=LOG_QUEUE_SIZE), None, threading.Lock()
+    _dropped, _dropped_lock, _reported = 0, threading.Lock(), 0
+    for handler in _handlers:
+        handler.queue = _queue
+    if _handlers:
+        _start_listener()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+atexit.register(_stop_listener)
 
 
 def get_logger(name="moonpng"):
@@ -25,17 +236,10 @@ def get_logger(name="moonpng"):
 
     logger.setLevel(logging.INFO)
 
-    # Formatação JSON
-    json_formatter = JsonFormatter()
-
-    # Terminal (stdout)
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setFormatter(json_formatter)
-    logger.addHandler(stream_handler)
-
-    # Arquivo
-    file_handler = logging.FileHandler("moonpng_requests.log")
-    file_handler.setFormatter(json_formatter)
-    logger.addHandler(file_handler)
+    # stdout e arquivo, escritos em lote pela thread de log
+    handler = NonBlockingQueueHandler(_queue)
+    _handlers.append(handler)
+    logger.addHandler(handler)
+    _start_listener()
 
     return logger
@@ -1,25 +1,183 @@
-import geopandas as gpd
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
-import shapely.vectorized
+import shapely
+
+import utils.assets as assets
+import utils.metrics as metrics
+
+# Máscaras rasterizadas mantidas em memória (por worker)
+MASK_CACHE_SIZE = int(os.environ.get("MOONPNG_MASK_CACHE_SIZE", 128))
+# Diretório das máscaras em disco, compartilhado entre workers (desligado se vazio)
+MASK_CACHE_DIR = os.environ.get("MOONPNG_MASK_CACHE_DIR", "")
+
+_masks = OrderedDict()
+_masks_lock = threading.Lock()
+
+
+def get_mask_extent(geojson, extent=None, pad=1):
+    """
+    Extent necessário para aplicar a máscara: o recorte pedido ou os limites
+    do geojson, com a margem `pad`.
+    """
+    if not extent:
+        bounds = assets.get_shape(geojson)["bounds"]
+        extent = [bounds[0], bounds[2], bounds[1], bounds[3]]
+    return [extent[0] - pad, extent[1] + pad, extent[2] - pad, extent[3] + pad]
+
+
+def _polygon_runs(polygon, lons, lats):
+    """
+    Trechos (linha, coluna inicial, coluna final) de células cujo centro está
+    dentro do polígono, por varredura de linhas (regra par-ímpar, então os
+    buracos ficam de fora). `lons` e `lats` precisam ser crescentes.
+    """
+    rings = [polygon.exterior, *polygon.interiors]
+    coords = [np.asarray(ring.coords) for ring in rings]
+    x0 = np.concatenate([c[:-1, 0] for c in coords])
+    y0 = np.concatenate([c[:-1, 1] for c in coords])
+    x1 = np.concatenate([c[1:, 0] for c in coords])
+    y1 = np.concatenate([c[1:, 1] for c in coords])
+
+    # cada aresta cruza as linhas com ymin <= lat < ymax
+    first = np.searchsorted(lats, np.minimum(y0, y1), side="left")
+    last = np.searchsorted(lats, np.maximum(y0, y1), side="left")
+    counts = last - first
+    if not counts.sum():
+        return None
+
+    edge = np.repeat(np.arange(x0.size), counts)
+    rows = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + first[edge]
+    y = lats[rows]
+    x = x0[edge] + (y - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+
+    order = np.lexsort((x, rows))
+    rows, x = rows[order], x[order]
+    starts = np.searchsorted(lons, x[0::2], side="left")
+    stops = np.searchsorted(lons, x[1::2], side="left")
+    return rows[0::2], starts, stops
+
+
+def rasterize(geoms, lons, lats):
+    """
+    Máscara booleana (lat, lon) das células cujo centro cai dentro das
+    geometrias, sem teste ponto a ponto.
+    """
+    lons = np.asarray(lons, dtype="float64")
+    lats = np.asarray(lats, dtype="float64")
+    flip_lon = lons.size > 1 and lons[0] > lons[-1]
+    flip_lat = lats.size > 1 and lats[0] > lats[-1]
+    if flip_lon:
+        lons = lons[::-1]
+    if flip_lat:
+        lats = lats[::-1]
+
+    coverage = np.zeros((lats.size, lons.size + 1), dtype="int32")
+    for geom in geoms:
+        for polygon in shapely.get_parts(geom):
+            if polygon.geom_type != "Polygon" or polygon.is_empty:
+                continue
+            runs = _polygon_runs(polygon, lons, lats)
+            if runs is None:
+                continue
+            rows, starts, stops = runs
+            np.add.at(coverage, (rows, starts), 1)
+            np.add.at(coverage, (rows, stops), -1)
+
+    mask = np.cumsum(coverage, axis=1)[:, :-1] > 0
+    if flip_lat:
+        mask = mask[::-1]
+    if flip_lon:
+        mask = mask[:, ::-1]
+    return np.ascontiguousarray(mask)
+
+
+def _grid_signature(values):
+    return (float(values[0]), float(values[-1]), int(values.size))
+
+
+def _disk_path(geojson, key):
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    return os.path.join(MASK_CACHE_DIR, f"{geojson}-{digest}.npy")
+
+
+def get_mask(geojson, lons, lats):
+    """
+    Máscara do geojson na grade (lons, lats), calculada uma vez por
+    (geojson, versão do arquivo, grade) e guardada em memória e em disco
+    como bits compactados.
+    """
+    shape = assets.get_shape(geojson)
+    key = (geojson, shape["mtime"], _grid_signature(lons), _grid_signature(lats))
+
+    with _masks_lock:
+        mask = _masks.get(key)
+        if mask is not None:
+            _masks.move_to_end(key)
+            return mask
+
+    size = (lats.size, lons.size)
+    mask = None
+    if MASK_CACHE_DIR:
+        try:
+            packed = np.load(_disk_path(geojson, key), mmap_mode="r")
+            mask = np.unpackbits(packed, count=size[0] * size[1]).reshape(size).astype(bool)
+        except (OSError, ValueError):
+            mask = None
+
+    if mask is None:
+        # só as geometrias que alcançam a grade (índice espacial)
+        grid = [np.min(lons), np.max(lons), np.min(lats), np.max(lats)]
+        mask = rasterize(assets.query(shape, grid), lons, lats)
+        if MASK_CACHE_DIR:
+            try:
+                os.makedirs(MASK_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{_disk_path(geojson, key)}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as file:
+                    np.save(file, np.packbits(mask))
+                os.replace(tmp_path, _disk_path(geojson, key))
+            except OSError:
+                pass
+
+    mask.setflags(write=False)
+    with _masks_lock:
+        _masks[key] = mask
+        while len(_masks) > MASK_CACHE_SIZE:
+            _masks.popitem(last=False)
+    return mask
+
+
+def clear():
+    """
+    Esvazia as máscaras em memória (as do disco continuam).
+    """
+    with _masks_lock:
+        _masks.clear()
 
 
 def get_masked_data(dataset, geojson, extent=None, pad=1):
-    gdf = gpd.read_file(f"data/cmaps/geojsons/{geojson}.geojson")
-    geoms = gdf.geometry.values
+    with metrics.stage("mask"):
+        return _get_masked_data(dataset, geojson, extent, pad)
+
+
+def _get_masked_data(dataset, geojson, extent=None, pad=1):
     if extent:
         lon_slice = slice(extent[0] - pad, extent[1] + pad)
         lat_slice = slice(extent[2] - pad, extent[3] + pad)
     else:
-        extent = gdf.total_bounds
+        extent = assets.get_shape(geojson)["bounds"]
         extent = [extent[0], extent[2], extent[1], extent[3]]
         lon_slice = slice(extent[0] - pad, extent[1] + pad)
         lat_slice = slice(extent[2] - pad, extent[3] + pad)
 
     dataset = dataset.sel(longitude=lon_slice, latitude=lat_slice)
-    lons2d, lats2d = np.meshgrid(dataset.longitude.values, dataset.latitude.values)
-    mask_array = np.zeros_like(lons2d, dtype=bool)
-    for geom in geoms:
-        mask_array |= shapely.vectorized.contains(geom, lons2d, lats2d)
+    lons = dataset.longitude.values
+    lats = dataset.latitude.values
+    lons2d, lats2d = np.meshgrid(lons, lats)
+    mask_array = get_mask(geojson, lons, lats)
 
     data_masked = np.ma.masked_array(dataset.values, ~mask_array)
     return data_masked, lons2d, lats2d, extent
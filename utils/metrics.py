@@ -0,0 +1,318 @@
+import atexit
+import fcntl
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Desliga a coleta (as etapas continuam rodando, sem medição)
+METRICS_ENABLED = os.environ.get("MOONPNG_METRICS_ENABLED", "1") == "1"
+# Diretório onde cada processo (workers do gunicorn e renderizadores) grava
+# os seus histogramas. Deve ser esvaziado a cada deploy (o gunicorn_config
+# faz isso ao iniciar o master).
+METRICS_DIR = os.environ.get("MOONPNG_METRICS_DIR", os.path.join(tempfile.gettempdir(), "moonpng-metrics"))
+# Intervalo máximo entre uma medição e a gravação dela no diretório
+METRICS_FLUSH_SECONDS = float(os.environ.get("MOONPNG_METRICS_FLUSH_SECONDS", 5))
+
+ARCHIVE_FILE = "archive.json"
+LOCK_FILE = ".lock"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MEMORY_BUCKETS = tuple(float(mb * 1024 * 1024) for mb in (1, 4, 16, 64, 256, 1024, 4096))
+
+HISTOGRAMS = {
+    "moonpng_stage_duration_seconds": ("Duração de cada etapa do pipeline.", DURATION_BUCKETS),
+    "moonpng_stage_memory_bytes": ("Crescimento do RSS do processo durante cada etapa.", MEMORY_BUCKETS),
+    "moonpng_request_duration_seconds": ("Duração das requisições HTTP.", DURATION_BUCKETS),
+}
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_values = {}
+_lock = threading.Lock()
+_dirty = False
+_claimed = False
+_flusher = None
+
+
+def _rss():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss():
+    # ru_maxrss em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def observe(name, value, **labels):
+    """
+    Registra uma medição no histograma `name` deste processo.
+    """
+    global _dirty
+
+    if not METRICS_ENABLED:
+        return
+
+    buckets = HISTOGRAMS[name][1]
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        entry = _values.get(key)
+        if entry is None:
+            entry = _values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+        _dirty = True
+
+    if _flusher is None:
+        _start_flusher()
+
+
+@contextmanager
+def stage(name):
+    """
+    Mede a duração e o crescimento do RSS de uma etapa do pipeline. Etapas
+    podem ser aninhadas (aggregate inclui open, por exemplo).
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+
+    rss = _rss()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("moonpng_stage_duration_seconds", time.perf_counter() - started, stage=name)
+        if rss is not None:
+            observe("moonpng_stage_memory_bytes", max(_rss() - rss, 0), stage=name)
+
+
+@contextmanager
+def disabled():
+    """
+    Suspende a coleta enquanto o bloco roda (aquecimento no master do
+    gunicorn, que não deve gravar medições nem iniciar a thread de gravação).
+    """
+    global METRICS_ENABLED
+
+    enabled, METRICS_ENABLED = METRICS_ENABLED, False
+    try:
+        yield
+    finally:
+        METRICS_ENABLED = enabled
+
+
+@contextmanager
+def _locked():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, LOCK_FILE), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=METRICS_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        json.dump(data, file)
+    os.replace(temp_path, path)
+
+
+def _merge(merged, histograms):
+    for name, labels, counts, total, count in histograms:
+        if name not in HISTOGRAMS or len(counts) != len(HISTOGRAMS[name][1]) + 1:
+            continue
+        key = (name, tuple(sorted(labels.items())))
+        entry = merged.get(key)
+        if entry is None:
+            merged[key] = [list(counts), total, count]
+        else:
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+
+
+def _archive(path):
+    """
+    Soma os histogramas de um processo que terminou no arquivo de
+    acumulados, para os contadores não voltarem atrás. Chamar com o lock.
+    """
+    data = _read(path)
+    if data is not None:
+        archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+        merged = {}
+        _merge(merged, (_read(archive_path) or {}).get("histograms", []))
+        _merge(merged, data.get("histograms", []))
+        _write(archive_path, {"histograms": _serialize(merged)})
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _serialize(values):
+    return [[name, dict(labels), counts, total, count] for (name, labels), (counts, total, count) in values.items()]
+
+
+def flush():
+    """
+    Grava os histogramas deste processo em METRICS_DIR/<pid>.json.
+    """
+    global _dirty, _claimed
+
+    if not METRICS_ENABLED:
+        return
+
+    with _lock:
+        histograms = _serialize({key: (list(counts), total, count) for key, (counts, total, count) in _values.items()})
+        _dirty = False
+
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        if not _claimed:
+            # arquivo de um processo antigo com o mesmo pid
+            if os.path.exists(path):
+                with _locked():
+                    _archive(path)
+            _claimed = True
+        _write(path, {"histograms": histograms, "rss": _rss(), "peak_rss": _peak_rss()})
+    except OSError:
+        pass
+
+
+def _run_flusher():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        if _dirty:
+            flush()
+
+
+def _start_flusher():
+    global _flusher
+
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = threading.Thread(target=_run_flusher, name="moonpng-metrics", daemon=True)
+    _flusher.start()
+    atexit.register(flush)
+
+
+def _after_fork():
+    # o processo filho começa sem as medições nem a thread do pai
+    global _values, _lock, _dirty, _claimed, _flusher
+
+    _values, _lock, _dirty, _claimed, _flusher = {}, threading.Lock(), False, False, None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def collect():
+    """
+    Soma os histogramas de todos os processos (vivos e já encerrados) e
+    retorna também RSS e pico de RSS de cada processo vivo.
+    """
+    flush()
+    merged, processes = {}, []
+    try:
+        with _locked():
+            for name in sorted(os.listdir(METRICS_DIR)):
+                path = os.path.join(METRICS_DIR, name)
+                pid = name[:-len(".json")]
+                if not name.endswith(".json") or not pid.isdigit():
+                    continue
+                pid = int(pid)
+                if not _alive(pid):
+                    _archive(path)
+                    continue
+                data = _read(path)
+                if data is not None:
+                    _merge(merged, data.get("histograms", []))
+                    processes.append((pid, data.get("rss"), data.get("peak_rss")))
+            _merge(merged, (_read(os.path.join(METRICS_DIR, ARCHIVE_FILE)) or {}).get("histograms", []))
+    except OSError:
+        pass
+    return merged, processes
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _labels(labels, **extra):
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def render() -> str:
+    """
+    Métricas de todos os processos no formato texto do Prometheus.
+    """
+    merged, processes = collect()
+    lines = []
+    for name, (description, buckets) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        for (key_name, labels), (counts, total, count) in sorted(merged.items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip([*map(str, buckets), "+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+    gauges = [
+        ("moonpng_process_resident_memory_bytes", "RSS de cada processo vivo.", 1),
+        ("moonpng_process_peak_resident_memory_bytes", "Pico de RSS de cada processo vivo.", 2),
+    ]
+    for name, description, index in gauges:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge"]
+        for process in processes:
+            if process[index] is not None:
+                lines.append(f'{name}{{pid="{process[0]}"}} {process[index]}')
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """
+    Apaga as métricas gravadas (início do master do gunicorn).
+    """
+    if not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        try:
+            os.remove(os.path.join(METRICS_DIR, name))
+        except OSError:
+            pass
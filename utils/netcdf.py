@@ -1,12 +1,28 @@
 import os
+import threading
 import time
+from collections import OrderedDict
+from functools import partial
 
 import netCDF4 as nc
+import numpy as np
 import xarray as xr
 from fastapi import HTTPException
 
+import utils.metrics as metrics
+
 CHUNKS = {"time": "auto", "latitude": "auto", "longitude": "auto"}
 
+# Janelas de índices já calculadas por (grade, extent)
+WINDOW_CACHE_SIZE = 1024
+_windows = {}
+
+# Datasets abertos mantidos por worker (0 desliga o pool). Fica abaixo do
+# file_cache_maxsize do xarray (128) para os handles não serem reciclados.
+POOL_SIZE = int(os.environ.get("MOONPNG_NETCDF_POOL_SIZE", 64))
+_pool = OrderedDict()
+_pool_lock = threading.Lock()
+
 
 def close_and_destroy(dataset):
     try:
@@ -18,43 +34,169 @@ def close_and_destroy(dataset):
         return False
 
 
-def run_validate(paths: list, variable: str):
-    validated_paths = [p for p in paths if os.path.isfile(p)]
+def _grid_signature(coordinate):
+    values = coordinate.values
+    return (float(values[0]), float(values[-1]), values.size)
 
-    if not validated_paths:
-        msg = {
-            "function_name": f"run_validate()",
-            "message": f"no valid paths found for variable {variable}",
-            "paths": paths,
-        }
-        raise HTTPException(
-            status_code=400,
-            detail=msg,
+
+def _index_slice(coordinate, vmin, vmax):
+    """
+    Fatia de índices que cobre [vmin, vmax], com uma célula extra em cada
+    borda para os contornos chegarem até o limite do recorte.
+    """
+    values = np.asarray(coordinate)
+    descending = values.size > 1 and values[0] > values[-1]
+    if descending:
+        values = values[::-1]
+
+    start = max(int(np.searchsorted(values, vmin, side="left")) - 1, 0)
+    stop = min(int(np.searchsorted(values, vmax, side="right")) + 1, values.size)
+
+    if descending:
+        start, stop = values.size - stop, values.size - start
+    return slice(start, stop)
+
+
+def get_window(latitudes, longitudes, extent):
+    """
+    Janela de índices (latitude, longitude) do extent numa grade. Calculada
+    uma vez por grade e extent.
+
+    Retorna também se as longitudes da grade (0 a 360) precisam ser
+    convertidas para -180 a 180.
+    """
+    key = (_grid_signature(latitudes), _grid_signature(longitudes), tuple(extent))
+    window = _windows.get(key)
+    if window is not None:
+        return window
+
+    lon_min, lon_max = extent[0], extent[1]
+    shift = False
+    if float(longitudes.max()) > 180 and min(lon_min, lon_max) < 0:
+        if lon_min % 360 <= lon_max % 360:
+            lon_min, lon_max = lon_min % 360, lon_max % 360
+            shift = True
+        else:
+            # o recorte cruza o meridiano de Greenwich: mantém todas as longitudes
+            lon_min, lon_max = float(longitudes.min()), float(longitudes.max())
+
+    window = (
+        _index_slice(latitudes.values, extent[2], extent[3]),
+        _index_slice(longitudes.values, lon_min, lon_max),
+        shift,
+    )
+
+    if len(_windows) >= WINDOW_CACHE_SIZE:
+        _windows.clear()
+    _windows[key] = window
+    return window
+
+
+def apply_window(dataarray, extent):
+    """
+    Recorta (de forma preguiçosa) a janela de índices do extent.
+    """
+    lat_slice, lon_slice, shift = get_window(dataarray.latitude, dataarray.longitude, extent)
+    dataarray = dataarray.isel(latitude=lat_slice, longitude=lon_slice)
+    if shift:
+        dataarray = dataarray.assign_coords(
+            longitude=((dataarray.longitude + 180) % 360) - 180
         )
+    return dataarray
 
+
+def _file_key(path):
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def open_dataset(path):
+    """
+    Dataset (sem chunks) aberto uma vez por (caminho, mtime, tamanho) e
+    compartilhado entre requisições e threads. Cabeçalhos e coordenadas são
+    lidos só na primeira abertura. Quando o arquivo é substituído, as versões
+    antigas saem do pool sem serem fechadas: requisições em andamento ainda
+    podem estar lendo delas.
+    """
+    key = _file_key(path)
+    with _pool_lock:
+        dataset = _pool.get(key)
+        if dataset is not None:
+            _pool.move_to_end(key)
+            return dataset
+
+    dataset = xr.open_dataset(path, engine="netcdf4")
+
+    with _pool_lock:
+        pooled = _pool.get(key)
+        if pooled is not None:
+            dataset.close()
+            return pooled
+
+        # versões antigas do mesmo arquivo saem do pool como na expiração: o
+        # handle é fechado pelo gerenciador de arquivos do xarray quando o
+        # dataset deixa de ser usado por requisições em andamento
+        for previous in [other for other in _pool if other[0] == path]:
+            del _pool[previous]
+
+        _pool[key] = dataset
+        while len(_pool) > POOL_SIZE:
+            _pool.popitem(last=False)
+
+    return dataset
+
+
+def clear_pool():
+    """
+    Fecha os datasets do pool e esquece as janelas calculadas.
+    """
+    with _pool_lock:
+        datasets = list(_pool.values())
+        _pool.clear()
+    for dataset in datasets:
+        close_and_destroy(dataset)
+    _windows.clear()
+
+
+def _open_window(path, variable, extent):
+    """
+    Abre uma variável lendo apenas a janela do extent. O recorte é feito antes
+    do chunking do dask, então só a janela entra no grafo.
+    """
+    if POOL_SIZE > 0:
+        dataset = open_dataset(path)
     else:
-        return validated_paths
+        dataset = xr.open_dataset(path, engine="netcdf4")
+    dataarray = dataset[variable]
+
+    if extent:
+        dataarray = apply_window(dataarray, extent)
+
+    dataarray = dataarray.chunk({dim: CHUNKS.get(dim, "auto") for dim in dataarray.dims})
+    return dataset, dataarray
+
+
+def _close_all(datasets):
+    for dataset in datasets:
+        dataset.close()
 
 
-def get_data(path_or_paths: list | str, variable: str):
+def get_data(path_or_paths: list | str, variable: str, extent: list | tuple | None = None):
     try:
-        if isinstance(path_or_paths, list) and len(path_or_paths) > 1:
-            return xr.open_mfdataset(
-                path_or_paths,
-                combine="by_coords",
-                # parallel=True,
-                engine="netcdf4",
-                chunks=CHUNKS,
-            )[variable]
-        elif isinstance(path_or_paths, list) and len(path_or_paths) == 1:
-            return xr.open_dataset(path_or_paths[0], engine="netcdf4", chunks=CHUNKS)[
-                variable
-            ]
+        paths = path_or_paths if isinstance(path_or_paths, list) else [path_or_paths]
+        with metrics.stage("open"):
+            datasets, dataarrays = zip(*(_open_window(path, variable, extent) for path in paths))
 
+        if len(dataarrays) > 1:
+            dataarray = xr.combine_by_coords(
+                [dataarray.to_dataset() for dataarray in dataarrays]
+            )[variable]
         else:
-            return xr.open_dataset(path_or_paths, engine="netcdf4", chunks=CHUNKS)[
-                variable
-            ]
+            dataarray = dataarrays[0]
+
+        if POOL_SIZE <= 0:
+            dataarray.set_close(partial(_close_all, datasets))
+        return dataarray
 
     except Exception as e:
         msg = {
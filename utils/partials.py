@@ -0,0 +1,341 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import orjson
+import pandas as pd
+import xarray as xr
+from fastapi import HTTPException
+
+import utils.cache as cache
+import utils.netcdf as nc_utils
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Diretório das parciais materializadas (desligado se vazio)
+STORE_DIR = os.environ.get("MOONPNG_PARTIALS_DIR", "")
+# Incrementar quando o formato das parciais mudar
+STORE_VERSION = 2
+
+# Agregações que podem ser calculadas a partir de parciais (soma, contagem,
+# mínimo, máximo e soma dos quadrados dos desvios, em float64)
+PARTIAL_METHODS = ["mean", "sum", "max", "min", "std", "var", "count"]
+FIELDS = ["sum", "m2", "count", "min", "max"]
+
+
+def _mean(partial):
+    return np.divide(
+        partial["sum"], partial["count"], out=np.zeros(np.shape(partial["sum"])), where=partial["count"] > 0
+    )
+
+
+def reduce_partial(values):
+    """
+    Reduz um bloco (time, lat, lon) às parciais de soma, soma dos quadrados
+    dos desvios (m2), contagem, mínimo e máximo, ignorando NaN como o xarray.
+    """
+    values = np.asarray(values, dtype="float64")
+    if values.ndim == 2:
+        values = values[np.newaxis]
+
+    valid = ~np.isnan(values)
+    partial = {
+        "sum": np.where(valid, values, 0.0).sum(axis=0),
+        "count": valid.sum(axis=0, dtype="int64"),
+        "min": np.fmin.reduce(values, axis=0),
+        "max": np.fmax.reduce(values, axis=0),
+    }
+    # desvios em relação à média do próprio bloco: sem o cancelamento de
+    # soma dos quadrados - quadrado da média
+    partial["m2"] = np.square(np.where(valid, values - _mean(partial), 0.0)).sum(axis=0)
+    return partial
+
+
+def merge_partials(a, b):
+    """
+    Combina as parciais de dois blocos (fórmula de Chan para o m2).
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    count = a["count"] + b["count"]
+    weight = np.divide(
+        a["count"] * b["count"], count, out=np.zeros(np.shape(count)), where=count > 0
+    )
+    return {
+        "sum": a["sum"] + b["sum"],
+        "m2": a["m2"] + b["m2"] + np.square(_mean(b) - _mean(a)) * weight,
+        "count": count,
+        "min": np.fmin(a["min"], b["min"]),
+        "max": np.fmax(a["max"], b["max"]),
+    }
+
+
+def reduce_files(paths, open_file):
+    """
+    Parciais de vários arquivos, lidos um por vez com `open_file(caminho)`:
+    em memória ficam só os acumuladores e o arquivo atual. Retorna
+    (parciais, molde), com o molde sendo o campo do primeiro arquivo sem a
+    dimensão time. Levanta ValueError se as grades forem diferentes.
+    """
+    total = None
+    template = None
+    for path in paths:
+        dataarray = open_file(path)
+        piece = reduce_partial(dataarray.values)
+
+        if template is None:
+            template = dataarray.isel(time=0, drop=True) if "time" in dataarray.dims else dataarray
+        elif piece["sum"].shape != total["sum"].shape:
+            raise ValueError(f"grid mismatch in {path}")
+        total = merge_partials(total, piece)
+    return total, template
+
+
+def finalize_partial(partial, method):
+    """
+    Resultado de `method` a partir das parciais (mesma convenção do xarray:
+    skipna e ddof=0).
+    """
+    if method == "sum":
+        return partial["sum"]
+    elif method == "count":
+        return partial["count"]
+    elif method == "min":
+        return partial["min"]
+    elif method == "max":
+        return partial["max"]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        count = np.where(partial["count"] > 0, partial["count"], np.nan)
+        mean = partial["sum"] / count
+        if method == "mean":
+            return mean
+
+        var = partial["m2"] / count
+        if method == "var":
+            return var
+        elif method == "std":
+            return np.sqrt(var)
+
+    raise HTTPException(status_code=400, detail="Aggregation method not supported")
+
+
+def _group_by_period(paths):
+    """
+    Agrupa os caminhos por mês e dia, a partir dos diretórios {%Y}/{%j}.
+    """
+    months = {}
+    for path in paths:
+        day_dir = os.path.dirname(path)
+        year = os.path.basename(os.path.dirname(day_dir))
+        day = datetime.strptime(f"{year}/{os.path.basename(day_dir)}", "%Y/%j")
+        month_group = months.setdefault(day.replace(day=1), {})
+        month_group.setdefault(day, []).append(path)
+    return months
+
+
+def _is_covered(start, end, params):
+    """
+    Se o período [start, end) inteiro está dentro do intervalo pedido.
+    Períodos de borda são lidos dos arquivos e não são materializados.
+    """
+    if not (params.initDate and params.endDate):
+        return False
+    return (
+        pd.Timestamp(params.initDate) <= pd.Timestamp(start)
+        and pd.Timestamp(end) - pd.Timedelta(1, "ns") <= pd.Timestamp(params.endDate)
+    )
+
+
+def _get_identities(paths):
+    # um stat por arquivo na agregação, não um por período
+    return {identity[0]: identity for identity in cache.get_file_identities(paths)}
+
+
+def _entry_dir(paths, period, identities):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(paths[0])))
+    product = hashlib.sha1(root.encode()).hexdigest()[:16]
+    files = hashlib.sha1(
+        orjson.dumps([identities[path] for path in paths])
+    ).hexdigest()[:16]
+    return os.path.join(STORE_DIR, f"v{STORE_VERSION}", product, f"{period}-{files}")
+
+
+def _load(entry_dir):
+    try:
+        piece = {field: np.load(os.path.join(entry_dir, f"{field}.npy"), mmap_mode="r") for field in FIELDS}
+        latitude = np.load(os.path.join(entry_dir, "latitude.npy"))
+        longitude = np.load(os.path.join(entry_dir, "longitude.npy"))
+        with open(os.path.join(entry_dir, "meta.json"), "rb") as file:
+            meta = orjson.loads(file.read())
+    except (OSError, ValueError):
+        return None
+    return piece, latitude, longitude, meta["dtype"]
+
+
+def _save(entry_dir, piece, latitude, longitude, dtype, paths):
+    parent = os.path.dirname(entry_dir)
+    try:
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent, suffix=".tmp")
+        for field in FIELDS:
+            np.save(os.path.join(tmp_dir, f"{field}.npy"), piece[field])
+        np.save(os.path.join(tmp_dir, "latitude.npy"), latitude)
+        np.save(os.path.join(tmp_dir, "longitude.npy"), longitude)
+        with open(os.path.join(tmp_dir, "meta.json"), "wb") as file:
+            file.write(orjson.dumps({"dtype": dtype, "files": paths}))
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # outro worker gravou a mesma parcial primeiro
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _open_file(path, variable, extent=None):
+    try:
+        dataarray = nc_utils.open_dataset(path)[variable]
+        if extent:
+            dataarray = nc_utils.apply_window(dataarray, extent)
+        return dataarray
+    except Exception as e:
+        raise ValueError(f"falha ao ler {path}: {e}")
+
+
+def _build(paths, variable, extent=None):
+    piece, template = reduce_files(paths, lambda path: _open_file(path, variable, extent))
+    return piece, template.latitude.values, template.longitude.values, str(template.dtype)
+
+
+def _window(piece, extent):
+    """
+    Recorta uma parcial gravada (grade nativa) na janela do extent, com o
+    mesmo recorte e deslocamento de longitude de `nc_utils.apply_window`.
+    """
+    if not extent:
+        return piece
+    partial, latitude, longitude, dtype = piece
+    lat_slice, lon_slice, shift = nc_utils.get_window(
+        xr.DataArray(latitude, dims="latitude"),
+        xr.DataArray(longitude, dims="longitude"),
+        extent,
+    )
+    partial = {field: values[lat_slice, lon_slice] for field, values in partial.items()}
+    latitude, longitude = latitude[lat_slice], longitude[lon_slice]
+    if shift:
+        longitude = ((longitude + 180) % 360) - 180
+    return partial, latitude, longitude, dtype
+
+
+def _merge_pieces(a, b):
+    if a is None:
+        return b
+    if a[0]["sum"].shape != b[0]["sum"].shape or not (
+        np.array_equal(a[1], b[1]) and np.array_equal(a[2], b[2])
+    ):
+        raise ValueError("parciais com grades diferentes")
+    return merge_partials(a[0], b[0]), a[1], a[2], a[3]
+
+
+def refresh(paths, new_paths, variable):
+    """
+    Materializa as parciais diárias dos dias que receberam arquivos novos.
+    `paths` são todos os arquivos desses dias; a parcial anterior do mesmo
+    dia, quando existe, é reaproveitada e só os arquivos novos são lidos.
+    """
+    if not STORE_DIR:
+        return 0
+
+    new_paths = set(new_paths)
+    identities = _get_identities(paths)
+    count = 0
+    for days in _group_by_period(paths).values():
+        for day, day_paths in days.items():
+            if new_paths.isdisjoint(day_paths):
+                continue
+            period = day.strftime("%Y-%m-%d")
+            entry_dir = _entry_dir(day_paths, period, identities)
+            if _load(entry_dir) is not None:
+                continue
+
+            try:
+                old_paths = [path for path in day_paths if path not in new_paths]
+                piece = _load(_entry_dir(old_paths, period, identities)) if old_paths else None
+                if piece is None:
+                    piece = _build(day_paths, variable)
+                else:
+                    added = [path for path in day_paths if path in new_paths]
+                    piece = _merge_pieces(piece, _build(added, variable))
+            except (ValueError, OSError, HTTPException) as e:
+                logger.warning({"message": "falha ao atualizar parcial", "period": period, "error": str(e)})
+                continue
+
+            _save(entry_dir, *piece, day_paths)
+            count += 1
+    return count
+
+
+def aggregate(validated_paths, params, extent=None):
+    """
+    Agregação temporal combinando as parciais gravadas (por mês e por dia)
+    com os dias sem parcial, lidos dos arquivos já na janela do extent.
+    Retorna None quando nenhuma parcial gravada cobre o pedido ou quando
+    não é possível (o chamador usa o caminho normal).
+    """
+    try:
+        identities = _get_identities(validated_paths)
+        total = None
+        edge_paths = []
+        for month, days in _group_by_period(validated_paths).items():
+            month_end = (month + timedelta(days=32)).replace(day=1)
+            month_paths = [path for day_paths in days.values() for path in day_paths]
+            month_dir = _entry_dir(month_paths, month.strftime("%Y-%m"), identities)
+
+            piece = _load(month_dir)
+            if piece is not None:
+                total = _merge_pieces(total, _window(piece, extent))
+                continue
+
+            stored = []
+            for day, day_paths in days.items():
+                day_piece = _load(_entry_dir(day_paths, day.strftime("%Y-%m-%d"), identities))
+                if day_piece is None:
+                    edge_paths.extend(day_paths)
+                else:
+                    stored.append(day_piece)
+
+            # mês coberto com todos os dias gravados: a parcial do mês sai da
+            # soma das diárias, sem reler os arquivos
+            if len(stored) == len(days) > 1 and _is_covered(month, month_end, params):
+                piece = None
+                for day_piece in stored:
+                    piece = _merge_pieces(piece, day_piece)
+                _save(month_dir, *piece, month_paths)
+
+            for day_piece in stored:
+                total = _merge_pieces(total, _window(day_piece, extent))
+
+        if total is None:
+            return None
+        if edge_paths:
+            total = _merge_pieces(total, _build(edge_paths, params.variable, extent))
+    except (ValueError, OSError, HTTPException) as e:
+        logger.warning({"message": "parciais indisponíveis, usando arquivos", "error": str(e)})
+        return None
+
+    partial, latitude, longitude, dtype = total
+    values = np.array(finalize_partial(partial, params.aggregation))
+    if params.aggregation != "count" and np.issubdtype(np.dtype(dtype), np.floating):
+        values = values.astype(dtype)
+
+    return xr.DataArray(
+        values,
+        coords={"latitude": latitude, "longitude": longitude},
+        dims=("latitude", "longitude"),
+        name=params.variable,
+    )
@@ -3,6 +3,9 @@ from datetime import datetime
 from functools import lru_cache
 
 import pandas as pd
+from fastapi import HTTPException
+
+import utils.metrics as metrics
 
 
 def gen_path_template(params):
@@ -26,6 +29,9 @@ def gen_path_template(params):
         file_in = "{params.model}_{params.variable}_{params.member}_%Y%m%d.nc"
         freq = "1D"
 
+    else:
+        raise ValueError(f"kind inválido: '{params.kind}'")
+
     return (os.path.join(dir_in, file_in).format(params=params), freq)
 
 
@@ -52,3 +58,42 @@ def get_paths(params, path_template, freq):
             date_range = [params.date]
 
     return (dt.strftime(path_template) for dt in date_range)
+
+
+def run_validate(paths: list, variable: str):
+    validated_paths = [p for p in paths if os.path.isfile(p)]
+
+    if not validated_paths:
+        msg = {
+            "function_name": f"run_validate()",
+            "message": f"no valid paths found for variable {variable}",
+            "paths": paths,
+        }
+        raise HTTPException(
+            status_code=400,
+            detail=msg,
+        )
+
+    else:
+        return validated_paths
+
+
+def get_validated_paths(params):
+    """
+    Gera e valida os caminhos dos arquivos de entrada.
+    """
+    # o catálogo importa este módulo
+    import utils.catalog as catalog
+
+    with metrics.stage("paths"):
+        path_template, freq = gen_path_template(params)
+
+        if catalog.CATALOG_ENABLED:
+            validated_paths = catalog.get_paths(params, path_template, freq)
+            if validated_paths:
+                return validated_paths
+
+        raw_paths = list(get_paths(params, path_template, freq))
+
+    with metrics.stage("validate"):
+        return run_validate(raw_paths, params.variable)
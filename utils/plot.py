@@ -1,15 +1,27 @@
+import json
+import os
+from functools import lru_cache
+from types import SimpleNamespace
+
 import matplotlib
 
 matplotlib.use("Agg")
 from io import BytesIO
 
 import cartopy.crs as ccrs
-import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from PIL import Image
 import cartopy.feature as cfeature
 from cartopy.mpl.gridliner import LATITUDE_FORMATTER
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER
-import geopandas as gpd
+
+import utils.assets as assets
+import utils.features as features_utils
+
+# Quantidade de mapas base (extent, dpi, tamanho, detalhes) mantidos em memória
+BASEMAP_CACHE_SIZE = int(os.environ.get("MOONPNG_BASEMAP_CACHE_SIZE", 64))
 
 
 def draw_gridlines(ax, params):
@@ -59,89 +71,188 @@ def draw_gridlines(ax, params):
             gridlines.xlabel_style = CFG_GRIDLINES
             gridlines.ylabel_style = CFG_GRIDLINES
 
-def draw_details(ax, params):
+class ShapeFeature(cfeature.ShapelyFeature):
+    """
+    Geojson do registro (utils/assets.py) como feature do cartopy: as
+    geometrias de cada recorte vêm do índice espacial.
+    """
+
+    def __init__(self, shape, **kwargs):
+        super().__init__(shape["geometries"], ccrs.PlateCarree(), **kwargs)
+        self.shape = shape
+
+    def intersecting_geometries(self, extent):
+        return iter(assets.query(self.shape, extent))
+
+
+def _shapecontour_names(params):
+    if isinstance(params.shapecontours, dict):
+        return list(params.shapecontours)
+    if isinstance(params.shapecontours, str):
+        return [params.shapecontours]
+    return []
+
+
+def get_detail_features(params, resolution=None):
+    """
+    Lista os detalhes estáticos do mapa como pares (feature, estilo). As
+    features do Natural Earth vêm do acervo local quando ele existe,
+    simplificadas para `resolution` (graus por pixel da imagem).
+    """
     ADMIN_0_STATES_PROVINCES = cfeature.NaturalEarthFeature(category='cultural', name='admin_0_boundary_lines_land',
                                         scale='50m', facecolor='none')
     ADMIN_1_STATES_PROVINCES = cfeature.NaturalEarthFeature(category='cultural', name='admin_1_states_provinces',
                                                 scale='50m', facecolor='none')
-    
+    features = []
+
     if not params.ocean:
-        ax.add_feature(
-                cfeature.OCEAN.with_scale("50m"),
-                zorder=1,
-                facecolor='white')
+        features.append((
+            cfeature.OCEAN.with_scale("50m"),
+            dict(zorder=1, facecolor='white'),
+        ))
 
-    if isinstance(params.shapecontours, dict):
-        for name, config in params.shapecontours.items():
-            shape_feature = cfeature.ShapelyFeature(
-                gpd.read_file(f"data/cmaps/geojsons/{name}.geojson").geometry, 
-                ccrs.PlateCarree(),
-                facecolor="none", 
-                edgecolor="black", 
-                zorder=4000
-            )
-            ax.add_feature(shape_feature)
-    elif isinstance(params.shapecontours, str):
-        shape_feature = cfeature.ShapelyFeature(
-            gpd.read_file(f"data/cmaps/geojsons/{params.shapecontours}.geojson").geometry, 
-            ccrs.PlateCarree(),
-            facecolor="none", 
-            edgecolor="black", 
+    for name in _shapecontour_names(params):
+        shape_feature = ShapeFeature(
+            assets.get_shape(name),
+            facecolor="none",
+            edgecolor="black",
             zorder=4000
         )
-        ax.add_feature(shape_feature)
+        features.append((shape_feature, {}))
 
     if isinstance(params.details, dict):
         for name, config in params.details.items():
+            style = dict(
+                edgecolor=config["edgecolor"],
+                facecolor=config["facecolor"],
+                zorder=config["zorder"],
+            )
             if name == "ADMIN_0_STATES_PROVINCES":
-                ax.add_feature(
-                    ADMIN_0_STATES_PROVINCES,
-                    edgecolor=config["edgecolor"],
-                    facecolor=config["facecolor"],
-                    zorder=config["zorder"]
-                )
+                features.append((ADMIN_0_STATES_PROVINCES, style))
             elif name == "ADMIN_1_STATES_PROVINCES":
-                ax.add_feature(
-                    ADMIN_1_STATES_PROVINCES,
-                    edgecolor=config["edgecolor"],
-                    facecolor=config["facecolor"],
-                    zorder=config["zorder"]
-                )
+                features.append((ADMIN_1_STATES_PROVINCES, style))
             else:              
-                ax.add_feature(
-                    getattr(cfeature, name).with_scale(config["scale"]),
-                    edgecolor=config["edgecolor"],
-                    facecolor=config["facecolor"],
-                    zorder=config["zorder"]
-                )
+                features.append((getattr(cfeature, name).with_scale(config["scale"]), style))
     else:
-        ax.add_feature(
+        features.append((
             cfeature.COASTLINE.with_scale("50m"),
-            edgecolor='k',
-            facecolor="#F5E9D3",
-            zorder=3)
-        ax.add_feature(
+            dict(edgecolor='k', facecolor="#F5E9D3", zorder=3),
+        ))
+        features.append((
             cfeature.BORDERS.with_scale("50m"),
-            zorder=3,
-            edgecolor="black",
-            facecolor="#F5E9D3")
-        ax.add_feature(
+            dict(zorder=3, edgecolor="black", facecolor="#F5E9D3"),
+        ))
+        features.append((
             ADMIN_0_STATES_PROVINCES,
-            facecolor="none", edgecolor="black",
-            zorder=3)
-        ax.add_feature(
+            dict(facecolor="none", edgecolor="black", zorder=3),
+        ))
+        features.append((
             ADMIN_1_STATES_PROVINCES,
-            facecolor="none", edgecolor="black",
-            zorder=3)
-        # ax.add_feature(
+            dict(facecolor="none", edgecolor="black", zorder=3),
+        ))
+        # features.append((
         #     STATES.with_scale("50m"),
-        #     facecolor="none", edgecolor="black",
-        #     zorder=3)
-        ax.add_feature(
+        #     dict(facecolor="none", edgecolor="black", zorder=3),
+        # ))
+        features.append((
             cfeature.LAND.with_scale("50m"),
-            edgecolor='k',
-            facecolor="#F5E9D3",
-            zorder=-1)
+            dict(edgecolor='k', facecolor="#F5E9D3", zorder=-1),
+        ))
+
+    return [(features_utils.localize(feature, resolution), style) for feature, style in features]
+
+
+def get_resolution(extent, dpi, size):
+    """
+    Tamanho do pixel da imagem, em graus, para eixos de `size` polegadas.
+    """
+    return max((extent[1] - extent[0]) / (size[0] * dpi), (extent[3] - extent[2]) / (size[1] * dpi))
+
+
+def _axes_view(ax):
+    # extent visível e tamanho dos eixos na figura, em polegadas
+    ax.apply_aspect()
+    extent = tuple(round(value, 6) for value in ax.get_extent(crs=ccrs.PlateCarree()))
+    position = ax.get_position()
+    width, height = ax.figure.get_size_inches()
+    return extent, (round(position.width * width, 4), round(position.height * height, 4))
+
+
+def draw_details(ax, params):
+    extent, size = _axes_view(ax)
+    for feature, style in get_detail_features(params, get_resolution(extent, params.dpi, size)):
+        ax.add_feature(feature, **style)
+
+
+def _details_key(params):
+    return json.dumps(
+        {
+            "details": params.details,
+            "ocean": params.ocean,
+            "shapecontours": params.shapecontours,
+            # versão dos geojsons: um arquivo alterado não reaproveita o cache
+            "versions": {name: assets.get_shape(name)["mtime"] for name in _shapecontour_names(params)},
+            "features": features_utils.version(),
+        },
+        sort_keys=True,
+    )
+
+
+@lru_cache(maxsize=max(BASEMAP_CACHE_SIZE, 1))
+def get_basemap_layers(extent, dpi, size, details_key):
+    """
+    Rasteriza os detalhes estáticos em camadas RGBA, uma por zorder, do
+    tamanho exato dos eixos na imagem final.
+    """
+    config = SimpleNamespace(**json.loads(details_key))
+
+    groups = {}
+    for feature, style in get_detail_features(config, get_resolution(extent, dpi, size)):
+        zorder = style.get("zorder", feature.kwargs.get("zorder", 1.5))
+        groups.setdefault(zorder, []).append((feature, style))
+
+    layers = []
+    for zorder in sorted(groups):
+        figure = Figure(figsize=size, dpi=dpi)
+        canvas = FigureCanvasAgg(figure)
+        figure.patch.set_alpha(0)
+
+        ax = figure.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree())
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+        ax.patch.set_visible(False)
+        ax.spines["geo"].set_visible(False)
+
+        for feature, style in groups[zorder]:
+            ax.add_feature(feature, **style)
+
+        canvas.draw()
+        image = np.array(canvas.buffer_rgba())
+        image.setflags(write=False)
+        layers.append((zorder, image))
+
+    return tuple(layers)
+
+
+def draw_basemap(ax, params):
+    """
+    Desenha os detalhes estáticos compondo camadas pré-renderizadas. Cada camada
+    entra com o zorder original, então continua acima ou abaixo dos dados.
+    """
+    if BASEMAP_CACHE_SIZE <= 0:
+        return draw_details(ax, params)
+
+    extent, size = _axes_view(ax)
+    layers = get_basemap_layers(extent, params.dpi, size, _details_key(params))
+    for zorder, image in layers:
+        ax.imshow(
+            image,
+            origin="upper",
+            extent=extent,
+            transform=ccrs.PlateCarree(),
+            interpolation="nearest",
+            zorder=zorder,
+        )
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
 
 
 
@@ -0,0 +1,5 @@
+# Carregado pelo forkserver dos renderizadores (RENDER_EXECUTOR "forkserver"):
+# o servidor aquece uma vez e cada renderizador nasce de um fork dele.
+import utils.warmup as warmup
+
+warmup.warm()
@@ -0,0 +1,202 @@
+import json
+import os
+import threading
+import time
+from functools import partial
+
+import pandas as pd
+
+import utils.cache as cache
+import utils.catalog as catalog
+import utils.encode as encode
+import utils.executor as render_executor
+import utils.paths as path_utils
+import utils.singleflight as singleflight
+from models.params import MoonPngParams
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# JSON com os conjuntos de parâmetros "quentes" (desligado se vazio). Cada
+# item tem "params" (MoonPngParams sem as datas), "window" opcional (ex.:
+# "1D": de último horário - window até o último; sem window, só o último
+# horário) e "profiles" opcional (padrão: o perfil configurado).
+PREWARM_CONFIG = os.environ.get("MOONPNG_PREWARM_CONFIG", "")
+# Espera depois da chegada de arquivos, para renderizar uma leva inteira
+PREWARM_DELAY_SECONDS = float(os.environ.get("MOONPNG_PREWARM_DELAY_SECONDS", 30))
+# Renderiza tudo na inicialização, além de a cada chegada
+PREWARM_ON_START = os.environ.get("MOONPNG_PREWARM_ON_START", "1") == "1"
+# Intervalo entre as tentativas de assumir a pré-renderização da máquina
+PREWARM_LEADER_RETRY_SECONDS = float(os.environ.get("MOONPNG_PREWARM_LEADER_RETRY_SECONDS", 30))
+
+_hot = {}
+_pending = {}
+_condition = threading.Condition()
+_thread = None
+# Lock do worker que pré-renderiza (um por máquina), mantido aberto
+_leader = None
+
+
+def _product_key(params: MoonPngParams):
+    return (params.source, params.kind, params.model, params.variable, params.member)
+
+
+def load_config(path):
+    """
+    Lê e valida os conjuntos quentes, agrupados por produto.
+    """
+    with open(path) as file:
+        entries = json.load(file)
+
+    hot = {}
+    for entry in entries:
+        params = MoonPngParams(**entry["params"])
+        window = pd.Timedelta(entry["window"]) if entry.get("window") else None
+        profiles = entry.get("profiles") or [encode.negotiate(None)]
+        hot.setdefault(_product_key(params), []).append((params, window, profiles))
+    return hot
+
+
+def get_params(params: MoonPngParams, window, latest):
+    """
+    Parâmetros para o horário mais recente do produto, como uma requisição
+    pelo último dado os enviaria.
+    """
+    start = latest - window if window is not None else latest
+    return params.model_copy(update={
+        "date": latest.isoformat(),
+        "initDate": start.isoformat(),
+        "endDate": latest.isoformat(),
+    })
+
+
+def warm(key):
+    """
+    Renderiza para o cache os conjuntos quentes de um produto. Conjuntos já
+    em cache (em memória ou em disco) não são renderizados de novo.
+    """
+    times = catalog.get_times(*key)
+    if not times:
+        return
+
+    started = time.perf_counter()
+    rendered, cached = 0, 0
+    for params, window, profiles in _hot.get(key, []):
+        params = get_params(params, window, pd.Timestamp(times[-1]))
+        try:
+            validated_paths = path_utils.get_validated_paths(params)
+        except Exception as e:
+            logger.warning({"message": "pré-renderização sem arquivos", "product": key, "error": str(e)})
+            continue
+
+        render = "utils.render:render_raster" if params.renderer == "raster" else "utils.render:render_png"
+        for profile in profiles:
+            image_key = cache.make_key([(params, validated_paths)], profile)
+            if cache.get(image_key) is not None:
+                cached += 1
+                continue
+            try:
+                cache.render_cached(image_key, partial(render_executor.run, render, params, validated_paths, profile))
+                rendered += 1
+            except Exception as e:
+                logger.warning({"message": "falha na pré-renderização", "product": key, "error": str(e)})
+
+    logger.info({
+        "message": "pré-renderização concluída",
+        "product": key,
+        "latest": times[-1].isoformat(),
+        "rendered": rendered,
+        "cached": cached,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+def refresh_partials(key, new_paths):
+    """
+    Atualiza as parciais diárias dos dias que receberam os arquivos novos.
+    Só o worker que pré-renderiza atualiza as parciais.
+    """
+    import utils.partials as partials
+
+    if not partials.STORE_DIR or _leader is None:
+        return
+    day_dirs = {os.path.dirname(path) for path in new_paths}
+    _, paths = catalog.get_product(*key)["index"]
+    day_paths = [path for path in paths if os.path.dirname(path) in day_dirs]
+    count = partials.refresh(day_paths, new_paths, key[3])
+    if count:
+        logger.info({"message": "parciais atualizadas", "product": key, "days": count})
+
+
+def _on_new_files(key, paths):
+    if key not in _hot:
+        return
+    with _condition:
+        _, pending_paths = _pending.get(key, (0, set()))
+        # a espera recomeça a cada arquivo novo da mesma leva
+        _pending[key] = (time.monotonic() + PREWARM_DELAY_SECONDS, pending_paths | set(paths))
+        _condition.notify()
+
+
+def _next_due():
+    with _condition:
+        while True:
+            now = time.monotonic()
+            due = [key for key, (deadline, _) in _pending.items() if deadline <= now]
+            if due:
+                return [(key, _pending.pop(key)[1]) for key in due]
+            timeout = min((deadline for deadline, _ in _pending.values()), default=now + 60) - now
+            _condition.wait(timeout)
+
+
+def _lead():
+    """
+    Espera até este worker ficar com o lock da pré-renderização. Quando o
+    worker que o tem termina, o lock é liberado e outro assume.
+    """
+    global _leader
+
+    while True:
+        _leader = singleflight.try_lock("prewarm")
+        if _leader is not None:
+            return
+        time.sleep(PREWARM_LEADER_RETRY_SECONDS)
+
+
+def _run():
+    _lead()
+    for key in _hot:
+        # o catálogo só varre produtos que já conhece
+        catalog.get_product(*key, pin=True)
+    catalog.subscribe(_on_new_files)
+    logger.info({"message": "pré-renderização ativa", "products": len(_hot), "pid": os.getpid()})
+
+    if PREWARM_ON_START:
+        for key in list(_hot):
+            warm(key)
+
+    while True:
+        for key, paths in _next_due():
+            try:
+                refresh_partials(key, sorted(paths))
+                warm(key)
+            except Exception as e:
+                logger.warning({"message": "falha na pré-renderização", "product": key, "error": str(e)})
+
+
+def start():
+    """
+    Observa, pelo catálogo, a chegada de arquivos dos produtos quentes e
+    pré-renderiza os conjuntos configurados. Chamado em todos os workers,
+    mas só um por máquina (o que tem o lock "prewarm" do singleflight)
+    observa os produtos, pré-renderiza e atualiza as parciais; os outros
+    esperam a vez.
+    """
+    global _thread, _hot
+
+    if not PREWARM_CONFIG or not catalog.CATALOG_ENABLED or _thread is not None:
+        return
+
+    _hot = load_config(PREWARM_CONFIG)
+    _thread = threading.Thread(target=_run, name="moonpng-prewarm", daemon=True)
+    _thread.start()
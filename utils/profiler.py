@@ -1,31 +1,111 @@
+import hmac
+import os
+import threading
 import time
 import tracemalloc
-from contextlib import contextmanager
 
+from fastapi import HTTPException
+
+import utils.executor as render_executor
 from utils.logger import get_logger
 
 logger = get_logger()
 
+# Permite pedir o perfil de uma requisição pelo cabeçalho PROFILE_HEADER
+PROFILE_ENABLED = os.environ.get("MOONPNG_PROFILE_ENABLED", "0") == "1"
+PROFILE_HEADER = "X-MoonPNG-Profile"
+# Token exigido no cabeçalho PROFILE_TOKEN_HEADER para pedir um perfil (sem
+# token, basta o PROFILE_ENABLED)
+PROFILE_TOKEN = os.environ.get("MOONPNG_PROFILE_TOKEN", "")
+PROFILE_TOKEN_HEADER = "X-MoonPNG-Profile-Token"
+# cpu: amostragem do pyinstrument (relatório HTML); memory: tracemalloc
+# (maiores alocações, em JSON)
+PROFILE_MODES = ["cpu", "memory"]
+# Intervalo de amostragem do pyinstrument (segundos)
+PROFILE_INTERVAL = float(os.environ.get("MOONPNG_PROFILE_INTERVAL", 0.001))
+# Quadros guardados por alocação e linhas no relatório de memória
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get("MOONPNG_PROFILE_TRACEMALLOC_FRAMES", 10))
+PROFILE_TOP = 30
+
+# tracemalloc é global ao processo: um perfil de memória por vez
+_memory_lock = threading.Lock()
+
 
-@contextmanager
-def profile_block(label="block"):
+def get_mode(request):
     """
-    Context manager para medir tempo e memória de um bloco de código.
+    Modo de perfil pedido no cabeçalho, ou None.
     """
-    tracemalloc.start()
-    start_time = time.perf_counter()
+    mode = request.headers.get(PROFILE_HEADER)
+    if mode is None:
+        return None
+    if not PROFILE_ENABLED:
+        raise HTTPException(status_code=403, detail="Perfil por requisição desligado (MOONPNG_PROFILE_ENABLED).")
+    if PROFILE_TOKEN and not hmac.compare_digest(
+        request.headers.get(PROFILE_TOKEN_HEADER, "").encode(), PROFILE_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail=f"Token de perfil inválido ({PROFILE_TOKEN_HEADER}).")
+    if mode not in PROFILE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Perfil '{mode}' inválido. Use um de {PROFILE_MODES}.",
+        )
+    return mode
+
+
+def profile_cpu(fn):
+    from pyinstrument import Profiler
+
+    profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="disabled")
+    profiler.start()
+    try:
+        fn()
+    finally:
+        profiler.stop()
+    return profiler.output_html()
+
+
+def profile_memory(fn):
+    if not _memory_lock.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Já há um perfil de memória em andamento, tente novamente.")
+
     try:
-        yield
+        if tracemalloc.is_tracing():
+            raise HTTPException(status_code=503, detail="tracemalloc já está em uso neste processo.")
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        started = time.perf_counter()
+        try:
+            fn()
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
     finally:
-        end_time = time.perf_counter()
-        current, peak = tracemalloc.get_traced_memory()
-        tracemalloc.stop()
-        duration_ms = round((end_time - start_time) * 1000, 2)
-        logger.info(
+        _memory_lock.release()
+
+    statistics = snapshot.statistics("lineno")
+    return {
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        "memory_current_kb": round(current / 1024, 2),
+        "memory_peak_kb": round(peak / 1024, 2),
+        "top": [
             {
-                "message": f"PROFILING: {label}",
-                "duration_ms": duration_ms,
-                "memory_current_kb": round(current / 1024, 2),
-                "memory_peak_kb": round(peak / 1024, 2),
+                "location": f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+                "size_kb": round(statistic.size / 1024, 2),
+                "count": statistic.count,
             }
-        )
+            for statistic in statistics[:PROFILE_TOP]
+        ],
+    }
+
+
+def run(mode, fn):
+    """
+    Executa `fn` no próprio processo (sem pool nem cache), sob o perfil
+    pedido, e retorna (conteúdo, media type) do relatório. Ocupa uma vaga
+    do limite de renderizações simultâneas, como as renderizações do pool.
+    """
+    logger.info({"message": "perfil da requisição", "mode": mode})
+    with render_executor.slot():
+        if mode == "cpu":
+            return profile_cpu(fn), "text/html"
+        return profile_memory(fn), "application/json"
@@ -0,0 +1,100 @@
+import matplotlib
+import numpy as np
+from matplotlib.colors import BoundaryNorm
+from matplotlib.ticker import MaxNLocator
+from PIL import Image
+
+import utils.colorbar as colorbar_utils
+from models.params import MoonPngParams
+from utils.levels import get_levels
+
+
+def get_style(params: MoonPngParams, data=None):
+    """
+    Níveis e cores de cada intervalo, como o contourf usaria: a colorbar
+    escolhida, os `levels` pedidos ou níveis automáticos sobre os dados.
+    """
+    if params.colorbar:
+        levels, cmap, norm = colorbar_utils.add_colorbar(params.colorbar)
+    else:
+        levels = get_levels(params)
+        if levels is None:
+            # mesmo default do contourf
+            levels = MaxNLocator(8).tick_values(np.nanmin(data), np.nanmax(data))
+        cmap = matplotlib.colormaps[matplotlib.rcParams["image.cmap"]]
+        norm = BoundaryNorm(levels, cmap.N)
+
+    levels = np.asarray(levels, dtype="float64")
+    centers = (levels[:-1] + levels[1:]) / 2
+    colors = cmap(norm(centers))
+    return levels, colors
+
+
+def get_lut(colors):
+    """
+    Tabela RGBA com uma linha por intervalo e a última transparente, para
+    valores fora dos níveis ou ausentes.
+    """
+    lut = np.zeros((len(colors) + 1, 4), dtype="uint8")
+    lut[:-1] = np.round(np.asarray(colors) * 255)
+    return lut
+
+
+def classify(data, levels):
+    """
+    Índice do intervalo de cada célula (levels[i] < valor <= levels[i + 1],
+    com o primeiro nível incluído); fora dos níveis vira len(levels) - 1.
+    """
+    data = np.ma.filled(np.ma.asarray(data, dtype="float64"), np.nan)
+    index = np.searchsorted(levels, data, side="left") - 1
+    index[data == levels[0]] = 0
+    outside = (index < 0) | (index >= len(levels) - 1) | np.isnan(data)
+    index[outside] = len(levels) - 1
+    return index.astype("uint16" if len(levels) > 255 else "uint8")
+
+
+def nearest_index(coordinate, values):
+    """
+    Índice da célula mais próxima em uma coordenada crescente e se o ponto
+    cai dentro da grade (meia célula além das bordas).
+    """
+    i = np.clip(np.searchsorted(coordinate, values), 1, len(coordinate) - 1)
+    left = coordinate[i - 1]
+    right = coordinate[i]
+    i = np.where(values - left <= right - values, i - 1, i)
+
+    half = (coordinate[-1] - coordinate[0]) / max(len(coordinate) - 1, 1) / 2
+    inside = (values >= coordinate[0] - half) & (values <= coordinate[-1] + half)
+    return i, inside
+
+
+def resample(data, lons, lats, out_lons, out_lats):
+    """
+    Amostra a grade (lats, lons), ambas crescentes, nos pontos (out_lats x
+    out_lons) pela célula mais próxima. Fora da grade fica NaN. Sem
+    interpolação: classificar um valor interpolado entre duas células
+    criaria faixas de intervalos que não existem nos dados.
+    """
+    data = np.ma.filled(np.ma.asarray(data, dtype="float32"), np.nan)
+    ix, inside_x = nearest_index(lons, out_lons)
+    iy, inside_y = nearest_index(lats, out_lats)
+
+    result = data[iy[:, None], ix[None, :]]
+    result[~inside_y] = np.nan
+    result[:, ~inside_x] = np.nan
+    return result
+
+
+def to_image(index, colors):
+    """
+    Imagem com paleta de 8 bits (transparência por índice) a partir dos
+    índices de classify, ou RGBA quando há mais de 255 intervalos.
+    """
+    lut = get_lut(colors)
+    if len(lut) > 256:
+        return Image.fromarray(lut[index], "RGBA")
+
+    image = Image.fromarray(index.astype("uint8"), "P")
+    image.putpalette(lut[:, :3].tobytes())
+    image.info["transparency"] = lut[:, 3].tobytes()
+    return image
@@ -0,0 +1,287 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib
+
+matplotlib.use("Agg")
+import cartopy.crs as ccrs
+import numpy as np
+import xarray as xr
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+import utils.aggregations as aggregations
+import utils.colorbar as colorbar_utils
+import utils.downsample as downsample_utils
+import utils.encode as encode
+import utils.executor as render_executor
+import utils.mask as mask_utils
+import utils.metrics as metrics
+import utils.netcdf as nc_utils
+import utils.plot as plot_utils
+import utils.raster as raster
+from models.params import MoonPngParams
+from utils.bounding_box import get_bbox
+from utils.levels import get_levels
+
+FIGURE_SIZE = (15, 20)
+
+
+def new_figure():
+    """
+    Figura com eixos PlateCarree, sem o estado global do pyplot.
+    """
+    figure = Figure(figsize=FIGURE_SIZE)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(projection=ccrs.PlateCarree())
+    return figure, ax
+
+
+def load_layer(params: MoonPngParams, validated_paths: list):
+    """
+    Prepara os dados de uma camada para desenho: agrega, recorta, reduz a
+    resolução e aplica a máscara. Retorna (extent, lons, lats, data), com as
+    coordenadas em 1D.
+    """
+    dataset = None
+    try:
+        extent = get_bbox(params)
+        read_extent = mask_utils.get_mask_extent(params.mask, extent, pad=1) if params.mask else extent
+        with metrics.stage("aggregate"):
+            dataset = aggregations.aggregate(validated_paths, params, extent=read_extent)
+            dataset.load()
+        return prepare_layer(dataset, params, extent)
+
+    finally:
+        if dataset is not None:
+            nc_utils.close_and_destroy(dataset)
+
+
+def prepare_layer(dataset, params: MoonPngParams, extent):
+    """
+    Recorta, mascara e reduz a resolução de um campo 2D já agregado.
+    Retorna (extent, lons, lats, data), com as coordenadas em 1D.
+    """
+    with metrics.stage("subset"):
+        if extent:
+            dataset = dataset.sel(
+                longitude=slice(extent[0], extent[1]),
+                latitude=slice(extent[2], extent[3]),
+            )
+
+    if params.mask:
+        # a máscara vem antes da redução: as células de fora viram NaN e não
+        # entram nas médias dos blocos da borda
+        data, lons, lats, _ = mask_utils.get_masked_data(dataset, params.mask, extent=extent, pad=1)
+        dataset = xr.DataArray(
+            np.ma.filled(data.astype(np.result_type(data.dtype, np.float32)), np.nan),
+            coords={"latitude": lats[:, 0], "longitude": lons[0]},
+            dims=("latitude", "longitude"),
+            name=dataset.name,
+            attrs=dataset.attrs,
+        )
+
+    with metrics.stage("subset"):
+        dataset = downsample_utils.downsample(dataset, params, extent, FIGURE_SIZE)
+
+    data = np.ma.masked_invalid(dataset.values) if params.mask else dataset.values
+    return extent, dataset.longitude.values, dataset.latitude.values, data
+
+
+def load_layers(params_list: list[MoonPngParams], paths_list: list[list]):
+    """
+    Prepara todas as camadas em paralelo, no máximo LAYER_WORKERS por vez.
+    """
+    if len(params_list) == 1 or render_executor.LAYER_WORKERS <= 1:
+        return [load_layer(params, paths) for params, paths in zip(params_list, paths_list)]
+
+    with ThreadPoolExecutor(max_workers=min(render_executor.LAYER_WORKERS, len(params_list))) as pool:
+        return list(pool.map(load_layer, params_list, paths_list))
+
+
+def render_png(params: MoonPngParams, validated_paths: list, profile: str = "png") -> bytes:
+    """
+    Renderiza a imagem de uma única camada e retorna os bytes no perfil
+    de codificação pedido.
+    """
+    return draw_layer(params, load_layer(params, validated_paths), profile)
+
+
+def draw_layer(params: MoonPngParams, layer, profile: str = "png") -> bytes:
+    """
+    Desenha uma camada já preparada por load_layer ou prepare_layer.
+    """
+    with metrics.stage("plot"):
+        figure, ax = new_figure()
+        extent, lons, lats, data = layer
+        lons, lats = np.meshgrid(lons, lats)
+
+        if extent:
+            ax.set_extent(extent, crs=ccrs.PlateCarree())
+
+        levels = get_levels(params)
+
+        if params.contourf:
+            cbar = ax.contourf(lons, lats, data, transform=ccrs.PlateCarree(), levels=levels)
+            figure.colorbar(
+                cbar,
+                ax=ax,
+                orientation="horizontal",
+                pad=0.05,
+                aspect=50,
+                label=params.variable
+            )
+
+        elif params.contour:
+            ax.contour(lons, lats, data, colors=params.color, linewidths=params.linewidths, levels=levels, zorder=params.zorder, transform=ccrs.PlateCarree())
+
+        if params.details:
+            plot_utils.draw_basemap(ax, params)
+
+        if params.gridlines:
+            plot_utils.draw_gridlines(ax, params)
+
+    return encode.encode_figure(figure, params.dpi, profile)
+
+
+def render_field(params: MoonPngParams, dataset, profile: str = "png") -> bytes:
+    """
+    Renderiza um campo 2D já agregado e carregado em memória, com o
+    renderizador pedido; o recorte e a máscara vêm de `params`.
+    """
+    if params.renderer == "raster":
+        return draw_raster(params, dataset, profile)
+    return draw_layer(params, prepare_layer(dataset, params, get_bbox(params)), profile)
+
+
+def render_png_post(params_list: list[MoonPngParams], paths_list: list[list], profile: str = "png") -> bytes:
+    """
+    Renderiza várias camadas sobre os mesmos eixos e retorna os bytes da
+    imagem. O raster só desenha uma camada (validado na rota).
+    """
+    if len(params_list) == 1 and params_list[0].renderer == "raster":
+        return render_raster(params_list[0], paths_list[0], profile)
+    return draw_layers(params_list, load_layers(params_list, paths_list), profile)
+
+
+def draw_layers(params_list: list[MoonPngParams], layers: list, profile: str = "png") -> bytes:
+    """
+    Desenha as camadas já preparadas por load_layer, em sequência e na
+    ordem pedida; os detalhes do mapa entram uma única vez.
+    """
+    with metrics.stage("plot"):
+        figure, ax = new_figure()
+
+        for params, (extent, lons, lats, data) in zip(params_list, layers):
+            lons, lats = np.meshgrid(lons, lats)
+            if extent:
+                ax.set_extent(extent, crs=ccrs.PlateCarree())
+
+            levels = get_levels(params)
+
+            if params.contourf:
+                cmap, norm = None, None
+                if params.colorbar:
+                    levels, cmap, norm = colorbar_utils.add_colorbar(params.colorbar)
+
+                cbar = ax.contourf(lons, lats, data, transform=ccrs.PlateCarree(), levels=levels, cmap=cmap, norm=norm)
+                colorbar_utils.show_colorbar(cbar, ax)
+
+            elif params.contour:
+                ax.contour(lons, lats, data, colors=params.color, linewidths=params.linewidths, levels=levels, zorder=params.zorder, transform=ccrs.PlateCarree())
+
+        # detalhes e gridlines seguem a última camada, como antes
+        if params.details:
+            plot_utils.draw_basemap(ax, params)
+
+        if params.gridlines:
+            plot_utils.draw_gridlines(ax, params)
+
+    return encode.encode_figure(figure, params.dpi, profile)
+
+
+def _basemap_layers(params, extent, width, height):
+    layers = plot_utils.get_basemap_layers(
+        tuple(round(value, 6) for value in extent),
+        params.dpi,
+        (width / params.dpi, height / params.dpi),
+        plot_utils._details_key(params),
+    )
+    for zorder, image in layers:
+        image = Image.fromarray(image, "RGBA")
+        if image.size != (width, height):
+            image = image.resize((width, height))
+        yield zorder, image
+
+
+def render_raster(params: MoonPngParams, validated_paths: list, profile: str = "png") -> bytes:
+    """
+    Renderiza contourf sem matplotlib: amostra o campo na resolução de
+    saída, classifica pelos níveis e pinta pela tabela de cores. Os detalhes
+    do mapa vêm do cache de camadas do mapa base.
+    """
+    dataset = None
+    try:
+        extent = get_bbox(params)
+        read_extent = mask_utils.get_mask_extent(params.mask, extent, pad=1) if params.mask else extent
+        with metrics.stage("aggregate"):
+            dataset = aggregations.aggregate(validated_paths, params, extent=read_extent)
+            dataset.load()
+        return draw_raster(params, dataset, profile)
+
+    finally:
+        if dataset is not None:
+            nc_utils.close_and_destroy(dataset)
+
+
+def draw_raster(params: MoonPngParams, dataset, profile: str = "png") -> bytes:
+    """
+    Parte do render_raster que recebe o campo já agregado.
+    """
+    extent = get_bbox(params)
+    with metrics.stage("subset"):
+        dataset = dataset.sortby("longitude").sortby("latitude")
+
+        if extent:
+            dataset = dataset.sel(
+                longitude=slice(extent[0], extent[1]),
+                latitude=slice(extent[2], extent[3]),
+            )
+
+    if params.mask:
+        # a máscara recorta o campo de novo: as coordenadas vêm do mesmo recorte
+        data, lons, lats, extent = mask_utils.get_masked_data(dataset, params.mask, extent=extent, pad=1)
+        lons, lats = lons[0], lats[:, 0]
+    else:
+        data, lons, lats = dataset.values, dataset.longitude.values, dataset.latitude.values
+
+    lons = lons.astype("float64")
+    lats = lats.astype("float64")
+    if not extent:
+        extent = [lons[0], lons[-1], lats[0], lats[-1]]
+
+    with metrics.stage("plot"):
+        width, height = downsample_utils.axes_pixels(extent, params.dpi, FIGURE_SIZE)
+        out_lons = extent[0] + (np.arange(width) + 0.5) * (extent[1] - extent[0]) / width
+        out_lats = extent[3] - (np.arange(height) + 0.5) * (extent[3] - extent[2]) / height
+
+        levels, colors = raster.get_style(params, data)
+        field = raster.resample(data, lons, lats, out_lons, out_lats)
+        image = raster.to_image(raster.classify(field, levels), colors)
+
+        if params.details:
+            # contourf fica no zorder 1; camadas com o mesmo zorder foram
+            # adicionadas depois dele, então ficam por cima
+            canvas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+            above = []
+            for zorder, layer in _basemap_layers(params, extent, width, height):
+                if zorder < 1:
+                    canvas.alpha_composite(layer)
+                else:
+                    above.append(layer)
+            canvas.alpha_composite(image.convert("RGBA"))
+            for layer in above:
+                canvas.alpha_composite(layer)
+            image = canvas
+
+    return encode.encode_image(image, profile)
@@ -0,0 +1,210 @@
+import fcntl
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Diretório dos arquivos de lock/resultado compartilhados entre os workers
+LOCK_DIR = os.environ.get(
+    "MOONPNG_SINGLEFLIGHT_DIR", os.path.join(tempfile.gettempdir(), "moonpng-singleflight")
+)
+# Tempo máximo que um seguidor espera pelo líder antes de renderizar sozinho
+LOCK_TIMEOUT = float(os.environ.get("MOONPNG_SINGLEFLIGHT_TIMEOUT", 60))
+# Por quanto tempo o arquivo de resultado do líder é aproveitado
+RESULT_TTL = float(os.environ.get("MOONPNG_SINGLEFLIGHT_RESULT_TTL", 30))
+POLL_INTERVAL = 0.05
+CLEANUP_EVERY = 100
+
+_inflight = {}
+_lock = threading.Lock()
+_runs = 0
+
+
+def _read_result(path):
+    try:
+        if time.time() - os.path.getmtime(path) > RESULT_TTL:
+            return None
+        with open(path, "rb") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def _write_result(path, data):
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=LOCK_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning({"message": "falha ao gravar resultado do single-flight", "error": str(e)})
+
+
+def _acquire(lock_file, deadline):
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+
+
+def _same_file(lock_file, path):
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(lock_file.fileno())
+    return (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino)
+
+
+def _open_lock(path):
+    """
+    Abre e trava o arquivo de lock. A limpeza só remove locks que ela mesma
+    travou; quem abriu o arquivo antes da remoção percebe, depois de travar,
+    que ele não está mais no caminho e tenta de novo com o arquivo novo.
+    Retorna o arquivo travado, ou None no timeout.
+    """
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        lock_file = open(path, "ab")
+        if not _acquire(lock_file, deadline):
+            lock_file.close()
+            return None
+        if _same_file(lock_file, path):
+            return lock_file
+        lock_file.close()
+
+
+def try_lock(name):
+    """
+    Trava, sem esperar, o lock `name` compartilhado entre os workers da
+    máquina. Retorna o arquivo travado (o lock dura enquanto ele ficar
+    aberto) ou None se outro processo já o tem.
+    """
+    path = os.path.join(LOCK_DIR, f"{name}.lock")
+    try:
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        lock_file = open(path, "ab")
+    except OSError as e:
+        logger.warning({"message": "falha ao abrir lock", "name": name, "error": str(e)})
+        return None
+
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    # removido pela limpeza entre o open e o flock
+    if not _same_file(lock_file, path):
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _do_across_workers(key, fn):
+    """
+    Coordena os workers por um arquivo de lock: o primeiro renderiza e grava o
+    resultado, os demais esperam o lock e leem esse arquivo.
+    """
+    try:
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        lock_file = _open_lock(os.path.join(LOCK_DIR, f"{key}.lock"))
+    except OSError as e:
+        logger.warning({"message": "single-flight sem lock entre workers", "error": str(e)})
+        return fn()
+
+    if lock_file is None:
+        logger.warning({"message": "timeout aguardando single-flight", "key": key})
+        return fn()
+
+    result_path = os.path.join(LOCK_DIR, f"{key}.result")
+    with lock_file:
+        try:
+            # Resultado produzido por outro worker enquanto esperávamos
+            data = _read_result(result_path)
+            if data is not None:
+                return data
+
+            data = fn()
+            _write_result(result_path, data)
+            return data
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def do(key, fn, across_workers=True):
+    """
+    Executa `fn` uma única vez por chave entre requisições concorrentes.
+    Quem chega enquanto a execução está em andamento recebe o mesmo resultado.
+    Com `across_workers=False` a coordenação fica só no processo, e o
+    resultado não precisa ser bytes.
+    """
+    global _runs
+
+    with _lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not leader:
+        return future.result()
+
+    _runs += 1
+    if _runs % CLEANUP_EVERY == 0:
+        cleanup()
+
+    try:
+        data = _do_across_workers(key, fn) if across_workers else fn()
+        future.set_result(data)
+        return data
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+def _remove_lock(path):
+    # só remove o lock que conseguir travar: ninguém o está usando
+    with open(path, "rb") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        if _same_file(lock_file, path):
+            os.remove(path)
+
+
+def cleanup():
+    """
+    Remove arquivos de resultado e de lock antigos. Um lock só é removido
+    se estiver livre, e travado durante a remoção.
+    """
+    now = time.time()
+    try:
+        names = os.listdir(LOCK_DIR)
+    except OSError:
+        return
+
+    for name in names:
+        path = os.path.join(LOCK_DIR, name)
+        try:
+            if now - os.path.getmtime(path) <= max(RESULT_TTL, LOCK_TIMEOUT) * 2:
+                continue
+            if name.endswith(".lock"):
+                _remove_lock(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
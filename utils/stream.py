@@ -0,0 +1,125 @@
+import asyncio
+import mimetypes
+import os
+import shutil
+import zipfile
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Intervalo entre as verificações de arquivos prontos
+STREAM_POLL_SECONDS = 0.05
+
+BOUNDARY = "moonpng-frame"
+# Respostas com várias imagens, enviadas à medida que ficam prontas
+STREAM_FORMATS = ["zip", "multipart"]
+
+STREAM_MEDIA_TYPES = {
+    "zip": "application/zip",
+    "multipart": f"multipart/mixed; boundary={BOUNDARY}",
+}
+
+
+def write_file(directory, index, name, data):
+    """
+    Grava um resultado no diretório com escrita atômica. O índice no nome
+    mantém a ordem de chegada para quem lê o diretório.
+    """
+    temp_path = os.path.join(directory, f".{index:05d}_{name}")
+    with open(temp_path, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, os.path.join(directory, f"{index:05d}_{name}"))
+
+
+def _ready_files(directory):
+    return sorted(name for name in os.listdir(directory) if not name.startswith("."))
+
+
+async def wait_first_file(task, directory):
+    """
+    Espera o primeiro arquivo ou o fim da tarefa, para que erros de
+    validação ainda saiam como resposta de erro, antes do stream começar.
+    """
+    while not task.done() and not _ready_files(directory):
+        await asyncio.sleep(STREAM_POLL_SECONDS)
+    if task.done() and task.exception() is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+        task.result()
+
+
+class _ChunkWriter:
+    """
+    Destino do ZipFile que só acumula os bytes escritos, para enviá-los aos
+    pedaços (o ZipFile aceita arquivos sem seek).
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _part(name, data):
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    header = (
+        f"--{BOUNDARY}\r\n"
+        f"Content-Type: {media_type}\r\n"
+        f'Content-Disposition: attachment; filename="{name}"\r\n'
+        f"Content-Length: {len(data)}\r\n\r\n"
+    )
+    return header.encode() + data + b"\r\n"
+
+
+async def stream_files(task, directory, fmt):
+    """
+    Envia os arquivos gravados por write_file à medida que aparecem, num ZIP
+    ou num multipart/mixed, e apaga o diretório no final. Se a tarefa falhar
+    no meio, o stream é interrompido sem ser fechado.
+    """
+    writer = _ChunkWriter()
+    archive = zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED) if fmt == "zip" else None
+    sent = 0
+    try:
+        while True:
+            done = task.done()
+            names = _ready_files(directory)
+            for name in names[sent:]:
+                with open(os.path.join(directory, name), "rb") as file:
+                    data = file.read()
+                filename = name.split("_", 1)[1]
+                if archive is not None:
+                    archive.writestr(filename, data)
+                    yield writer.take()
+                else:
+                    yield _part(filename, data)
+            sent = len(names)
+            if done:
+                break
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+
+        if task.exception() is not None:
+            logger.error({"message": "stream interrompido", "files": sent, "error": str(task.exception())})
+            task.result()
+
+        if archive is not None:
+            archive.close()
+            yield writer.take()
+        else:
+            yield f"--{BOUNDARY}--\r\n".encode()
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        if not task.done():
+            # cliente desconectou: a tarefa para ao não achar o diretório
+            task.add_done_callback(lambda task: task.exception())
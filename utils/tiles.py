@@ -0,0 +1,208 @@
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import orjson
+from fastapi import HTTPException
+
+import utils.aggregations as aggregations
+import utils.assets as assets
+import utils.cache as cache
+import utils.encode as encode
+import utils.mask as mask_utils
+import utils.metrics as metrics
+import utils.netcdf as nc_utils
+import utils.raster as raster
+import utils.singleflight as singleflight
+from models.params import MoonPngParams
+
+TILE_SIZE = 256
+MAX_ZOOM = 18
+# Campos agregados mantidos em memória (por renderizador) para cortar os
+# tiles. Campos maiores que isso não ficam em memória: cada tile lê só a
+# própria janela
+FIELD_CACHE_MAX_BYTES = int(os.environ.get("MOONPNG_FIELD_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+OVERSIZED_CACHE_SIZE = 1024
+
+# Campos que definem o dado (produto, agregação e máscara; o tempo vem dos
+# arquivos); o resto é estilo
+FIELD_PARAMS = ["kind", "model", "variable", "member", "source", "aggregation", "mask"]
+STYLE_PARAMS = ["levels", "colorbar"]
+# Parâmetros de desenho que os tiles não aplicam, com o único valor aceito:
+# pedidos com outro valor são recusados em vez de receberem um tile que não
+# corresponde a eles
+UNSUPPORTED_PARAMS = {"renderer": "raster", "contour": False, "shapecontours": None}
+
+_fields = OrderedDict()
+_fields_bytes = 0
+_oversized = set()
+_lock = threading.Lock()
+
+
+def _hash(payload):
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+def field_key(params: MoonPngParams, validated_paths):
+    data = cache.canonicalize(params)
+    return _hash({
+        "version": cache.CACHE_VERSION,
+        "field": {name: data.get(name) for name in FIELD_PARAMS},
+        # versão do geojson: um arquivo alterado não reaproveita o campo
+        "mask_version": assets.get_shape(params.mask)["mtime"] if params.mask else None,
+        "files": cache.get_file_identities(validated_paths),
+    })
+
+
+def tile_key(field, params: MoonPngParams, z, x, y, profile="png"):
+    data = cache.canonicalize(params)
+    return _hash({
+        "field": field,
+        "style": {name: data.get(name) for name in STYLE_PARAMS},
+        "tile": [z, x, y],
+        "profile": profile,
+    })
+
+
+def _load_field(params, validated_paths, extent=None):
+    """
+    Agrega o campo completo (ou só a janela do extent) e ordena as
+    coordenadas de forma crescente com longitudes em -180..180.
+    """
+    with metrics.stage("aggregate"):
+        dataset = aggregations.aggregate(validated_paths, params, extent=extent)
+        try:
+            dataset = dataset.load()
+        finally:
+            nc_utils.close_and_destroy(dataset)
+
+    lons = dataset.longitude.values.astype("float64")
+    if lons.max() > 180:
+        dataset = dataset.assign_coords(longitude=np.where(lons > 180, lons - 360, lons))
+    dataset = dataset.sortby("longitude").sortby("latitude")
+
+    lons = dataset.longitude.values.astype("float64")
+    lats = dataset.latitude.values.astype("float64")
+    data = dataset.transpose("latitude", "longitude").values.astype("float32")
+    if params.mask:
+        # fora da máscara vira NaN, que os tiles deixam transparente
+        data = np.where(mask_utils.get_mask(params.mask, lons, lats), data, np.float32("nan"))
+    field = (data, lons, lats)
+    for array in field:
+        array.setflags(write=False)
+    return field
+
+
+def _fields_set(key, field):
+    global _fields_bytes
+
+    size = sum(array.nbytes for array in field)
+    if size > FIELD_CACHE_MAX_BYTES:
+        with _lock:
+            if len(_oversized) >= OVERSIZED_CACHE_SIZE:
+                _oversized.clear()
+            _oversized.add(key)
+        return
+
+    with _lock:
+        if key in _fields:
+            _fields_bytes -= sum(array.nbytes for array in _fields.pop(key))
+        _fields[key] = field
+        _fields_bytes += size
+
+        while _fields_bytes > FIELD_CACHE_MAX_BYTES:
+            _, evicted = _fields.popitem(last=False)
+            _fields_bytes -= sum(array.nbytes for array in evicted)
+
+
+def tile_extent(z, x, y):
+    """
+    [lon_min, lon_max, lat_min, lat_max] dos centros dos pixels de um tile.
+    """
+    lons, lats = tile_bounds(z, x, y)
+    return [float(lons[0]), float(lons[-1]), float(lats[-1]), float(lats[0])]
+
+
+def get_field(key, params: MoonPngParams, validated_paths, z, x, y):
+    """
+    Campo agregado (dados, lons, lats), carregado uma vez por produto,
+    tempo, agregação e máscara. Campos que não cabem no cache são lidos de
+    novo a cada tile, só na janela do tile (z, x, y).
+    """
+    with _lock:
+        field = _fields.get(key)
+        if field is not None:
+            _fields.move_to_end(key)
+            return field
+        oversized = key in _oversized
+
+    if oversized:
+        return _load_field(params, validated_paths, tile_extent(z, x, y))
+
+    def load():
+        field = _load_field(params, validated_paths)
+        _fields_set(key, field)
+        return field
+
+    return singleflight.do(f"field-{key}", load, across_workers=False)
+
+
+def tile_bounds(z, x, y):
+    """
+    Coordenadas (lon, lat) dos centros dos pixels de um tile Web Mercator.
+    """
+    n = 2 ** z
+    pixels = (np.arange(TILE_SIZE) + 0.5) / (TILE_SIZE * n)
+    lons = (x / n + pixels) * 360 - 180
+    lats = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * (y / n + pixels)))))
+    return lons, lats
+
+
+def get_tile(params: MoonPngParams, validated_paths, key, z, x, y, profile="png") -> bytes:
+    """
+    Agrega (ou reaproveita) o campo e corta o tile. Roda no pool de
+    renderização, com o cache de campos do próprio renderizador.
+    """
+    return render_tile(get_field(key, params, validated_paths, z, x, y), params, z, x, y, profile)
+
+
+def render_tile(field, params: MoonPngParams, z, x, y, profile="png") -> bytes:
+    data, lons, lats = field
+    tile_lons, tile_lats = tile_bounds(z, x, y)
+    ix, inside_x = raster.nearest_index(lons, tile_lons)
+    iy, inside_y = raster.nearest_index(lats, tile_lats)
+
+    levels, colors = raster.get_style(params, data)
+    index = raster.classify(data[iy[:, None], ix[None, :]], levels)
+    index[~(inside_y[:, None] & inside_x[None, :])] = len(levels) - 1
+
+    return encode.encode_image(raster.to_image(index, colors), profile)
+
+
+def validate_params(params: MoonPngParams, names=None):
+    """
+    Recusa os parâmetros de UNSUPPORTED_PARAMS pedidos com outro valor.
+    `names` são os parâmetros enviados na requisição: o modelo vindo da
+    query tem todos os campos preenchidos, inclusive os padrões.
+    """
+    names = params.model_fields_set if names is None else set(names)
+    unsupported = [
+        name for name, value in UNSUPPORTED_PARAMS.items()
+        if name in names and getattr(params, name) != value
+    ]
+    if unsupported:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Parâmetros não suportados nos tiles.", "params": unsupported},
+        )
+
+
+def validate_tile(z, x, y):
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Tile inválido.", "z": z, "x": x, "y": y},
+        )
@@ -0,0 +1,117 @@
+import os
+import time
+
+import utils.metrics as metrics
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Desliga o aquecimento (workers e renderizadores)
+WARMUP_ENABLED = os.environ.get("MOONPNG_WARMUP_ENABLED", "1") == "1"
+# Recortes desenhados no aquecimento: o mapa base de cada um fica no cache
+# de camadas (separados por vírgula, nomes do BBOX_DB)
+WARMUP_EXTENTS = [extent for extent in os.environ.get("MOONPNG_WARMUP_EXTENTS", "BR").split(",") if extent]
+
+_warmed = False
+
+
+def load_modules():
+    """
+    Importa os módulos de renderização (matplotlib, cartopy, shapely...).
+    """
+    import utils.animation
+    import utils.render
+    import utils.tiles
+
+
+def load_features():
+    """
+    Lê as geometrias do Natural Earth dos detalhes padrão que não estão no
+    acervo local (utils/features.py); o cartopy as guarda em memória para o
+    resto do processo. As do acervo são lidas por região, no desenho.
+    """
+    from types import SimpleNamespace
+
+    import cartopy.feature as cfeature
+
+    import utils.plot as plot_utils
+
+    for ocean in (False, True):
+        config = SimpleNamespace(details=True, ocean=ocean, shapecontours=None)
+        for feature, _ in plot_utils.get_detail_features(config):
+            if isinstance(feature, cfeature.NaturalEarthFeature):
+                tuple(feature.geometries())
+
+
+def draw(extent):
+    """
+    Renderiza um campo sintético com os parâmetros padrão: carrega as
+    fontes, a barra de cores e as gridlines e rasteriza o mapa base do
+    recorte.
+    """
+    import numpy as np
+    import xarray as xr
+
+    import utils.encode as encode
+    import utils.render as render_utils
+    from models.params import MoonPngParams
+    from utils.bounding_box import BBOX_DB
+
+    lon_min, lon_max, lat_min, lat_max = BBOX_DB[extent]
+    lons = np.linspace(lon_min - 1, lon_max + 1, 64)
+    lats = np.linspace(lat_min - 1, lat_max + 1, 64)
+    field = xr.DataArray(
+        np.add.outer(np.sin(np.radians(lats) * 8), np.cos(np.radians(lons) * 8)),
+        coords={"latitude": lats, "longitude": lons},
+        dims=("latitude", "longitude"),
+        name="warmup",
+    )
+    # sem validação: só os campos de desenho importam
+    params = MoonPngParams.model_construct(kind="warmup", model="warmup", variable="warmup", contourf=True, extent=extent)
+    render_utils.render_field(params, field, encode.negotiate(None))
+
+
+def warm():
+    """
+    Deixa o processo pronto para a primeira requisição: módulos, geometrias,
+    colorbars e geojsons do registro, fontes e mapas base. Roda uma vez por
+    processo; um processo criado por fork de outro já aquecido (workers com
+    preload_app, que renderizam em threads, e renderizadores do forkserver)
+    herda tudo e não repete. Renderizadores criados por spawn não herdam
+    nada: cada um roda o seu aquecimento.
+
+    Não usa dask, netCDF nem threads: pode rodar no master do gunicorn antes
+    do fork dos workers.
+    """
+    global _warmed
+
+    if _warmed or not WARMUP_ENABLED:
+        return
+
+    import utils.assets as assets
+
+    steps = [
+        ("modules", load_modules),
+        ("features", load_features),
+        ("assets", assets.load_all),
+        *[(f"draw_{extent}", lambda extent=extent: draw(extent)) for extent in WARMUP_EXTENTS],
+    ]
+
+    timings = {}
+    started = time.perf_counter()
+    with metrics.disabled():
+        for name, step in steps:
+            step_started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.warning({"message": "falha no aquecimento", "step": name, "error": str(e)})
+            timings[name] = round((time.perf_counter() - step_started) * 1000, 2)
+    _warmed = True
+
+    logger.info({
+        "message": "aquecimento concluído",
+        "pid": os.getpid(),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        "steps_ms": timings,
+    })